@@ -1,7 +1,11 @@
-from importlib.metadata import PackageNotFoundError, metadata
+from __future__ import annotations
+
+from typing import Any
 
 
 def get_version() -> str:
+    from importlib.metadata import PackageNotFoundError, metadata
+
     try:
         distribution = metadata(__name__)
     except PackageNotFoundError:
@@ -10,4 +14,10 @@ def get_version() -> str:
         return distribution["Version"]
 
 
-__version__ = get_version()
+def __getattr__(name: str) -> Any:
+    # The version is resolved on first access, reading the package metadata is
+    # too slow to be done by every hook process at startup.
+    if name == "__version__":
+        globals()["__version__"] = get_version()
+        return globals()["__version__"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
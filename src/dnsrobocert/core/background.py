@@ -1,75 +1,200 @@
 from __future__ import annotations
 
+import hashlib
+import heapq
 import logging
+import os
 import threading
 import time
 from collections.abc import Iterator
 from contextlib import contextmanager
-from random import random
+from datetime import datetime
 
 import coloredlogs
-import schedule
 
-from dnsrobocert.core import certbot
+from dnsrobocert.core import certbot, config, cron, index, state, tracing
 
 LOGGER = logging.getLogger(__name__)
 coloredlogs.install(logger=LOGGER)
 
+# Renewals of the certificates are spread over this window, so certificates issued
+# at the same time are not all renewed at once.
+_JITTER_WINDOW = 21600
+# Delay before trying again to issue a certificate that is missing or still due.
+_RETRY_DELAY = 3600
+# The queue is rebuilt at least at this interval, to follow changes of the wall clock
+# (eg. host suspension) and of the certificates made outside DNSroboCert.
+_MAX_SLEEP = 3600
+
+
+class Scheduler(threading.Thread):
+    """
+    Renew each certificate when it is due. A priority queue holds the lineages ordered
+    by their renewal time, computed from the expiration of the current certificate,
+    the acme.renewal_fraction parameter and a per-lineage jitter, and optionally
+    delayed to the next time allowed by the acme.crontab_renew pattern.
+    The thread sleeps until the first lineage of the queue is due.
+    """
+
+    def __init__(
+        self, config_path: str, directory_path: str, lock: threading.Lock
+    ) -> None:
+        super().__init__(name="dnsrobocert-scheduler", daemon=True)
+        self._config_path = config_path
+        self._directory_path = directory_path
+        self._lock = lock
+        self._queue: list[tuple[float, str]] = []
+        self._retries: dict[str, float] = {}
+        self._condition = threading.Condition()
+        self._refresh = True
+        self._stopped = False
+
+    def refresh(self) -> None:
+        """
+        Rebuild the queue, typically after the configuration has been processed.
+        """
+        with self._condition:
+            self._refresh = True
+            self._condition.notify()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def queue(self) -> list[tuple[float, str]]:
+        """
+        Return a snapshot of the queue, ordered by renewal time.
+        """
+        # The queue is only read or modified while holding the condition, as the
+        # heap is updated in place by the scheduler thread.
+        with self._condition:
+            return sorted(self._queue)
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+
+                if not self._refresh:
+                    timeout = (
+                        self._queue[0][0] - time.time() if self._queue else _MAX_SLEEP
+                    )
+                    if timeout > 0:
+                        notified = self._condition.wait(min(timeout, _MAX_SLEEP))
+                        if not notified and timeout >= _MAX_SLEEP:
+                            self._refresh = True
+                        continue
+
+                refresh = self._refresh
+                self._refresh = False
+
+            try:
+                if refresh:
+                    self._rebuild()
+                else:
+                    self._renew_due()
+            except BaseException as error:
+                LOGGER.error(f"An error occurred during automated renewal:\n{error}")
+                with self._condition:
+                    self._queue = []
+
+    def _rebuild(self) -> None:
+        queue: list[tuple[float, str]] = []
+        now = time.time()
+
+        dnsrobocert_config = (
+            config.load(self._config_path)
+            if os.path.exists(self._config_path)
+            else None
+        )
+        if dnsrobocert_config:
+            acme = dnsrobocert_config.get("acme", {})
+            renewal_fraction = acme.get("renewal_fraction", index.RENEWAL_FRACTION)
+            crontab = (
+                cron.Crontab(acme["crontab_renew"])
+                if acme.get("crontab_renew")
+                else None
+            )
+            lineages_index = index.build(self._directory_path)
+            store = state.open_store(self._directory_path)
+
+            for certificate in dnsrobocert_config.get("certificates", []):
+                lineage = config.get_lineage(certificate)
+                info = lineages_index.get(lineage)
+                if info:
+                    lineage_state = store.get(lineage)
+                    # The lineage is due for its renewal, or for a periodic check by
+                    # Certbot, whichever comes first.
+                    due = min(
+                        index.renewal_due(info, renewal_fraction).timestamp(),
+                        index.check_due(
+                            info, lineage_state and lineage_state.last_attempt
+                        ),
+                    ) + _jitter(lineage)
+                else:
+                    # Missing certificates are created when the configuration is
+                    # processed, they are retried here only if this creation failed.
+                    due = self._retries.setdefault(lineage, now + _RETRY_DELAY)
+                due = max(due, self._retries.get(lineage, 0))
+                # Failing lineages are retried after their backoff.
+                due = max(
+                    due,
+                    store.backoff_until(
+                        lineage, state.config_digest(dnsrobocert_config, certificate)
+                    ),
+                )
+                if crontab:
+                    due = crontab.next(due)
+                queue.append((due, lineage))
+
+        heapq.heapify(queue)
+        with self._condition:
+            self._queue = queue
+        self._retries = {
+            lineage: retry for lineage, retry in self._retries.items() if retry > now
+        }
+
+        if queue:
+            due, lineage = queue[0]
+            LOGGER.info(
+                f"Next automated renewal: certificate {lineage} "
+                f"on {datetime.fromtimestamp(due).isoformat()}."
+            )
+
+    def _renew_due(self) -> None:
+        now = time.time()
+        lineages = []
+        with self._condition:
+            while self._queue and self._queue[0][0] <= now:
+                lineages.append(heapq.heappop(self._queue)[1])
+
+        LOGGER.info(
+            f"Automated execution: renew certificate(s) {', '.join(lineages)} if needed."
+        )
+        with tracing.span("renew", lineages=",".join(lineages)):
+            certbot.renew(self._config_path, self._directory_path, self._lock, lineages)
+
+        # Renewed certificates are due again in several weeks, failed ones are retried.
+        self._retries.update({lineage: now + _RETRY_DELAY for lineage in lineages})
+        self._rebuild()
+
 
 @contextmanager
 def worker(
     config_path: str, directory_path: str, lock: threading.Lock
-) -> Iterator[None]:
-    stop_thread = threading.Event()
-
-    schedule.every().day.at("12:00").do(
-        _renew_job,
-        config_path=config_path,
-        directory_path=directory_path,
-        lock=lock,
-        stop_thread=stop_thread,
-    )
-    schedule.every().day.at("00:00").do(
-        _renew_job,
-        config_path=config_path,
-        directory_path=directory_path,
-        lock=lock,
-        stop_thread=stop_thread,
-    )
-
-    _launch_background_jobs(stop_thread)
+) -> Iterator[Scheduler]:
+    scheduler = Scheduler(config_path, directory_path, lock)
+    scheduler.start()
 
     try:
-        yield
+        yield scheduler
     finally:
-        stop_thread.set()
-
-
-def _launch_background_jobs(stop_thread: threading.Event, interval: int = 1) -> None:
-    class ScheduleThread(threading.Thread):
-        @classmethod
-        def run(cls) -> None:
-            while not stop_thread.is_set():
-                schedule.run_pending()
-                time.sleep(interval)
-
-    continuous_thread = ScheduleThread()
-    continuous_thread.start()
-
-
-def _renew_job(
-    config_path: str,
-    directory_path: str,
-    lock: threading.Lock,
-    stop_thread: threading.Event,
-) -> None:
-    random_delay_seconds = 21600  # Random delay up to 12 hours
-    wait_time = int(random() * random_delay_seconds)
-
-    LOGGER.info("Automated execution: renew certificates if needed.")
-    LOGGER.info(f"Random wait for this execution: {wait_time} seconds")
+        scheduler.stop()
 
-    interrupted = stop_thread.wait(wait_time)
 
-    if not interrupted:
-        certbot.renew(config_path, directory_path, lock)
+def _jitter(lineage: str) -> float:
+    # Stable across restarts, so the renewal of a certificate is never brought forward.
+    digest = hashlib.sha256(lineage.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2**32 * _JITTER_WINDOW
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from dnsrobocert.core import utils
+
+try:
+    import fcntl
+
+    POSIX_MODE = True
+except ImportError:
+    POSIX_MODE = False
+
+# Environment variable holding the path of the resolution cache used by the hooks.
+CACHE_ENV = "DNSROBOCERT_RESOLUTION_CACHE"
+
+DEFAULT_TTL = 86400
+
+
+class ResolutionCache:
+    """
+    A small on-disk cache for DNS resolutions (canonical names, zones) shared between
+    the hooks processes. Entries expire after their TTL, and can be invalidated when
+    they lead to errors. If no path is given, the cache is disabled.
+    A cache hit only reads the file: the statistics are counted in memory, and written
+    along with the next change of the file, or by flush.
+    """
+
+    def __init__(self, path: str | None, ttl: float = DEFAULT_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._pending_stats: dict[str, int] = {}
+
+    def lookup(self, kind: str, key: str, resolve: Callable[[], str]) -> str:
+        if not self.path:
+            return resolve()
+
+        entry = self._load()["entries"].get(f"{kind}:{key}")
+        if entry and entry["expires"] > time.time():
+            self._count("hits")
+            return entry["value"]
+
+        value = resolve()
+        self._count("misses")
+        with self._update() as data:
+            data["entries"][f"{kind}:{key}"] = {
+                "value": value,
+                "expires": time.time() + self.ttl,
+            }
+
+        return value
+
+    def invalidate(self, kind: str, key: str) -> None:
+        if not self.path:
+            return
+
+        with self._update() as data:
+            if data["entries"].pop(f"{kind}:{key}", None):
+                data["stats"]["invalidations"] = (
+                    data["stats"].get("invalidations", 0) + 1
+                )
+
+    def flush(self) -> None:
+        """
+        Write the statistics counted in memory since the last change of the file.
+        """
+        if self.path and self._pending_stats:
+            with self._update():
+                pass
+
+    def stats(self) -> dict[str, int]:
+        stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        if self.path:
+            stats.update(self._load()["stats"])
+        for name, count in self._pending_stats.items():
+            stats[name] += count
+        return stats
+
+    def _count(self, name: str) -> None:
+        self._pending_stats[name] = self._pending_stats.get(name, 0) + 1
+
+    def _load(self) -> dict[str, Any]:
+        try:
+            with open(self.path) as file_h:  # type: ignore[arg-type]
+                data = json.load(file_h)
+        except (OSError, ValueError):
+            data = {}
+
+        data.setdefault("entries", {})
+        data.setdefault("stats", {})
+        return data
+
+    @contextmanager
+    def _update(self) -> Iterator[dict[str, Any]]:
+        path = str(self.path)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        with open(f"{path}.lock", "a") as lock_h:
+            if POSIX_MODE:
+                fcntl.flock(lock_h, fcntl.LOCK_EX)
+
+            data = self._load()
+            now = time.time()
+            data["entries"] = {
+                key: entry
+                for key, entry in data["entries"].items()
+                if entry["expires"] > now
+            }
+
+            yield data
+
+            for name, count in self._pending_stats.items():
+                data["stats"][name] = data["stats"].get(name, 0) + count
+            self._pending_stats = {}
+            utils.atomic_write(path, json.dumps(data).encode("utf-8"))
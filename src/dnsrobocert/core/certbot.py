@@ -2,17 +2,43 @@
 # -*- encoding: utf-8 -*-
 from __future__ import annotations
 
+import contextvars
 import logging
 import os
-import re
+import shutil
 import sys
 import threading
+import time
+import urllib.parse
+from collections.abc import Collection, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any
 
 import coloredlogs
-from certbot import main
 
 import dnsrobocert
-from dnsrobocert.core import config, utils
+from dnsrobocert.core import (
+    cache,
+    config,
+    hooks,
+    index,
+    metrics,
+    ratelimits,
+    state,
+    suffixes,
+    tracing,
+    utils,
+    workers,
+)
+
+try:
+    import fcntl
+
+    POSIX_MODE = True
+except ImportError:
+    POSIX_MODE = False
 
 LOGGER = logging.getLogger(__name__)
 coloredlogs.install(logger=LOGGER)
@@ -25,6 +51,36 @@ _DEFAULT_FLAGS = [
     "ISRG Root X1",
 ]
 
+# Environment variable used to tell a certbot process spawned by DNSroboCert that the
+# config directory is already protected by the per-lineage locks held by the daemon.
+_SHARED_CONFIG_DIR_ENV = "DNSROBOCERT_SHARED_CONFIG_DIR"
+
+_DEPLOY_QUEUE = "deploy-queue.jsonl"
+_SUFFIX_LIST = "public_suffix_list.dat"
+_REVOCATIONS = "revocations.json"
+_ACCOUNTS = "accounts.json"
+# Same as LE_REUSE_SERVERS in Certbot: accounts of the ACME v1 servers of Let's Encrypt
+# are reused for their ACME v2 servers.
+_ACCOUNTS_REUSE_SERVERS = {
+    "acme-v02.api.letsencrypt.org/directory": "acme-v01.api.letsencrypt.org/directory",
+    "acme-staging-v02.api.letsencrypt.org/directory": (
+        "acme-staging.api.letsencrypt.org/directory"
+    ),
+}
+
+# Maximum number of certificates revoked at the same time by a sweep.
+_MAX_PARALLEL_REVOCATIONS = 4
+# A failed revocation is retried in a later pass after an exponential backoff starting
+# from this delay (in seconds), and abandoned after the given number of attempts.
+_REVOCATION_RETRY_DELAY = 3600
+_MAX_REVOCATION_ATTEMPTS = 5
+
+_PASS_LOCK_FILE = "issue.lock"
+_PASS_LOCK = threading.Lock()
+
+_LINEAGE_LOCKS: dict[str, threading.Lock] = {}
+_LINEAGE_LOCKS_GUARD = threading.Lock()
+
 
 def account(config_path: str, directory_path: str, lock: threading.Lock) -> None:
     dnsrobocert_config = config.load(config_path)
@@ -38,29 +94,55 @@ def account(config_path: str, directory_path: str, lock: threading.Lock) -> None
         return
 
     url = config.get_acme_url(dnsrobocert_config)
+    # Certbot does not store the email of the accounts, so DNSroboCert keeps track of
+    # the email registered for each ACME server.
+    accounts_path = utils.state_path(directory_path, _ACCOUNTS)
+    accounts = utils.load_json(accounts_path)
 
-    utils.execute(
-        [
-            sys.executable,
-            "-m",
-            "dnsrobocert.core.certbot",
-            "register",
-            *_DEFAULT_FLAGS,
-            "--config-dir",
-            directory_path,
-            "--work-dir",
-            os.path.join(directory_path, "workdir"),
-            "--logs-dir",
-            os.path.join(directory_path, "logs"),
-            "-m",
-            email,
-            "--agree-tos",
-            "--server",
-            url,
-        ],
-        check=False,
-        lock=lock,
-    )
+    if not _account_exists(directory_path, url):
+        action = "registered"
+        args = ["register", "--agree-tos"]
+    elif accounts.get(url, email) != email:
+        action = "updated"
+        args = ["update_account"]
+    else:
+        LOGGER.info(f"ACME account for {email} on {url} already exists.")
+        if url not in accounts:
+            accounts[url] = email
+            utils.save_json(accounts_path, accounts)
+        return
+
+    try:
+        _execute(
+            dnsrobocert_config,
+            [
+                *args,
+                *_DEFAULT_FLAGS,
+                "--config-dir",
+                directory_path,
+                "--work-dir",
+                os.path.join(directory_path, "workdir"),
+                "--logs-dir",
+                os.path.join(directory_path, "logs"),
+                "-m",
+                email,
+                "--server",
+                url,
+            ],
+            lock=lock,
+        )
+    except Exception as e:
+        # Like before, a registration refused by Certbot because an account already
+        # exists for the ACME server is not an error: this account is adopted as is.
+        if action != "registered" or not _account_exists(directory_path, url):
+            LOGGER.error(
+                f"ACME account for {email} on {url} could not be {action}: {e}"
+            )
+            return
+        LOGGER.info(f"ACME account on {url} already exists.")
+
+    accounts[url] = email
+    utils.save_json(accounts_path, accounts)
 
 
 def certonly(
@@ -76,7 +158,8 @@ def certonly(
     if not domains:
         return
 
-    url = config.get_acme_url(config.load(config_path))
+    dnsrobocert_config = config.load(config_path)
+    url = config.get_acme_url(dnsrobocert_config)
 
     additional_params = []
     if force_renew:
@@ -90,19 +173,30 @@ def certonly(
         additional_params.append("-d")
         additional_params.append(domain)
 
-    utils.execute(
+    workspace = os.path.join(directory_path, "workdir", lineage)
+    env = os.environ.copy()
+    env[_SHARED_CONFIG_DIR_ENV] = directory_path
+    env[hooks.WORKSPACE_ENV] = workspace
+    env[cache.CACHE_ENV] = utils.state_path(directory_path, "resolution-cache.json")
+    queue_path = _deploy_queue(dnsrobocert_config, directory_path)
+    if queue_path:
+        env[hooks.DEPLOY_QUEUE_ENV] = queue_path
+    suffix_list_path = _suffix_list(dnsrobocert_config, directory_path)
+    if suffix_list_path:
+        env[suffixes.SUFFIX_LIST_ENV] = suffix_list_path
+    env[state.STATE_ENV] = utils.state_path(directory_path, state.DATABASE)
+
+    _execute(
+        dnsrobocert_config,
         [
-            sys.executable,
-            "-m",
-            "dnsrobocert.core.certbot",
             "certonly",
             *_DEFAULT_FLAGS,
             "--config-dir",
             directory_path,
             "--work-dir",
-            os.path.join(directory_path, "workdir"),
+            workspace,
             "--logs-dir",
-            os.path.join(directory_path, "logs"),
+            os.path.join(directory_path, "logs", lineage),
             "--manual",
             "--preferred-challenges=dns",
             "--manual-auth-hook",
@@ -118,81 +212,364 @@ def certonly(
             lineage,
             *additional_params,
         ],
+        env=env,
         lock=lock,
     )
 
 
-def _issue(config_path: str, directory_path: str, lock: threading.Lock) -> None:
-    dnsrobocert_config = config.load(config_path)
+def _issue(
+    config_path: str,
+    directory_path: str,
+    lock: threading.Lock,
+    changes: dict[str, set[str]] | None = None,
+) -> None:
+    with _serialized(directory_path):
+        dnsrobocert_config = config.load(config_path)
 
-    if dnsrobocert_config:
-        certificates = dnsrobocert_config.get("certificates", {})
-        for certificate in certificates:
-            try:
-                lineage = config.get_lineage(certificate)
-                domains = certificate["domains"]
-                force_renew = certificate.get("force_renew", False)
+        if dnsrobocert_config:
+            certificates = dnsrobocert_config.get("certificates", {})
+            max_parallel_issuance = dnsrobocert_config.get("acme", {}).get(
+                "max_parallel_issuance", 1
+            )
+            _refresh_suffix_list(dnsrobocert_config, directory_path)
+
+            lineages_index = index.build(directory_path)
+            store = state.open_store(directory_path)
+            budget = ratelimits.Budget(dnsrobocert_config, store)
+            for lineage, info in lineages_index.items():
+                metrics.CERTIFICATE_NOT_AFTER.set(
+                    info.not_after.timestamp(), lineage=lineage
+                )
+
+            def _priority(certificate: dict[str, Any]) -> tuple[int, float]:
+                # When the budget of the rate limits is short, it goes first to the
+                # certificates closest to their expiration, and to new certificates last.
+                info = lineages_index.get(config.get_lineage(certificate))
+                return (0, info.not_after.timestamp()) if info else (1, 0)
+
+            with ThreadPoolExecutor(
+                max_workers=max_parallel_issuance,
+                thread_name_prefix="dnsrobocert-issue",
+            ) as executor:
+                for certificate in sorted(certificates, key=_priority):
+                    steps = (
+                        {"issue"}
+                        if changes is None
+                        else changes.get(config.get_lineage(certificate))
+                    )
+                    if steps:
+                        # Spans of the operations are children of the current span.
+                        executor.submit(
+                            contextvars.copy_context().run,
+                            _issue_one,
+                            config_path,
+                            directory_path,
+                            dnsrobocert_config,
+                            certificate,
+                            lineages_index,
+                            steps,
+                            store,
+                            budget,
+                        )
+
+            # Deploy actions collected for all the certificates of this pass are executed
+            # once, after all the certificates have been processed.
+            hooks.flush_deploy_actions(utils.state_path(directory_path, _DEPLOY_QUEUE))
+
+            LOGGER.info("Revoke and delete certificates if needed")
+            lineages = {config.get_lineage(certificate) for certificate in certificates}
+            # Sweeps of concurrent passes must not revoke the same certificates.
+            with lock:
+                _revoke_removed(
+                    dnsrobocert_config, directory_path, lineages, lineages_index
+                )
+
+
+def _issue_one(
+    config_path: str,
+    directory_path: str,
+    dnsrobocert_config: dict[str, Any],
+    certificate: dict[str, Any],
+    lineages_index: dict[str, index.LineageInfo],
+    steps: set[str],
+    store: state.StateStore,
+    budget: ratelimits.Budget,
+) -> None:
+    try:
+        lineage = config.get_lineage(certificate)
+        domains = certificate["domains"]
+        info = lineages_index.get(lineage)
+        renewal_fraction = dnsrobocert_config.get("acme", {}).get(
+            "renewal_fraction", index.RENEWAL_FRACTION
+        )
+        reason = index.issuance_reason(
+            info,
+            certificate,
+            config.get_acme_url(dnsrobocert_config),
+            renewal_fraction=renewal_fraction,
+        )
+        lineage_state = store.get(lineage)
+        # Renewals decided by Certbot itself (ARI, revocation) happen only if it is
+        # invoked: a lineage that is not due is still checked by Certbot periodically.
+        check = bool(
+            not reason
+            and info
+            and time.time()
+            >= index.check_due(info, lineage_state and lineage_state.last_attempt)
+        )
+        if check:
+            reason = "periodic check by Certbot"
+        digest = state.config_digest(dnsrobocert_config, certificate)
+        backoff_until = store.backoff_until(lineage, digest)
+        if "issue" in steps and reason and backoff_until > time.time():
+            LOGGER.warning(
+                f"Certificate {lineage} is failing ({reason}), skipping it until "
+                f"{datetime.fromtimestamp(backoff_until).isoformat()} "
+                f"(last error during {lineage_state and lineage_state.last_error_phase})."
+            )
+        elif "issue" in steps and reason:
+            # Domain names are case insensitive.
+            renewal = info is not None and frozenset(
+                domain.lower() for domain in info.domains
+            ) == frozenset(domain.lower() for domain in domains)
+            exceeded = budget.reserve(lineage, domains, renewal)
+            if exceeded:
+                held_until = datetime.fromtimestamp(max(exceeded.values()))
+                LOGGER.warning(
+                    f"Certificate {lineage} is held back ({reason}) until "
+                    f"{held_until.isoformat()} to respect the rate limits of the ACME "
+                    f"server: {', '.join(ratelimits.LIMITS[name].description for name in sorted(exceeded))}."
+                )
+            else:
+                # Certbot applies its own renewal window: a certificate due according
+                # to renewal_fraction would not be renewed unless it is forced.
+                force_renew = certificate.get("force_renew", False) or bool(
+                    info
+                    and datetime.now(timezone.utc)
+                    >= index.renewal_due(info, renewal_fraction)
+                )
                 reuse_key = certificate.get("reuse_key", False)
                 key_type = certificate.get("key_type", "rsa")
                 LOGGER.info(
-                    f"Handling the certificate for domain(s): {', '.join(domains)}"
+                    f"Handling the certificate for domain(s): {', '.join(domains)} ({reason})"
                 )
-                certonly(
-                    config_path,
-                    directory_path,
-                    lineage,
-                    lock,
-                    domains,
-                    force_renew=force_renew,
-                    reuse_key=reuse_key,
-                    key_type=key_type,
-                )
-            except BaseException as error:
-                LOGGER.error(
-                    f"An error occurred while processing certificate config {certificate}:\n{error}"
+                start = time.monotonic()
+                started = time.time()
+                store.start_attempt(lineage)
+                try:
+                    certonly(
+                        config_path,
+                        directory_path,
+                        lineage,
+                        _lineage_lock(lineage),
+                        domains,
+                        force_renew=force_renew,
+                        reuse_key=reuse_key,
+                        key_type=key_type,
+                    )
+                except BaseException as error:
+                    _complete_order(budget, store, lineage, started, False)
+                    store.record_failure(
+                        lineage, str(error), time.monotonic() - start, digest
+                    )
+                    raise
+                # Certbot exits successfully when it decides that nothing is due: the
+                # lineage is renewed only if its expiration actually advanced.
+                new_info = index.load(directory_path, lineage)
+                if new_info and (not info or new_info.not_after > info.not_after):
+                    _complete_order(budget, store, lineage, started, True)
+                    store.record_success(lineage, time.monotonic() - start, digest)
+                    metrics.CERTIFICATE_LAST_SUCCESS.set(time.time(), lineage=lineage)
+                    metrics.CERTIFICATE_NOT_AFTER.set(
+                        new_info.not_after.timestamp(), lineage=lineage
+                    )
+                elif check:
+                    _complete_order(budget, store, lineage, started, False)
+                    store.record_success(lineage, time.monotonic() - start, digest)
+                    LOGGER.info(f"Certificate {lineage} is not renewed by Certbot.")
+                else:
+                    # Not retried before the backoff of the failing lineages.
+                    _complete_order(budget, store, lineage, started, False)
+                    message = f"Certbot did not renew the certificate {lineage}."
+                    store.record_failure(
+                        lineage, message, time.monotonic() - start, digest
+                    )
+                    raise RuntimeError(message)
+                # The deploy settings are applied by the deploy hook of Certbot.
+                return
+        elif info and "issue" in steps:
+            LOGGER.info(
+                f"Certificate {lineage} is up to date, skipping it "
+                f"(renewal due on {index.renewal_due(info, renewal_fraction).isoformat()})."
+            )
+
+        settings = steps - {"issue"}
+        if info and settings:
+            LOGGER.info(
+                f"Applying the changed deploy settings ({', '.join(sorted(settings))}) "
+                f"of the certificate {lineage}."
+            )
+            with _lineage_lock(lineage):
+                hooks.deploy_lineage(
+                    dnsrobocert_config,
+                    os.path.join(directory_path, "live", lineage),
+                    settings,
+                    _deploy_queue(dnsrobocert_config, directory_path),
                 )
+    except BaseException as error:
+        metrics.CERTIFICATE_LAST_FAILURE.set(
+            time.time(), lineage=config.get_lineage(certificate)
+        )
+        LOGGER.error(
+            f"An error occurred while processing certificate config {certificate}:\n{error}"
+        )
+
 
-        LOGGER.info("Revoke and delete certificates if needed")
-        lineages = {config.get_lineage(certificate) for certificate in certificates}
-        for domain in os.listdir(os.path.join(directory_path, "live")):
-            if domain != "README":
-                domain = re.sub(r"^\*\.", "", domain)
-                if domain not in lineages:
-                    LOGGER.info(f"Removing the certificate {domain}")
-                    revoke(config_path, directory_path, domain, lock)
+def _complete_order(
+    budget: ratelimits.Budget,
+    store: state.StateStore,
+    lineage: str,
+    started: float,
+    issued: bool,
+) -> None:
+    # An order counts against the rate limits only if it issued a certificate, or if
+    # its challenges were submitted to the ACME server (as a failed validation then).
+    # Certbot does not place any order when it decides that nothing is due.
+    if issued:
+        budget.complete(lineage, True)
+    elif store.validated_since(lineage, started):
+        budget.complete(lineage, False)
+    else:
+        budget.cancel(lineage)
+
+
+def _lineage_lock(lineage: str) -> threading.Lock:
+    with _LINEAGE_LOCKS_GUARD:
+        return _LINEAGE_LOCKS.setdefault(lineage, threading.Lock())
 
 
-def renew(config_path: str, directory_path: str, lock: threading.Lock) -> None:
-    _issue(config_path, directory_path, lock)
+@contextmanager
+def _serialized(directory_path: str) -> Iterator[None]:
+    # The lock of Certbot on its config directory is disabled (see _share_config_dir),
+    # so the passes are serialized here, between the threads of this process (config
+    # watcher and scheduler) and between the processes sharing the same directory.
+    with (
+        _PASS_LOCK,
+        open(utils.state_path(directory_path, _PASS_LOCK_FILE), "a") as lock_h,
+    ):
+        if POSIX_MODE:
+            fcntl.flock(lock_h, fcntl.LOCK_EX)
+        yield
+
+
+def renew(
+    config_path: str,
+    directory_path: str,
+    lock: threading.Lock,
+    lineages: Collection[str] | None = None,
+) -> None:
+    _issue(
+        config_path,
+        directory_path,
+        lock,
+        None if lineages is None else {lineage: {"issue"} for lineage in lineages},
+    )
 
 
 def revoke(
-    config_path: str, directory_path: str, lineage: str, lock: threading.Lock
+    dnsrobocert_config: dict[str, Any], directory_path: str, lineage: str
 ) -> None:
-    url = config.get_acme_url(config.load(config_path))
+    """
+    Revoke the current certificate of the given lineage. Its files are not deleted.
+    The caller must hold the lock of this lineage.
+    """
+    url = config.get_acme_url(dnsrobocert_config)
+    env = os.environ.copy()
+    env[_SHARED_CONFIG_DIR_ENV] = directory_path
 
-    utils.execute(
+    _execute(
+        dnsrobocert_config,
         [
-            sys.executable,
-            "-m",
-            "dnsrobocert.core.certbot",
             "revoke",
             "-n",
+            "--no-delete-after-revoke",
             "--config-dir",
             directory_path,
             "--work-dir",
-            os.path.join(directory_path, "workdir"),
+            os.path.join(directory_path, "workdir", lineage),
             "--logs-dir",
-            os.path.join(directory_path, "logs"),
+            os.path.join(directory_path, "logs", lineage),
             "--server",
             url,
             "--cert-path",
             os.path.join(directory_path, "live", lineage, "cert.pem"),
         ],
-        lock=lock,
+        env=env,
     )
 
 
+def _execute(
+    dnsrobocert_config: dict[str, Any],
+    args: list[str],
+    check: bool = True,
+    env: dict[str, str] | None = None,
+    lock: threading.Lock | None = None,
+) -> None:
+    certbot_workers = dnsrobocert_config.get("acme", {}).get("certbot_workers", 0)
+    attributes = {}
+    if "--cert-name" in args:
+        attributes["lineage"] = args[args.index("--cert-name") + 1]
+    elif "--cert-path" in args:
+        attributes["lineage"] = os.path.basename(
+            os.path.dirname(args[args.index("--cert-path") + 1])
+        )
+
+    with (
+        metrics.CERTBOT_DURATION.time(operation=args[0]),
+        tracing.span(f"certbot.{args[0]}", **attributes),
+    ):
+        # Spans of Certbot and of its hooks are children of the span of this operation.
+        env = tracing.inject(env)
+        if certbot_workers and workers.supported():
+            workers.execute(args, certbot_workers, check=check, env=env, lock=lock)
+        else:
+            utils.execute(
+                [sys.executable, "-m", "dnsrobocert.core.certbot", *args],
+                check=check,
+                env=env,
+                lock=lock,
+            )
+
+
+def _deploy_queue(
+    dnsrobocert_config: dict[str, Any], directory_path: str
+) -> str | None:
+    if not dnsrobocert_config.get("acme", {}).get("coalesce_deploy_actions", True):
+        return None
+    return utils.state_path(directory_path, _DEPLOY_QUEUE)
+
+
+def _suffix_list(dnsrobocert_config: dict[str, Any], directory_path: str) -> str | None:
+    if not dnsrobocert_config.get("acme", {}).get("refresh_public_suffix_list"):
+        return None
+    return utils.state_path(directory_path, _SUFFIX_LIST)
+
+
+def _refresh_suffix_list(
+    dnsrobocert_config: dict[str, Any], directory_path: str
+) -> None:
+    suffix_list_path = _suffix_list(dnsrobocert_config, directory_path)
+    if not suffix_list_path:
+        return
+
+    try:
+        if suffixes.refresh(suffix_list_path):
+            LOGGER.info("Public Suffix List has been refreshed.")
+    except Exception as e:
+        # The hooks fall back to the Public Suffix List shipped with DNSroboCert.
+        LOGGER.warning(f"Public Suffix List could not be refreshed: {e}")
+
+
 def _hook_cmd(hook_type: str, config_path: str, lineage: str | None = None) -> str:
     command = (
         f'{sys.executable} -m dnsrobocert.core.hooks -t {hook_type} -c "{config_path}"'
@@ -202,5 +579,206 @@ def _hook_cmd(hook_type: str, config_path: str, lineage: str | None = None) -> s
     return command
 
 
+def _share_config_dir(config_dir: str) -> None:
+    # Certbot locks its config directory for the whole process lifetime, which forbids
+    # several certonly processes to run at the same time. DNSroboCert already serializes
+    # the operations on a given lineage, and the shared state (account, revocations)
+    # is guarded by its global lock, so the lock on the config directory is skipped here.
+    from certbot import util
+
+    lock_dir_until_exit = util.lock_dir_until_exit
+    config_dir = os.path.realpath(config_dir)
+
+    def _lock_dir_until_exit(dir_path: str) -> None:
+        if os.path.realpath(dir_path) != config_dir:
+            lock_dir_until_exit(dir_path)
+
+    util.lock_dir_until_exit = _lock_dir_until_exit
+
+
+def _revoke_removed(
+    dnsrobocert_config: dict[str, Any],
+    directory_path: str,
+    lineages: Collection[str],
+    lineages_index: dict[str, index.LineageInfo],
+) -> None:
+    """
+    Revoke and delete the certificates whose lineage is not in the configuration anymore.
+    Revocations are executed concurrently, and their outcomes are recorded in a state file:
+    a failed revocation is retried in later passes with a backoff, then abandoned, and a
+    revoked certificate is never revoked again.
+    """
+    live_path = os.path.join(directory_path, "live")
+    removed = (
+        [
+            lineage
+            for lineage in sorted(os.listdir(live_path))
+            if lineage != "README"
+            and os.path.isdir(os.path.join(live_path, lineage))
+            and utils.normalize_lineage(lineage) not in lineages
+        ]
+        if os.path.isdir(live_path)
+        else []
+    )
+
+    revocations_path = utils.state_path(directory_path, _REVOCATIONS)
+    revocations = utils.load_json(revocations_path)
+    new_revocations: dict[str, dict[str, Any]] = {}
+    now = time.time()
+
+    tasks = []
+    for lineage in removed:
+        fingerprint = utils.digest(os.path.join(live_path, lineage, "cert.pem"))
+        entry = revocations.get(lineage, {})
+        # A new certificate with the same lineage is handled from scratch.
+        if entry.get("fingerprint") != (fingerprint.hex() if fingerprint else None):
+            entry = {}
+
+        info = lineages_index.get(lineage)
+        if entry.get("status") == "failed":
+            if entry["attempts"] >= _MAX_REVOCATION_ATTEMPTS:
+                LOGGER.warning(
+                    f"Revocation of the certificate {lineage} was abandoned after "
+                    f"{entry['attempts']} attempts, its files must be deleted manually."
+                )
+                new_revocations[lineage] = entry
+                continue
+            if entry["next_attempt"] > now:
+                LOGGER.info(
+                    f"Revocation of the certificate {lineage} will be retried after "
+                    f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['next_attempt']))}."
+                )
+                new_revocations[lineage] = entry
+                continue
+
+        # There is nothing to revoke for a missing or an expired certificate.
+        revoke_needed = bool(
+            fingerprint
+            and entry.get("status") != "revoked"
+            and not (info and info.not_after.timestamp() <= now)
+        )
+        tasks.append(
+            (
+                lineage,
+                fingerprint.hex() if fingerprint else None,
+                entry.get("attempts", 0),
+                revoke_needed,
+            )
+        )
+
+    if tasks:
+        with ThreadPoolExecutor(
+            max_workers=min(len(tasks), _MAX_PARALLEL_REVOCATIONS),
+            thread_name_prefix="dnsrobocert-revoke",
+        ) as executor:
+            futures = {
+                lineage: executor.submit(
+                    contextvars.copy_context().run,
+                    _revoke_one,
+                    dnsrobocert_config,
+                    directory_path,
+                    lineage,
+                    fingerprint,
+                    attempts,
+                    revoke_needed,
+                )
+                for lineage, fingerprint, attempts, revoke_needed in tasks
+            }
+        for lineage, future in futures.items():
+            outcome = future.result()
+            if outcome:
+                new_revocations[lineage] = outcome
+
+    if new_revocations != revocations:
+        utils.save_json(revocations_path, new_revocations)
+
+
+def _revoke_one(
+    dnsrobocert_config: dict[str, Any],
+    directory_path: str,
+    lineage: str,
+    fingerprint: str | None,
+    attempts: int,
+    revoke_needed: bool,
+) -> dict[str, Any] | None:
+    with _lineage_lock(lineage):
+        # The lineage may have been deleted by a concurrent pass.
+        if not os.path.isdir(os.path.join(directory_path, "live", lineage)):
+            return None
+
+        if revoke_needed:
+            LOGGER.info(f"Revoking the certificate {lineage}")
+            try:
+                revoke(dnsrobocert_config, directory_path, lineage)
+            except Exception as error:
+                attempts = attempts + 1
+                LOGGER.error(
+                    f"Error while revoking the certificate {lineage} "
+                    f"(attempt {attempts}/{_MAX_REVOCATION_ATTEMPTS}): {error}"
+                )
+                return {
+                    "fingerprint": fingerprint,
+                    "status": "failed",
+                    "attempts": attempts,
+                    "next_attempt": time.time()
+                    + _REVOCATION_RETRY_DELAY * 2 ** (attempts - 1),
+                }
+
+        LOGGER.info(f"Removing the certificate {lineage}")
+        try:
+            _delete_lineage(directory_path, lineage)
+        except OSError as error:
+            LOGGER.error(f"Error while removing the certificate {lineage}: {error}")
+            return {"fingerprint": fingerprint, "status": "revoked"}
+
+    return None
+
+
+def _delete_lineage(directory_path: str, lineage: str) -> None:
+    # Like Certbot, the renewal configuration is removed first, so a partially deleted
+    # lineage is never renewed.
+    renewal_path = os.path.join(directory_path, "renewal", f"{lineage}.conf")
+    if os.path.exists(renewal_path):
+        os.remove(renewal_path)
+    for path in (
+        os.path.join(directory_path, "live", lineage),
+        os.path.join(directory_path, "archive", lineage),
+    ):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+
+def _account_exists(directory_path: str, url: str) -> bool:
+    # Same layout as Certbot: accounts/<server host and path>/<account id>/
+    parsed = urllib.parse.urlparse(url)
+    server = parsed.netloc + parsed.path
+    for server_path in (server, _ACCOUNTS_REUSE_SERVERS.get(server)):
+        if not server_path:
+            continue
+        server_path = server_path.replace("/", os.path.sep)
+        if os.name == "nt":
+            server_path = server_path.replace(":", "_")
+        accounts_dir = os.path.join(directory_path, "accounts", server_path)
+        try:
+            if any(
+                os.path.exists(os.path.join(accounts_dir, account_id, "regr.json"))
+                for account_id in os.listdir(accounts_dir)
+            ):
+                return True
+        except OSError:
+            pass
+
+    return False
+
+
+def run(args: list[str]) -> int | str | None:
+    if os.environ.get(_SHARED_CONFIG_DIR_ENV):
+        _share_config_dir(os.environ[_SHARED_CONFIG_DIR_ENV])
+
+    from certbot import main
+
+    return main.main(args)
+
+
 if __name__ == "__main__":
-    sys.exit(main.main())
+    sys.exit(run(sys.argv[1:]))
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
+import os
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as futures_wait
+from contextlib import contextmanager
 from typing import Any
 
 import dns.exception
 import dns.resolver
-import tldextract
+from lexicon import client as lexicon_client
 from lexicon.client import Client
 from lexicon.config import ConfigResolver
 
+from dnsrobocert.core import cache, metrics, suffixes, tracing
+
 
 def txt_challenge(
     certificate: dict[str, Any],
@@ -16,8 +25,21 @@ def txt_challenge(
     domain: str,
     action: str = "create",
 ) -> None:
+    txt_challenges(certificate, profile, [[domain, token]], action=action)
+
+
+def txt_challenges(
+    certificate: dict[str, Any],
+    profile: dict[str, Any],
+    challenges: list[list[str]],
+    action: str = "create",
+) -> None:
+    """
+    Create or delete the TXT records for the given challenges (list of domain/token pairs).
+    Records are grouped by their actual DNS zone, and each zone is handled within one
+    authenticated session against the DNS provider.
+    """
     profile_name = profile["name"]
-    provider_name = profile["provider"]
     provider_options = profile.get("provider_options", {})
 
     if not provider_options:
@@ -26,40 +48,213 @@ def txt_challenge(
             "any call to the provider API is likely to fail."
         )
 
+    resolution_cache = cache.ResolutionCache(os.environ.get(cache.CACHE_ENV))
+
+    # Zones are resolved first, so a single Lexicon client is built for each zone.
+    zones: dict[str, list[tuple[str, str, list[tuple[str, str]]]]] = {}
+    for domain, token in challenges:
+        challenge_name, lexicon_domain = _challenge_name(
+            certificate, domain, resolution_cache
+        )
+        if profile.get("dynamic_zone_resolution", True):
+            zone = resolution_cache.lookup(
+                "zone",
+                lexicon_domain,
+                lambda: dns.resolver.zone_for_name(lexicon_domain).to_text(
+                    omit_final_dot=True
+                ),
+            )
+        else:
+            zone = suffixes.extract(lexicon_domain)
+        cache_keys = [
+            ("cname", f"_acme-challenge.{domain}."),
+            ("zone", lexicon_domain),
+        ]
+        zones.setdefault(zone, []).append((challenge_name, token, cache_keys))
+
+    with (
+        tracing.span(
+            "txt_challenges",
+            action=action,
+            profile=profile_name,
+            records=len(challenges),
+        ),
+        _flushing(resolution_cache),
+    ):
+        for zone, records in zones.items():
+            print(
+                f"Handling {len(records)} TXT record(s) ({action}) in DNS zone {zone}."
+            )
+            try:
+                client = _ZoneClient(
+                    ConfigResolver().with_dict(_lexicon_config(profile, zone))
+                )
+                with (
+                    tracing.span("dns_zone", zone=zone, records=len(records)),
+                    metrics.PROVIDER_DURATION.time(profile=profile_name, action=action),
+                    client as operations,
+                ):
+                    for challenge_name, token, _ in records:
+                        if action == "create":
+                            operations.create_record(
+                                rtype="TXT", name=challenge_name, content=token
+                            )
+                        elif action == "delete":
+                            operations.delete_record(
+                                rtype="TXT", name=challenge_name, content=token
+                            )
+            except Exception:
+                # Cached resolutions may be outdated and be the cause of the error.
+                for _, _, cache_keys in records:
+                    for kind, key in cache_keys:
+                        resolution_cache.invalidate(kind, key)
+                raise
+
+    if resolution_cache.path:
+        stats = resolution_cache.stats()
+        print(
+            f"Resolution cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['invalidations']} invalidations."
+        )
+
+
+def _challenge_name(
+    certificate: dict[str, Any], domain: str, resolution_cache: cache.ResolutionCache
+) -> tuple[str, str]:
     challenge_name = f"_acme-challenge.{domain}."
     if certificate.get("follow_cnames"):
         print(f"Trying to resolve the canonical challenge name for {challenge_name}")
-        canonical_challenge_name = str(dns.resolver.canonical_name(challenge_name))
+        canonical_challenge_name = resolution_cache.lookup(
+            "cname",
+            challenge_name,
+            lambda: str(dns.resolver.canonical_name(challenge_name)),
+        )
         print(
             f"Canonical challenge name found for {challenge_name}: {canonical_challenge_name}"
         )
         challenge_name = canonical_challenge_name
 
-        extracted = tldextract.extract(challenge_name)
-        domain = ".".join([extracted.domain, extracted.suffix])
+        domain = suffixes.extract(challenge_name)
+
+    return challenge_name, domain
+
+
+class _ZoneClient(Client):
+    """
+    A Lexicon client for a DNS zone already resolved by DNSroboCert. The base client
+    resolves the zone of its domain again on each instantiation, with DNS requests
+    or with a Public Suffix List fetched from the network: here the domain of the
+    configuration is used as is.
+    """
+
+    def __init__(self, config: ConfigResolver) -> None:
+        self.config = config
+        if not config.resolve("lexicon:domain"):
+            raise AttributeError("domain")
+        self._validate_provider()
 
+        self.provider_name = str(config.resolve("lexicon:provider_name"))
+        provider_module = lexicon_client._load_provider_module(self.provider_name)
+        self.provider_class = getattr(provider_module, "Provider")
+
+        self._state = threading.local()
+        self._state.stack = []
+
+
+def _lexicon_config(profile: dict[str, Any], zone: str) -> dict[str, Any]:
+    provider_name = profile["provider"]
     config_dict = {
-        "domain": domain,
-        "resolve_zone_name": profile.get("dynamic_zone_resolution", True),
-        "delegated": profile.get("delegated_subdomain"),
+        "domain": _delegated_domain(zone, profile.get("delegated_subdomain")),
         "provider_name": provider_name,
-        provider_name: provider_options,
+        provider_name: profile.get("provider_options", {}),
     }
 
     ttl = profile.get("ttl")
     if ttl:
         config_dict["ttl"] = ttl
 
-    with Client(ConfigResolver().with_dict(config_dict)) as operations:
-        if action == "create":
-            operations.create_record(rtype="TXT", name=challenge_name, content=token)
-        elif action == "delete":
-            operations.delete_record(rtype="TXT", name=challenge_name, content=token)
+    return config_dict
+
+
+def _delegated_domain(zone: str, delegated: str | None) -> str:
+    # Same as Lexicon: the delegated subdomain, relative to the zone or not, replaces
+    # the zone that has been resolved.
+    if not delegated:
+        return zone
+
+    delegated = str(delegated).rstrip(".")
+    if delegated == zone:
+        return zone
+    if delegated.endswith(zone):
+        delegated = delegated[: -len(zone)].rstrip(".")
+    return f"{delegated}.{zone}"
+
+
+@contextmanager
+def _flushing(resolution_cache: cache.ResolutionCache) -> Iterator[None]:
+    # Statistics of the cache hits are written once for all the challenges.
+    try:
+        yield
+    finally:
+        resolution_cache.flush()
+
+
+_MAX_CONCURRENT_CHECKS = 16
+
+
+def check_challenges(
+    challenges: dict[str, str | None], timeout: float | None = None
+) -> dict[str, bool]:
+    """
+    Check concurrently all the given challenges (mapping of the challenge names to
+    their expected token, if any). A whole round is bounded by timeout seconds: each
+    DNS query lasts at most until the deadline of the round, and the challenges not
+    checked by then are not propagated yet. Return the result for each challenge.
+    """
+    if not challenges:
+        return {}
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    def _check(challenge: str, token: str | None) -> bool:
+        if deadline is None:
+            return check_one_challenge(challenge, token)
+        lifetime = max(0.0, deadline - time.monotonic())
+        if not lifetime:
+            print(f"Timeout before trying to check TXT {challenge}.")
+            return False
+        return check_one_challenge(challenge, token, lifetime)
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(len(challenges), _MAX_CONCURRENT_CHECKS),
+        thread_name_prefix="dnsrobocert-check",
+    )
+    try:
+        futures = {
+            challenge: executor.submit(_check, challenge, token)
+            for challenge, token in challenges.items()
+        }
+        futures_wait(
+            futures.values(),
+            timeout=(
+                max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            ),
+        )
+    finally:
+        # The queries still running end by themselves with their lifetime.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {
+        challenge: future.done() and not future.cancelled() and future.result()
+        for challenge, future in futures.items()
+    }
 
 
-def check_one_challenge(challenge: str, token: str | None = None) -> bool:
+def check_one_challenge(
+    challenge: str, token: str | None = None, timeout: float | None = None
+) -> bool:
     try:
-        answers = dns.resolver.resolve(challenge, "TXT")
+        answers = dns.resolver.resolve(challenge, "TXT", lifetime=timeout)
     except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
         print(f"TXT {challenge} does not exist.")
         return False
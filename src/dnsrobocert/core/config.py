@@ -1,80 +1,78 @@
 from __future__ import annotations
 
+import copy
+import functools
+import hashlib
 import logging
 import os
 import re
+import threading
+import time
 import warnings
 from importlib.resources import as_file, files
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import coloredlogs
-import jsonschema
 import yaml
 
-from dnsrobocert.core import utils
+from dnsrobocert.core import cron, metrics, utils
+
+if TYPE_CHECKING:
+    from jsonschema.protocols import Validator
 
 LOGGER = logging.getLogger(__name__)
 coloredlogs.install(logger=LOGGER)
 
+# Use the libyaml bindings when available, they are an order of magnitude faster.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+_ENV_VARIABLE_PATTERN = re.compile(r"\${1,2}{(\S+)}")
+
+_CACHE: dict[str, tuple[tuple[Any, ...], dict[str, Any]]] = {}
+_CACHE_LOCK = threading.Lock()
+
+# Settings of the acme section that select the ACME server or account.
+_ACME_SERVER_SETTINGS = ("staging", "api_version", "directory_url")
+_ACME_ACCOUNT_SETTINGS = ("email_account", *_ACME_SERVER_SETTINGS)
+# Settings of a certificate that require to check if it needs to be issued again.
+_ISSUANCE_SETTINGS = (
+    "domains",
+    "profile",
+    "key_type",
+    "reuse_key",
+    "force_renew",
+    "follow_cnames",
+)
+# Settings of a certificate applied by the deploy hook.
+DEPLOY_SETTINGS = ("pfx", "exports", "autorestart", "autocmd", "deploy_hook")
+
 
 def load(config_path: str) -> dict[str, Any] | None:
     if not os.path.exists(config_path):
         LOGGER.error(f"Configuration file {config_path} does not exist.")
         return None
 
+    start = time.monotonic()
     with open(config_path) as file_h:
         raw_config = file_h.read()
 
-    raw_config = _inject_env_variables(raw_config)
-
-    try:
-        config = yaml.load(raw_config, Loader=yaml.SafeLoader)
-    except BaseException:
-        message = """
-Error while validating dnsrobocert configuration:
-Configuration file is not a valid YAML file.\
-"""
-        LOGGER.error(message)
-        return None
-
-    with as_file(files("dnsrobocert") / "schema.yml") as schema_path:
-        with open(schema_path) as file_h:
-            schema = yaml.load(file_h.read(), yaml.SafeLoader)
-
-    if not config:
-        message = """
-Error while validating dnsrobocert configuration:
-Configuration file is empty.\
-"""
-        LOGGER.error(message)
-        return None
-
-    try:
-        jsonschema.validate(instance=config, schema=schema)
-    except jsonschema.ValidationError as e:
-        node = "/" + "/".join([str(item) for item in e.path])
-        message = f"""\
-Error while validating dnsrobocert configuration for node path {node}:
-{e.message}.
------
-{raw_config}\
-"""
-        LOGGER.error(message)
-        return None
-
-    try:
-        _values_conversion(config)
-        _business_check(config)
-    except ValueError as e:
-        message = f"""\
-Error while validating dnsrobocert configuration:
-{str(e)}
------
-{raw_config}\
-"""
-        LOGGER.error(message)
-        return None
-
+    # A valid configuration is cached until the file content or the value of one of
+    # the environment variables it references changes.
+    cache_key = _cache_key(raw_config)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(config_path)
+    if cached and cached[0] == cache_key:
+        cached_config = copy.deepcopy(cached[1])
+        metrics.CONFIG_LOAD_DURATION.observe(time.monotonic() - start, cached="true")
+        return cached_config
+
+    config = _parse(raw_config)
+    if config:
+        with _CACHE_LOCK:
+            _CACHE[config_path] = (cache_key, copy.deepcopy(config))
+
+    metrics.CONFIG_LOAD_DURATION.observe(time.monotonic() - start, cached="false")
     return config
 
 
@@ -145,6 +143,79 @@ def find_profile_for_lineage(
     return get_profile(config, profile_name)
 
 
+def diff(
+    previous_config: dict[str, Any] | None, config: dict[str, Any]
+) -> dict[str, set[str]]:
+    """
+    Compare the certificates of two configurations, and return for each lineage that
+    needs some work the steps to apply: "issue" if the certificate must be checked for
+    issuance, and the names of the deploy settings that changed. Untouched lineages
+    are omitted. Without a previous configuration, every lineage must be checked.
+    """
+    if not previous_config:
+        return {
+            get_lineage(certificate): {"issue"}
+            for certificate in config.get("certificates", [])
+        }
+
+    server_changed = _acme_changed(previous_config, config, _ACME_SERVER_SETTINGS)
+    previous_certificates = {
+        get_lineage(certificate): certificate
+        for certificate in previous_config.get("certificates", [])
+    }
+
+    changes: dict[str, set[str]] = {}
+    for certificate in config.get("certificates", []):
+        lineage = get_lineage(certificate)
+        previous_certificate = previous_certificates.get(lineage)
+
+        if not previous_certificate or server_changed or certificate.get("force_renew"):
+            changes[lineage] = {"issue"}
+            continue
+
+        steps = {
+            setting
+            for setting in DEPLOY_SETTINGS
+            if certificate.get(setting) != previous_certificate.get(setting)
+        }
+        if any(
+            certificate.get(setting) != previous_certificate.get(setting)
+            for setting in _ISSUANCE_SETTINGS
+        ) or get_profile(config, certificate["profile"]) != get_profile(
+            previous_config, previous_certificate["profile"]
+        ):
+            steps.add("issue")
+
+        if steps:
+            changes[lineage] = steps
+
+    return changes
+
+
+def account_changed(
+    previous_config: dict[str, Any] | None, config: dict[str, Any]
+) -> bool:
+    return not previous_config or _acme_changed(
+        previous_config, config, _ACME_ACCOUNT_SETTINGS
+    )
+
+
+def permissions_changed(
+    previous_config: dict[str, Any] | None, config: dict[str, Any]
+) -> bool:
+    return not previous_config or _acme_changed(
+        previous_config, config, ("certs_permissions",)
+    )
+
+
+def _acme_changed(
+    previous_config: dict[str, Any], config: dict[str, Any], settings: tuple[str, ...]
+) -> bool:
+    previous_acme = previous_config.get("acme", {})
+    acme = config.get("acme", {})
+    return any(previous_acme.get(setting) != acme.get(setting) for setting in settings)
+
+
 def _inject_env_variables(raw_config: str) -> str:
     def replace(match: re.Match[str]) -> str:
         entry = match.group(0)
@@ -160,7 +231,7 @@ def _inject_env_variables(raw_config: str) -> str:
 
         return os.environ[variable_name]
 
-    return re.sub(r"\${1,2}{(\S+)}", replace, raw_config)
+    return _ENV_VARIABLE_PATTERN.sub(replace, raw_config)
 
 
 def _values_conversion(config: dict[str, Any]) -> None:
@@ -199,6 +270,10 @@ def _business_check(config: dict[str, Any]) -> None:
             DeprecationWarning,
         )
 
+    crontab_renew = config.get("acme", {}).get("crontab_renew")
+    if crontab_renew:
+        cron.Crontab(crontab_renew)
+
     # Check that each files_mode and dirs_mode is a valid POSIX mode
     files_mode = config.get("acme", {}).get("certs_permissions", {}).get("files_mode")
     if files_mode and files_mode > 511:
@@ -206,3 +281,82 @@ def _business_check(config: dict[str, Any]) -> None:
     dirs_mode = config.get("acme", {}).get("certs_permissions", {}).get("dirs_mode")
     if dirs_mode and dirs_mode > 511:
         raise ValueError("Invalid dirs_mode {0} provided.".format(oct(files_mode)))
+
+
+def _parse(raw_config: str) -> dict[str, Any] | None:
+    raw_config = _inject_env_variables(raw_config)
+
+    try:
+        config = yaml.load(raw_config, Loader=YAML_LOADER)
+    except BaseException:
+        message = """
+Error while validating dnsrobocert configuration:
+Configuration file is not a valid YAML file.\
+"""
+        LOGGER.error(message)
+        return None
+
+    if not config:
+        message = """
+Error while validating dnsrobocert configuration:
+Configuration file is empty.\
+"""
+        LOGGER.error(message)
+        return None
+
+    # Deferred: hooks forwarded to the hooks server never validate a configuration.
+    import jsonschema
+
+    error = jsonschema.exceptions.best_match(_validator().iter_errors(config))
+    if error:
+        node = "/" + "/".join([str(item) for item in error.path])
+        message = f"""\
+Error while validating dnsrobocert configuration for node path {node}:
+{error.message}.
+-----
+{raw_config}\
+"""
+        LOGGER.error(message)
+        return None
+
+    try:
+        _values_conversion(config)
+        _business_check(config)
+    except ValueError as e:
+        message = f"""\
+Error while validating dnsrobocert configuration:
+{str(e)}
+-----
+{raw_config}\
+"""
+        LOGGER.error(message)
+        return None
+
+    return config
+
+
+@functools.lru_cache(maxsize=None)
+def _validator() -> Validator:
+    import jsonschema
+
+    with as_file(files("dnsrobocert") / "schema.yml") as schema_path:
+        with open(schema_path) as file_h:
+            schema = yaml.load(file_h.read(), YAML_LOADER)
+
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+def _cache_key(raw_config: str) -> tuple[Any, ...]:
+    variables = sorted(
+        {
+            match.group(1)
+            for match in _ENV_VARIABLE_PATTERN.finditer(raw_config)
+            if not match.group(0).startswith("$${")
+        }
+    )
+    return (
+        hashlib.sha256(raw_config.encode("utf-8")).digest(),
+        tuple((variable, os.environ.get(variable)) for variable in variables),
+    )
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+# Bounds of the minute, hour, day of month, month and day of week fields.
+_FIELDS_BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+_MAX_ITERATIONS = 100000
+
+
+class Crontab:
+    """
+    A minimal cron pattern (minute, hour, day of month, month, day of week), supporting
+    wildcards, lists, ranges and steps. Times are evaluated in the local timezone.
+    """
+
+    def __init__(self, pattern: str) -> None:
+        fields = pattern.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron pattern {pattern}: 5 fields are expected.")
+
+        self.pattern = pattern
+        self._minutes, self._hours, self._days, self._months, days_of_week = (
+            _parse_field(field, *bounds)
+            for field, bounds in zip(fields, _FIELDS_BOUNDS)
+        )
+        # Both 0 and 7 are Sunday.
+        self._days_of_week = {day % 7 for day in days_of_week}
+        self._any_day = fields[2] == "*"
+        self._any_day_of_week = fields[4] == "*"
+
+    def match(self, moment: datetime) -> bool:
+        return (
+            self._match_day(moment)
+            and moment.hour in self._hours
+            and moment.minute in self._minutes
+        )
+
+    def next(self, timestamp: float) -> float:
+        """
+        Return the timestamp of the first minute matching the pattern at or after
+        the given timestamp.
+        """
+        moment = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0)
+        if moment.timestamp() < timestamp:
+            moment += timedelta(minutes=1)
+
+        for _ in range(_MAX_ITERATIONS):
+            if not self._match_day(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self._hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self._minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+
+        raise ValueError(f"Cron pattern {self.pattern} never matches.")
+
+    def _match_day(self, moment: datetime) -> bool:
+        if moment.month not in self._months:
+            return False
+
+        day_match = moment.day in self._days
+        # Python weekday() starts on Monday, cron starts on Sunday.
+        day_of_week_match = (moment.weekday() + 1) % 7 in self._days_of_week
+
+        # Like cron, if both days fields are restricted, matching one of them is enough.
+        if self._any_day or self._any_day_of_week:
+            return day_match and day_of_week_match
+        return day_match or day_of_week_match
+
+
+def _parse_field(field: str, minimum: int, maximum: int) -> set[int]:
+    values: set[int] = set()
+    for item in field.split(","):
+        expression, _, step = item.partition("/")
+        if expression == "*":
+            start, end = minimum, maximum
+        elif "-" in expression:
+            start_value, _, end_value = expression.partition("-")
+            start, end = int(start_value), int(end_value)
+        else:
+            start = end = int(expression)
+            if step:
+                end = maximum
+
+        if start < minimum or end > maximum or start > end:
+            raise ValueError(
+                f"Invalid cron field {field}: values must be between {minimum} and {maximum}."
+            )
+
+        values.update(range(start, end + 1, int(step) if step else 1))
+
+    return values
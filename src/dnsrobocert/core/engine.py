@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import codecs
+import http.client
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from typing import IO, Any
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+PODMAN_SOCKET = "/run/podman/podman.sock"
+
+# Timeout of each call to the Engine API, in seconds.
+DEFAULT_TIMEOUT = 60
+# Time given to a container to stop gracefully before being killed during a restart.
+_RESTART_STOP_TIMEOUT = 10
+# Maximum time to wait for a swarm service to converge after a forced update.
+_SERVICE_UPDATE_TIMEOUT = 600
+_SERVICE_UPDATE_POLL_INTERVAL = 1
+_SERVICE_UPDATE_FAILED_STATES = {
+    "paused",
+    "rollback_started",
+    "rollback_paused",
+    "rollback_completed",
+}
+# Interval between the inspections of an exec whose output stream is closed, until
+# the command is not running anymore.
+_EXEC_POLL_INTERVAL = 0.1
+
+_CLIENTS: dict[str, EngineClient] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+class EngineClient:
+    """
+    A client of the Docker Engine API, also implemented by Podman (compatibility API),
+    over a Unix socket. A connection is kept open and reused between the calls.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._connection: _UnixHTTPConnection | None = None
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection:
+                self._connection.close()
+                self._connection = None
+
+    def restart_container(self, container: str) -> None:
+        print(f"Restarting container {container}.")
+        self._call(
+            "POST",
+            f"/containers/{_quote(container)}/restart?t={_RESTART_STOP_TIMEOUT}",
+            timeout=self.timeout + _RESTART_STOP_TIMEOUT,
+        )
+
+    def update_service(
+        self, service: str, timeout: float = _SERVICE_UPDATE_TIMEOUT
+    ) -> None:
+        """
+        Force the update of a swarm service, so its tasks are recreated, and wait
+        for the service to converge (like docker service update --force --detach=false).
+        """
+        print(f"Updating swarm service {service}.")
+        current = self._call("GET", f"/services/{_quote(service)}")
+        spec = current["Spec"]
+        task_template = spec.setdefault("TaskTemplate", {})
+        task_template["ForceUpdate"] = task_template.get("ForceUpdate", 0) + 1
+        self._call(
+            "POST",
+            f"/services/{current['ID']}/update?version={current['Version']['Index']}",
+            spec,
+        )
+
+        deadline = time.monotonic() + timeout
+        while True:
+            state = (
+                self._call("GET", f"/services/{current['ID']}")
+                .get("UpdateStatus", {})
+                .get("State")
+            )
+            if state == "completed":
+                return
+            if state in _SERVICE_UPDATE_FAILED_STATES:
+                raise RuntimeError(
+                    f"Update of swarm service {service} failed ({state})."
+                )
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    f"Swarm service {service} did not converge after {timeout} seconds."
+                )
+            time.sleep(_SERVICE_UPDATE_POLL_INTERVAL)
+
+    def exec(
+        self,
+        container: str,
+        command: list[str],
+        timeout: float | None = None,
+        stdout: IO[str] | None = None,
+        stderr: IO[str] | None = None,
+    ) -> None:
+        """
+        Execute a command in a running container. Its output is streamed to the given
+        stdout and stderr (defaults to the ones of this process) as it is produced.
+        Raise an error if the command fails.
+        """
+        print(f"Executing command {command} in container {container}.")
+        created = self._call(
+            "POST",
+            f"/containers/{_quote(container)}/exec",
+            {"AttachStdout": True, "AttachStderr": True, "Tty": False, "Cmd": command},
+        )
+        exec_id = created["Id"]
+
+        outputs = {1: stdout or sys.stdout, 2: stderr or sys.stderr}
+        decoders = {
+            stream: codecs.getincrementaldecoder("utf-8")("replace")
+            for stream in outputs
+        }
+
+        with self._lock:
+            connection = self._open(self.timeout if timeout is None else timeout)
+            body = json.dumps({"Detach": False, "Tty": False}).encode("utf-8")
+            connection.request(
+                "POST",
+                f"/exec/{exec_id}/start",
+                body,
+                {"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            try:
+                if response.status >= 400:
+                    raise RuntimeError(_error(response.status, response.read()))
+
+                # Multiplexed stream: each frame has a header holding the stream
+                # (1 for stdout, 2 for stderr) and the size of the payload.
+                while True:
+                    header = response.read(8)
+                    if len(header) < 8:
+                        break
+                    stream, size = struct.unpack(">BxxxL", header)
+                    payload = response.read(size)
+                    output = outputs.get(stream)
+                    if output:
+                        output.write(decoders[stream].decode(payload))
+                        output.flush()
+            finally:
+                response.close()
+                # The connection has been hijacked for the stream, it cannot be reused.
+                connection.close()
+                self._connection = None
+
+        # The exit code is known (not null) only once the command is not running anymore.
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            inspect = self._call("GET", f"/exec/{exec_id}/json")
+            if not inspect.get("Running"):
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    f"Command {command} in container {container} is still running."
+                )
+            time.sleep(_EXEC_POLL_INTERVAL)
+
+        exit_code = inspect.get("ExitCode")
+        if exit_code != 0:
+            raise RuntimeError(
+                f"Command {command} in container {container} failed with exit code {exit_code}."
+            )
+
+    def _call(
+        self,
+        method: str,
+        path: str,
+        payload: Any = None,
+        timeout: float | None = None,
+    ) -> Any:
+        body = None if payload is None else json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+
+        with self._lock:
+            reused = self._connection is not None
+            connection = self._open(self.timeout if timeout is None else timeout)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                if not reused:
+                    raise
+                # The Engine closed the idle connection: try again on a new one.
+                connection.close()
+                connection = self._open(self.timeout if timeout is None else timeout)
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+
+            data = response.read()
+            if response.will_close:
+                connection.close()
+                self._connection = None
+
+        if response.status >= 400:
+            raise RuntimeError(_error(response.status, data))
+
+        return json.loads(data) if data else None
+
+    def _open(self, timeout: float) -> _UnixHTTPConnection:
+        if not self._connection:
+            self._connection = _UnixHTTPConnection(self.socket_path, timeout)
+        self._connection.timeout = timeout
+        if self._connection.sock:
+            self._connection.sock.settimeout(timeout)
+        return self._connection
+
+
+def client(socket_path: str) -> EngineClient:
+    """
+    Return the client for the Engine API listening on the given Unix socket, shared
+    by all the calls made from this process.
+    """
+    with _CLIENTS_LOCK:
+        if socket_path not in _CLIENTS:
+            _CLIENTS[socket_path] = EngineClient(socket_path)
+        return _CLIENTS[socket_path]
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+def _quote(name: str) -> str:
+    return urllib.parse.quote(name, safe="")
+
+
+def _error(status: int, data: bytes) -> str:
+    try:
+        message = json.loads(data)["message"]
+    except (ValueError, KeyError, TypeError):
+        message = data.decode("utf-8", "replace")
+    return f"Engine API error ({status}): {message}"
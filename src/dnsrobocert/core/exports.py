@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import os
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, NamedTuple, cast
+
+from dnsrobocert.core import utils
+
+if TYPE_CHECKING:
+    from cryptography import x509
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
+# Record of the exports made for the current certificate of a lineage, stored in its
+# archive directory, so the exports are regenerated only when needed.
+MANIFEST = "exports.json"
+
+
+class Material:
+    """
+    The key material of the current certificate of a lineage. Files are read once,
+    and parsed only if an exporter needs it.
+    """
+
+    def __init__(self, lineage_path: str, lineage: str) -> None:
+        self.lineage = lineage
+        self.lineage_path = lineage_path
+        self.privkey_pem = _read(lineage_path, "privkey.pem")
+        self.cert_pem = _read(lineage_path, "cert.pem")
+        self.chain_pem = _read(lineage_path, "chain.pem")
+
+    @functools.cached_property
+    def cert(self) -> x509.Certificate:
+        from cryptography import x509
+
+        return x509.load_pem_x509_certificate(self.cert_pem)
+
+    @functools.cached_property
+    def chain(self) -> list[x509.Certificate]:
+        from cryptography import x509
+
+        return x509.load_pem_x509_certificates(self.chain_pem)
+
+    @functools.cached_property
+    def key(self) -> pkcs12.PKCS12PrivateKeyTypes:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.serialization import pkcs12
+
+        key = serialization.load_pem_private_key(self.privkey_pem, None)
+        # By construction, Certbot will generate only RSA/ECDSA private keys.
+        return cast(pkcs12.PKCS12PrivateKeyTypes, key)
+
+
+class Exporter(NamedTuple):
+    # Prefix and extension of the exported files: for the certificate cert3.pem,
+    # file <prefix>3<extension> in the archive directory, linked from the live
+    # directory as <prefix><extension>.
+    prefix: str
+    extension: str
+    serialize: Callable[[Material, dict[str, Any]], bytes]
+    # Export options used by this exporter: when they change, the file is generated again.
+    options: tuple[str, ...] = ()
+
+
+def _pem(material: Material, _options: dict[str, Any]) -> bytes:
+    # Certificate, chain and private key in one file, as expected by HAProxy.
+    return b"".join(
+        data if data.endswith(b"\n") else data + b"\n"
+        for data in (material.cert_pem, material.chain_pem, material.privkey_pem)
+    )
+
+
+def _der(material: Material, _options: dict[str, Any]) -> bytes:
+    from cryptography.hazmat.primitives import serialization
+
+    return material.cert.public_bytes(serialization.Encoding.DER)
+
+
+def _pfx(material: Material, options: dict[str, Any]) -> bytes:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
+    passphrase = options.get("passphrase")
+    return pkcs12.serialize_key_and_certificates(
+        material.lineage.encode("utf-8"),
+        material.key,
+        material.cert,
+        material.chain,
+        (
+            serialization.BestAvailableEncryption(passphrase.encode("utf-8"))
+            if passphrase
+            else serialization.NoEncryption()
+        ),
+    )
+
+
+def _jks(material: Material, options: dict[str, Any]) -> bytes:
+    # Java loads PKCS#12 keystores as JKS keystores (keystore.type.compat, default since
+    # Java 8u60). The legacy encryption is used, as it is supported by all Java versions.
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
+    passphrase = options.get("passphrase")
+    return pkcs12.serialize_key_and_certificates(
+        material.lineage.encode("utf-8"),
+        material.key,
+        material.cert,
+        material.chain,
+        (
+            serialization.PrivateFormat.PKCS12.encryption_builder()
+            .key_cert_algorithm(pkcs12.PBES.PBESv1SHA1And3KeyTripleDESCBC)
+            .hmac_hash(hashes.SHA1())
+            .build(passphrase.encode("utf-8"))
+            if passphrase
+            else serialization.NoEncryption()
+        ),
+    )
+
+
+EXPORTERS = {
+    "pem": Exporter("combined", ".pem", _pem),
+    "pfx": Exporter("cert", ".pfx", _pfx, ("passphrase",)),
+    "der": Exporter("cert", ".der", _der),
+    "jks": Exporter("keystore", ".jks", _jks, ("passphrase",)),
+}
+
+
+def formats(certificate: dict[str, Any]) -> list[str]:
+    """
+    Return the formats in which the given certificate is exported.
+    """
+    selected = list(certificate.get("exports", []))
+    if certificate.get("pfx", {}).get("export") and "pfx" not in selected:
+        selected.append("pfx")
+    return selected
+
+
+def export(certificate: dict[str, Any], lineage_path: str, lineage: str) -> None:
+    """
+    Export the current certificate of the given lineage in all the formats configured
+    for it. Each exported file is written next to the certificate in the archive
+    directory, and linked from the live directory. A file is generated again only if
+    the certificate (identified by its serial number) or the export options changed.
+    """
+    selected = formats(certificate)
+    if not selected:
+        return
+
+    material = Material(lineage_path, lineage)
+    cert_path = os.readlink(os.path.join(lineage_path, "cert.pem"))
+    archive_path = os.path.dirname(cert_path)
+    archive_path_abs = os.path.normpath(os.path.join(lineage_path, archive_path))
+    # Version of the certificate (eg. "3" for cert3.pem).
+    version = os.path.basename(cert_path)[len("cert") : -len(".pem")]
+    serial = format(material.cert.serial_number, "x")
+
+    manifest_path = os.path.join(archive_path_abs, MANIFEST)
+    manifest = _load_manifest(manifest_path)
+    options = {"passphrase": certificate.get("pfx", {}).get("passphrase")}
+
+    changed = False
+    for name in selected:
+        exporter = EXPORTERS[name]
+        file_name = f"{exporter.prefix}{version}{exporter.extension}"
+        options_digest = hashlib.sha256(
+            json.dumps([options[option] for option in exporter.options]).encode("utf-8")
+        ).hexdigest()
+        entry = {"serial": serial, "options": options_digest, "file": file_name}
+
+        if manifest.get(name) != entry or not os.path.exists(
+            os.path.join(archive_path_abs, file_name)
+        ):
+            utils.atomic_write(
+                os.path.join(archive_path_abs, file_name),
+                exporter.serialize(material, options),
+            )
+            manifest[name] = entry
+            changed = True
+
+        _link(
+            os.path.join(archive_path, file_name),
+            os.path.join(lineage_path, f"{exporter.prefix}{exporter.extension}"),
+        )
+
+    if changed:
+        utils.atomic_write(
+            manifest_path, json.dumps(manifest, sort_keys=True).encode("utf-8")
+        )
+
+
+def _read(lineage_path: str, name: str) -> bytes:
+    with open(os.path.join(lineage_path, name), "rb") as file_h:
+        return file_h.read()
+
+
+def _load_manifest(path: str) -> dict[str, dict[str, str]]:
+    try:
+        with open(path) as file_h:
+            return json.load(file_h)
+    except (OSError, ValueError):
+        return {}
+
+
+def _link(target: str, link_path: str) -> None:
+    try:
+        if os.readlink(link_path) == target:
+            return
+    except OSError:
+        pass
+
+    # The link is replaced atomically, whether it already exists or not.
+    temp_path = f"{link_path}.{os.getpid()}.tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    os.symlink(target, temp_path)
+    os.replace(temp_path, link_path)
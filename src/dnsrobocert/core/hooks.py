@@ -3,26 +3,65 @@
 from __future__ import annotations
 
 import argparse
+import json
 import os
 import os.path
+import random
 import subprocess
 import sys
 import time
 import traceback
-from typing import Any, cast
-
-from cryptography import x509
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.serialization import pkcs12
-
-from dnsrobocert.core import config, utils
-from dnsrobocert.core.challenge import check_one_challenge, txt_challenge
+from collections.abc import Collection, Iterator
+from contextlib import contextmanager
+from typing import IO, Any
+
+from dnsrobocert.core import (
+    config,
+    engine,
+    exports,
+    hookserver,
+    metrics,
+    tracing,
+    utils,
+)
+
+try:
+    import fcntl
+
+    POSIX_MODE = True
+except ImportError:
+    POSIX_MODE = False
+
+_INITIAL_PROPAGATION_DELAY = 2
+_DEFAULT_BACKOFF_CHECKS = 10
+_DEFAULT_PROPAGATION_TIMEOUT = 600
+_CHECK_ROUND_TIMEOUT = 10
+
+# Environment variable holding the workspace of the lineage being processed by Certbot.
+# When set, the hooks handle all the challenges of the lineage in batch.
+WORKSPACE_ENV = "DNSROBOCERT_LINEAGE_WORKSPACE"
+_CHALLENGES_FILE = "dnsrobocert-challenges.json"
+# Environment variable holding the path of the queue collecting the deploy actions
+# (restarts of containers and services, commands in containers) of the certificates
+# processed during a pass. When set, these actions are executed once by DNSroboCert
+# at the end of the pass, instead of once for each certificate.
+DEPLOY_QUEUE_ENV = "DNSROBOCERT_DEPLOY_QUEUE"
 
 
 def main(args: list[str] | None = None) -> int:
     if not args:
         args = sys.argv[1:]
 
+    socket_path = os.environ.get(hookserver.SOCKET_ENV)
+    if socket_path:
+        returncode = hookserver.forward(socket_path, args)
+        if returncode is not None:
+            return returncode
+        print(
+            f"Hooks server at {socket_path} is not reachable, executing the hook locally.",
+            file=sys.stderr,
+        )
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-t", "--type", choices=["auth", "cleanup", "deploy"], required=True
@@ -41,7 +80,11 @@ def main(args: list[str] | None = None) -> int:
         return 1
 
     try:
-        globals()[parsed_args.type](dnsrobocert_config, parsed_args.lineage)
+        with (
+            metrics.HOOK_DURATION.time(hook=parsed_args.type),
+            tracing.span(f"hook.{parsed_args.type}", lineage=parsed_args.lineage),
+        ):
+            globals()[parsed_args.type](dnsrobocert_config, parsed_args.lineage)
     except BaseException as e:
         print(
             f"Error while executing the {parsed_args.type} hook:",
@@ -49,12 +92,25 @@ def main(args: list[str] | None = None) -> int:
         )
         print(e, file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
+        _record_failed_phase(parsed_args.type, parsed_args.lineage)
         return 1
 
+    if parsed_args.type == "auth":
+        # Certbot submits the challenges to the ACME server once the hook succeeds.
+        _record_validation(parsed_args.lineage)
+
     return 0
 
 
 def auth(dnsrobocert_config: dict[str, Any], lineage: str) -> None:
+    # Lexicon, dnspython and tldextract are imported only by the hooks that need them,
+    # not when a hook is only forwarded to the hooks server.
+    from dnsrobocert.core.challenge import (
+        check_challenges,
+        txt_challenge,
+        txt_challenges,
+    )
+
     certificate = config.get_certificate(dnsrobocert_config, lineage)
     profile = config.find_profile_for_lineage(dnsrobocert_config, lineage)
     domain = os.environ["CERTBOT_DOMAIN"]
@@ -72,61 +128,104 @@ def auth(dnsrobocert_config: dict[str, Any], lineage: str) -> None:
 
     print(f"Executing auth hook for domain {domain}, lineage {lineage}.")
 
-    txt_challenge(certificate, profile, token, domain, action="create")
-
+    all_domains_str = os.environ.get("CERTBOT_ALL_DOMAINS", "")
+    all_domains = all_domains_str.split(",")
     remaining_challenges = int(os.environ.get("CERTBOT_REMAINING_CHALLENGES", "0"))
-    if remaining_challenges != 0:
-        print(
-            f"Still {remaining_challenges} challenges to handle, skip checks until last challenge."
+    workspace = os.environ.get(WORKSPACE_ENV)
+
+    if workspace:
+        # TXT records are created all at once with the last challenge, using one
+        # provider session for each DNS zone.
+        pending = (
+            []
+            if remaining_challenges == len(all_domains) - 1
+            else _load_challenges(workspace)["challenges"]
         )
-        return
+        pending.append([domain, token])
+        _save_challenges(workspace, {"challenges": pending, "cleaned": False})
+        if remaining_challenges != 0:
+            print(
+                f"Still {remaining_challenges} challenges to handle, "
+                "TXT records will be created with the last challenge."
+            )
+            return
 
-    all_domains_str = os.environ.get("CERTBOT_ALL_DOMAINS", "")
-    all_domains = all_domains_str.split(",")
-    challenges_to_check = [f"_acme-challenge.{domain}" for domain in all_domains]
+        txt_challenges(certificate, profile, pending, action="create")
+    else:
+        pending = [[domain, token]]
+        txt_challenge(certificate, profile, token, domain, action="create")
 
+        if remaining_challenges != 0:
+            print(
+                f"Still {remaining_challenges} challenges to handle, skip checks until last challenge."
+            )
+            return
+
+    # Tokens are known for the challenges handled by this process. If several tokens
+    # are expected for the same name (wildcard and apex domains), only existence is checked.
+    challenges_to_check: dict[str, str | None] = {
+        f"_acme-challenge.{one_domain}": None for one_domain in all_domains
+    }
+    tokens: dict[str, set[str]] = {}
+    for one_domain, one_token in pending:
+        tokens.setdefault(f"_acme-challenge.{one_domain}", set()).add(one_token)
+    for challenge, challenge_tokens in tokens.items():
+        if challenge in challenges_to_check and len(challenge_tokens) == 1:
+            challenges_to_check[challenge] = challenge_tokens.pop()
+
+    strategy = profile.get("propagation_strategy", "fixed")
     sleep_time = profile.get("sleep_time", 30)
     max_checks = profile.get("max_checks", 0)
-    if max_checks:
-        print(f"Challenges to check: {challenges_to_check}")
-        checks = 0
-        while True:
-            checks = checks + 1
-            if checks > max_checks:
-                print(
-                    f"All challenges were not propagated after the maximum tries of {max_checks}",
-                    file=sys.stderr,
-                )
-                raise RuntimeError("Auth hook failed.")
+    if strategy == "fixed" and not max_checks:
+        print(
+            f"Wait {sleep_time} seconds to let all challenges be propagated: {list(challenges_to_check)}"
+        )
+        time.sleep(sleep_time)
+        return
+
+    print(f"Challenges to check: {list(challenges_to_check)}")
+    start = time.monotonic()
+    checks = 0
+    for delay in _propagation_delays(profile):
+        checks = checks + 1
+        print(
+            f"Wait {delay:.1f} seconds before checking that all challenges have the expected value "
+            f"(try {checks}, {strategy} strategy)"
+        )
+        time.sleep(delay)
 
+        # Only the challenges still missing are queried again in the next round.
+        with tracing.span(
+            "check_challenges", attempt=checks, challenges=len(challenges_to_check)
+        ):
+            results = check_challenges(challenges_to_check, _CHECK_ROUND_TIMEOUT)
+        challenges_to_check = {
+            challenge: expected_token
+            for challenge, expected_token in challenges_to_check.items()
+            if not results[challenge]
+        }
+
+        if not challenges_to_check:
+            latency = time.monotonic() - start
+            metrics.PROPAGATION_DURATION.observe(latency, profile=profile["name"])
+            print(f"All challenges have been propagated (try {checks}).")
             print(
-                f"Wait {sleep_time} seconds before checking that all challenges have the expected value "
-                f"(try {checks}/{max_checks})"
+                f"Propagation latency for provider {profile['provider']} "
+                f"(profile {profile['name']}): {latency:.1f} seconds."
             )
-            time.sleep(sleep_time)
-
-            challenges_to_check = [
-                challenge
-                for challenge in challenges_to_check
-                if not check_one_challenge(
-                    challenge,
-                    token if challenge == "_acme-challenge.{domain}" else None,
-                )
-            ]
+            return
 
-            if not challenges_to_check:
-                print(
-                    f"All challenges have been propagated (try {checks}/{max_checks})."
-                )
-                break
-    else:
-        print(
-            f"Wait {sleep_time} seconds to let all challenges be propagated: {challenges_to_check}"
-        )
-        time.sleep(sleep_time)
+    print(
+        f"All challenges were not propagated after {checks} tries "
+        f"and {time.monotonic() - start:.1f} seconds ({strategy} strategy)",
+        file=sys.stderr,
+    )
+    raise RuntimeError("Auth hook failed.")
 
 
 def cleanup(dnsrobocert_config: dict[str, str], lineage: str) -> None:
+    from dnsrobocert.core.challenge import txt_challenge, txt_challenges
+
     certificate = config.get_certificate(dnsrobocert_config, lineage)
     profile = config.find_profile_for_lineage(dnsrobocert_config, lineage)
     domain = os.environ["CERTBOT_DOMAIN"]
@@ -134,125 +233,291 @@ def cleanup(dnsrobocert_config: dict[str, str], lineage: str) -> None:
 
     print(f"Executing cleanup hook for domain {domain}, lineage {lineage}.")
 
-    txt_challenge(certificate, profile, token, domain, action="delete")
+    workspace = os.environ.get(WORKSPACE_ENV)
+    state = _load_challenges(workspace) if workspace else None
+    if not workspace or not state:
+        txt_challenge(certificate, profile, token, domain, action="delete")
+        return
+
+    # All TXT records are deleted with the first cleanup, the next ones are no-op.
+    if not state["cleaned"]:
+        try:
+            txt_challenges(certificate, profile, state["challenges"], action="delete")
+        finally:
+            _save_challenges(workspace, {**state, "cleaned": True})
+    else:
+        print("TXT records of all challenges have already been deleted.")
+
+    if int(os.environ.get("CERTBOT_REMAINING_CHALLENGES", "0")) == 0:
+        os.remove(os.path.join(workspace, _CHALLENGES_FILE))
 
 
 def deploy(dnsrobocert_config: dict[str, Any], _no_lineage: Any) -> None:
-    lineage_path = os.environ["RENEWED_LINEAGE"]
+    deploy_lineage(
+        dnsrobocert_config,
+        os.environ["RENEWED_LINEAGE"],
+        queue_path=os.environ.get(DEPLOY_QUEUE_ENV),
+    )
+
+
+def deploy_lineage(
+    dnsrobocert_config: dict[str, Any],
+    lineage_path: str,
+    settings: Collection[str] = config.DEPLOY_SETTINGS,
+    queue_path: str | None = None,
+) -> None:
+    """
+    Apply the deploy settings of the certificate stored in the given lineage path.
+    A subset of the settings can be given, to apply only the settings that changed
+    on a certificate that is not issued again. If a queue path is given, the restarts
+    and commands in containers are added to this queue instead of being executed.
+    """
     lineage = os.path.basename(lineage_path)
     certificate = config.get_certificate(dnsrobocert_config, lineage)
+    if not certificate:
+        raise RuntimeError(
+            f"Error, certificate named {lineage} could not be found in configuration."
+        )
 
-    _pfx_export(certificate, lineage_path, lineage)
-    _fix_permissions(
-        dnsrobocert_config.get("acme", {}).get("certs_permissions", {}), lineage_path
-    )
-    _autorestart(certificate)
-    _autocmd(certificate)
-    _deploy_hook(certificate)
-
-
-def _pfx_export(certificate: dict[str, Any], lineage_path: str, lineage: str) -> None:
-    pfx = certificate.get("pfx", {})
-    if pfx.get("export"):
-        with open(os.path.join(lineage_path, "privkey.pem"), "rb") as f:
-            key = serialization.load_pem_private_key(f.read(), None)
-        with open(os.path.join(lineage_path, "cert.pem"), "rb") as f:
-            cert = x509.load_pem_x509_certificate(f.read())
-        with open(os.path.join(lineage_path, "chain.pem"), "rb") as f:
-            ca_certs = x509.load_pem_x509_certificates(f.read())
-
-        passphrase: str = pfx.get("passphrase")
-        p12 = pkcs12.serialize_key_and_certificates(
-            lineage.encode("utf-8"),
-            cast(
-                pkcs12.PKCS12PrivateKeyTypes, key
-            ),  # By construction, Certbot will generate only RSA/ECDSA private keys.
-            cert,
-            ca_certs,
-            (
-                serialization.BestAvailableEncryption(passphrase.encode("utf-8"))
-                if passphrase
-                else serialization.NoEncryption()
-            ),
+    if "pfx" in settings or "exports" in settings:
+        with tracing.span("export", lineage=lineage):
+            exports.export(certificate, lineage_path, lineage)
+    with tracing.span("fix_permissions", lineage=lineage):
+        _fix_permissions(
+            dnsrobocert_config.get("acme", {}).get("certs_permissions", {}),
+            lineage_path,
         )
+    if "autorestart" in settings:
+        with tracing.span("autorestart", lineage=lineage):
+            _autorestart(certificate, queue_path)
+    if "autocmd" in settings:
+        with tracing.span("autocmd", lineage=lineage):
+            _autocmd(certificate, queue_path)
+    if "deploy_hook" in settings:
+        with tracing.span("deploy_hook", lineage=lineage):
+            _deploy_hook(certificate, lineage_path)
+
+
+def _record_failed_phase(hook_type: str, lineage: str) -> None:
+    from dnsrobocert.core import state
+
+    state_path = os.environ.get(state.STATE_ENV)
+    if not state_path:
+        return
+
+    try:
+        state.StateStore(state_path).record_phase(lineage, hook_type)
+    except Exception as e:
+        print(f"Could not record the failure of the hook: {e}", file=sys.stderr)
+
+
+def _record_validation(lineage: str) -> None:
+    from dnsrobocert.core import state
+
+    state_path = os.environ.get(state.STATE_ENV)
+    if not state_path:
+        return
+
+    try:
+        state.StateStore(state_path).record_validation(lineage)
+    except Exception as e:
+        print(f"Could not record the validation of the hook: {e}", file=sys.stderr)
+
+
+def _load_challenges(workspace: str) -> dict[str, Any]:
+    try:
+        with open(os.path.join(workspace, _CHALLENGES_FILE)) as file_h:
+            return json.load(file_h)
+    except FileNotFoundError:
+        return {}
 
-        cert_path = os.readlink(os.path.join(lineage_path, "cert.pem"))
-        pfx_cert_name = os.path.basename(cert_path).replace(".pem", ".pfx")
-        archive_path = os.path.dirname(cert_path)
-        archive_path_abs = os.path.normpath(os.path.join(lineage_path, archive_path))
 
-        with open(os.path.join(archive_path_abs, pfx_cert_name), "wb") as f:
-            f.write(p12)
-        os.symlink(
-            os.path.join(archive_path, pfx_cert_name),
-            os.path.join(lineage_path, "cert.pfx"),
+def _save_challenges(workspace: str, state: dict[str, Any]) -> None:
+    os.makedirs(workspace, exist_ok=True)
+    with open(os.path.join(workspace, _CHALLENGES_FILE), "w") as file_h:
+        json.dump(state, file_h)
+
+
+def _propagation_delays(profile: dict[str, Any]) -> Iterator[float]:
+    strategy = profile.get("propagation_strategy", "fixed")
+    sleep_time = profile.get("sleep_time", 30)
+    max_checks = profile.get("max_checks", 0)
+
+    if strategy == "fixed":
+        for _ in range(max_checks):
+            yield sleep_time
+        return
+
+    # Adaptive strategies start checking almost immediately, then back off
+    # exponentially up to sleep_time between two checks.
+    delay = min(_INITIAL_PROPAGATION_DELAY, sleep_time)
+    if strategy == "backoff":
+        for _ in range(max_checks or _DEFAULT_BACKOFF_CHECKS):
+            yield _jitter(delay)
+            delay = min(delay * 2, sleep_time)
+    else:
+        deadline = time.monotonic() + profile.get(
+            "propagation_timeout", _DEFAULT_PROPAGATION_TIMEOUT
         )
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield min(_jitter(delay), remaining)
+            delay = min(delay * 2, sleep_time)
+
+
+def _jitter(delay: float) -> float:
+    return delay * (0.5 + random.random() / 2)
 
 
 def _fix_permissions(
     certificate_permissions: dict[str, str], lineage_path: str
 ) -> None:
+    # Only the lineage directories and the content of the live directory are fixed: the
+    # symbolic links target the files of the current certificate, and the previous
+    # certificates in the archive directory were fixed when they were deployed. Regular
+    # files of the live directory (eg. the README of Certbot) are fixed as well.
     archive_path = lineage_path.replace(os.path.sep + "live", os.path.sep + "archive")
-    utils.fix_permissions(certificate_permissions, archive_path)
-    utils.fix_permissions(certificate_permissions, lineage_path)
+    with os.scandir(lineage_path) as entries:
+        live_paths = sorted(
+            entry.path for entry in entries if os.path.exists(entry.path)
+        )
+    utils.fix_paths_permissions(
+        certificate_permissions, [archive_path, lineage_path, *live_paths]
+    )
 
 
-def _autorestart(certificate: dict[str, Any]) -> None:
+def _autorestart(certificate: dict[str, Any], queue_path: str | None = None) -> None:
     autorestart = certificate.get("autorestart")
     if autorestart:
-        if not os.path.exists("/var/run/docker.sock") and not os.path.exists(
-            "/run/podman/podman.sock"
+        if not os.path.exists(engine.DOCKER_SOCKET) and not os.path.exists(
+            engine.PODMAN_SOCKET
         ):
             raise RuntimeError(
-                "Error, /var/run/docker.sock and /run/podman/podman.sock sockets are missing."
+                f"Error, {engine.DOCKER_SOCKET} and {engine.PODMAN_SOCKET} sockets are missing."
             )
 
-        if os.path.exists("/var/run/docker.sock"):
+        actions: list[dict[str, Any]] = []
+        if os.path.exists(engine.DOCKER_SOCKET):
             for onerestart in autorestart:
                 containers = onerestart.get("containers", [])
                 for container in containers:
-                    utils.execute(["docker", "restart", container])
+                    actions.append({"action": "restart", "container": container})
 
                 swarm_services = onerestart.get("swarm_services", [])
                 for service in swarm_services:
-                    utils.execute(
-                        [
-                            "docker",
-                            "service",
-                            "update",
-                            "--detach=false",
-                            "--force",
-                            service,
-                        ]
-                    )
-
-        if os.path.exists("/run/podman/podman.sock"):
+                    actions.append({"action": "update_service", "service": service})
+
+        if os.path.exists(engine.PODMAN_SOCKET):
             for onerestart in autorestart:
                 containers = onerestart.get("podman_containers", [])
                 for container in containers:
-                    utils.execute(["podman", "--remote", "restart", container])
+                    actions.append({"action": "podman_restart", "container": container})
+
+        _run_actions(actions, queue_path)
 
 
-def _autocmd(certificate: dict[str, Any]) -> None:
+def _autocmd(certificate: dict[str, Any], queue_path: str | None = None) -> None:
     autocmd = certificate.get("autocmd")
     if autocmd:
-        if not os.path.exists("/var/run/docker.sock"):
-            raise RuntimeError("Error, /var/run/docker.sock socket is missing.")
+        if not os.path.exists(engine.DOCKER_SOCKET):
+            raise RuntimeError(f"Error, {engine.DOCKER_SOCKET} socket is missing.")
 
+        actions: list[dict[str, Any]] = []
         for onecmd in autocmd:
             command = onecmd.get("cmd")
 
             containers = onecmd.get("containers", [])
             for container in containers:
-                if isinstance(command, list):
-                    utils.execute(["docker", "exec", container, *command])
-                else:
-                    utils.execute(f"docker exec {container} {command}", shell=True)
+                actions.append(
+                    {"action": "exec", "container": container, "command": command}
+                )
+
+        _run_actions(actions, queue_path)
+
+
+def flush_deploy_actions(queue_path: str) -> None:
+    """
+    Execute the deploy actions collected in the given queue, then empty it. Each
+    distinct action is executed once, in the order it was first collected, even if
+    it has been collected for several certificates.
+    """
+    if not os.path.exists(queue_path):
+        return
+
+    with _lock_queue(queue_path) as queue_h:
+        queue_h.seek(0)
+        lines = queue_h.readlines()
+        queue_h.seek(0)
+        queue_h.truncate()
+
+    actions = [json.loads(line) for line in dict.fromkeys(lines) if line.strip()]
+    if not actions:
+        return
+
+    print(
+        f"Executing {len(actions)} deploy action(s) collected "
+        f"from {len(lines)} request(s)."
+    )
+    with tracing.span("deploy_actions", actions=len(actions), requests=len(lines)):
+        for action in actions:
+            try:
+                _execute_action(action)
+            except BaseException as e:
+                # Other actions are executed even if one of them fails.
+                print(
+                    f"Error while executing the deploy action {action}:",
+                    file=sys.stderr,
+                )
+                print(e, file=sys.stderr)
+
+
+def _run_actions(actions: list[dict[str, Any]], queue_path: str | None) -> None:
+    if not queue_path:
+        for action in actions:
+            _execute_action(action)
+        return
+
+    with _lock_queue(queue_path) as queue_h:
+        for action in actions:
+            # Keys are sorted, so identical actions are identical lines.
+            queue_h.write(json.dumps(action, sort_keys=True) + "\n")
+
+
+@contextmanager
+def _lock_queue(queue_path: str) -> Iterator[IO[str]]:
+    os.makedirs(os.path.dirname(queue_path), exist_ok=True)
+    with open(queue_path, "a+") as queue_h:
+        if POSIX_MODE:
+            fcntl.flock(queue_h, fcntl.LOCK_EX)
+        yield queue_h
+
+
+def _execute_action(action: dict[str, Any]) -> None:
+    if action["action"] == "restart":
+        engine.client(engine.DOCKER_SOCKET).restart_container(action["container"])
+    elif action["action"] == "update_service":
+        engine.client(engine.DOCKER_SOCKET).update_service(action["service"])
+    elif action["action"] == "podman_restart":
+        engine.client(engine.PODMAN_SOCKET).restart_container(action["container"])
+    elif action["action"] == "exec":
+        command = action["command"]
+        # Commands of string type are executed in a shell of the target container.
+        engine.client(engine.DOCKER_SOCKET).exec(
+            action["container"],
+            command if isinstance(command, list) else ["sh", "-c", command],
+        )
+    else:
+        raise ValueError(f"Unknown deploy action {action['action']}.")
 
 
-def _deploy_hook(certificate: dict[str, Any]) -> None:
+def _deploy_hook(certificate: dict[str, Any], lineage_path: str) -> None:
     deploy_hook = certificate.get("deploy_hook")
     env = os.environ.copy()
+    # Certbot variables are missing when the deploy settings are applied by DNSroboCert.
+    env.setdefault("RENEWED_LINEAGE", lineage_path)
+    env.setdefault("RENEWED_DOMAINS", " ".join(certificate.get("domains", [])))
     env.update(
         {
             "DNSROBOCERT_CERTIFICATE_NAME": certificate.get("name", ""),
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import codecs
+import importlib
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import IO, Any
+
+import coloredlogs
+
+LOGGER = logging.getLogger(__name__)
+coloredlogs.install(logger=LOGGER)
+
+# Environment variable holding the path of the hooks server socket. It is inherited by
+# the Certbot processes, and so by the hooks processes they spawn.
+SOCKET_ENV = "DNSROBOCERT_HOOKS_SOCKET"
+
+_WARM_STATE: dict[str, int] = {}
+
+
+def supported() -> bool:
+    return hasattr(socket, "AF_UNIX") and hasattr(os, "fork")
+
+
+@contextmanager
+def serve(workspace: str, config_path: str) -> Iterator[None]:
+    """
+    Start the hooks server in a dedicated process for the duration of the context.
+    Hooks are executed in children forked from this process, that has already imported
+    everything needed and loaded the configuration, instead of fresh Python processes.
+    """
+    if not supported():
+        yield
+        return
+
+    from dnsrobocert.core import utils
+
+    socket_path = os.path.join(workspace, "hooks.sock")
+    context = utils.forkserver_context()
+    ready = context.Event()
+    process = context.Process(
+        target=_serve,
+        args=(socket_path, config_path, ready),
+        name="dnsrobocert-hooks",
+        daemon=True,
+    )
+    process.start()
+
+    if not ready.wait(30):
+        LOGGER.warning("Hooks server did not start, hooks will run in new processes.")
+        process.terminate()
+        yield
+        return
+
+    os.environ[SOCKET_ENV] = socket_path
+    try:
+        yield
+    finally:
+        os.environ.pop(SOCKET_ENV, None)
+        process.terminate()
+        process.join()
+
+
+def forward(socket_path: str, args: list[str]) -> int | None:
+    """
+    Execute a hook in the hooks server: the environment is forwarded, the output of the
+    hook is streamed back to stdout/stderr, and its exit code is returned.
+    None is returned if the hooks server could not be reached.
+    """
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+    except OSError:
+        return None
+
+    with client, client.makefile("rwb") as stream:
+        stream.write(_encode({"args": args, "env": dict(os.environ)}))
+        stream.flush()
+
+        for line in stream:
+            frame = json.loads(line)
+            if "exit" in frame:
+                return frame["exit"]
+
+            output = sys.stderr if frame["stream"] == "stderr" else sys.stdout
+            output.write(frame["data"])
+            output.flush()
+
+    print("Connection to the hooks server was lost.", file=sys.stderr)
+    return 1
+
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    def __init__(self, socket_path: str, config_path: str) -> None:
+        super().__init__(socket_path, _Handler)
+        self.config_path = config_path
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        # Executed before forking, so every hook inherits a warm state.
+        _warm_up(self.config_path)
+        super().process_request(request, client_address)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        request = json.loads(self.rfile.readline())
+        write_lock = threading.Lock()
+
+        def send(frame: dict[str, Any]) -> None:
+            with write_lock:
+                self.wfile.write(_encode(frame))
+                self.wfile.flush()
+
+        os.environ.clear()
+        os.environ.update(request["env"])
+        os.environ.pop(SOCKET_ENV, None)
+
+        # Both Python code and the subprocesses spawned by the hooks write on the file
+        # descriptors 1 and 2: these are redirected to pipes pumped into the socket.
+        pumps = [
+            _redirect(sys.stdout, 1, "stdout", send),
+            _redirect(sys.stderr, 2, "stderr", send),
+        ]
+
+        from dnsrobocert.core import hooks
+
+        returncode = 1
+        try:
+            returncode = hooks.main(request["args"])
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.close(1)
+            os.close(2)
+            for pump in pumps:
+                # A process started in background by a hook may hold the pipe open.
+                pump.join(5)
+
+            send({"exit": returncode})
+
+
+def _serve(socket_path: str, config_path: str, ready: Any) -> None:
+    # The daemon handles the interruptions, and will terminate this process.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    with _Server(socket_path, config_path) as server:
+        _warm_up(config_path)
+        ready.set()
+        server.serve_forever()
+
+
+def _warm_up(config_path: str) -> None:
+    # Modules imported lazily by the hooks are imported once here.
+    from dnsrobocert.core import challenge, config, hooks, suffixes  # noqa: F401
+
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except OSError:
+        return
+
+    if _WARM_STATE.get(config_path) == mtime:
+        return
+    _WARM_STATE[config_path] = mtime
+
+    dnsrobocert_config = config.load(config_path)
+    for profile in (dnsrobocert_config or {}).get("profiles", []):
+        try:
+            importlib.import_module(f"lexicon._private.providers.{profile['provider']}")
+        except ImportError:
+            pass
+
+    certificates = (dnsrobocert_config or {}).get("certificates", [])
+    if any(certificate.get("follow_cnames") for certificate in certificates):
+        # The Public Suffix List shipped with DNSroboCert is loaded once for all hooks.
+        suffixes.extractor(None)
+
+
+def _redirect(stream: IO[str], fd: int, name: str, send: Any) -> threading.Thread:
+    stream.flush()
+    read_fd, write_fd = os.pipe()
+    os.dup2(write_fd, fd)
+    os.close(write_fd)
+
+    def pump() -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with os.fdopen(read_fd, "rb") as pipe:
+            while True:
+                data = pipe.read1(65536)
+                text = decoder.decode(data, final=not data)
+                if text:
+                    send({"stream": name, "data": text})
+                if not data:
+                    return
+
+    thread = threading.Thread(target=pump, daemon=True)
+    thread.start()
+    return thread
+
+
+def _encode(frame: dict[str, Any]) -> bytes:
+    return json.dumps(frame).encode("utf-8") + b"\n"
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, NamedTuple
+
+import coloredlogs
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+LOGGER = logging.getLogger(__name__)
+coloredlogs.install(logger=LOGGER)
+
+# By default, a certificate is renewed once less than this fraction of its lifetime
+# remains, which is 30 days for the usual 90 days certificates of Let's Encrypt.
+RENEWAL_FRACTION = 1 / 3
+# Lineages that are not due are still handed to Certbot at this interval, so Certbot can
+# renew them earlier when the ACME server asks for it (ARI) or when they are revoked.
+CERTBOT_CHECK_INTERVAL = 86400
+
+
+class LineageInfo(NamedTuple):
+    lineage: str
+    not_before: datetime
+    not_after: datetime
+    domains: frozenset[str]
+    key_type: str
+    server: str | None
+
+
+def build(directory_path: str) -> dict[str, LineageInfo]:
+    """
+    Parse the live certificates of every lineage found in the given Certbot
+    directory, without spawning any Certbot process.
+    """
+    lineages: dict[str, LineageInfo] = {}
+
+    live_path = os.path.join(directory_path, "live")
+    if not os.path.isdir(live_path):
+        return lineages
+
+    with os.scandir(live_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            info = load(directory_path, entry.name)
+            if info:
+                lineages[entry.name] = info
+
+    return lineages
+
+
+def load(directory_path: str, lineage: str) -> LineageInfo | None:
+    cert_path = os.path.join(directory_path, "live", lineage, "cert.pem")
+    try:
+        with open(cert_path, "rb") as file_h:
+            cert = x509.load_pem_x509_certificate(file_h.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        LOGGER.warning(f"Could not parse the certificate {cert_path}: {e}")
+        return None
+
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+        domains = frozenset(
+            domain.lower() for domain in san.value.get_values_for_type(x509.DNSName)
+        )
+    except x509.ExtensionNotFound:
+        domains = frozenset()
+
+    public_key = cert.public_key()
+    if isinstance(public_key, rsa.RSAPublicKey):
+        key_type = "rsa"
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        key_type = "ecdsa"
+    else:
+        key_type = "unknown"
+
+    return LineageInfo(
+        lineage=lineage,
+        not_before=cert.not_valid_before_utc,
+        not_after=cert.not_valid_after_utc,
+        domains=domains,
+        key_type=key_type,
+        server=_renewal_server(directory_path, lineage),
+    )
+
+
+def renewal_due(info: LineageInfo, fraction: float = RENEWAL_FRACTION) -> datetime:
+    lifetime = info.not_after - info.not_before
+    return info.not_after - lifetime * fraction
+
+
+def check_due(info: LineageInfo, last_check: float | None) -> float:
+    """
+    Return when Certbot needs to check again the renewal of the given lineage, from the
+    time of the last Certbot invocation for it (if known).
+    """
+    return max(last_check or 0, info.not_before.timestamp()) + CERTBOT_CHECK_INTERVAL
+
+
+def issuance_reason(
+    info: LineageInfo | None,
+    certificate: dict[str, Any],
+    acme_url: str,
+    now: datetime | None = None,
+    renewal_fraction: float = RENEWAL_FRACTION,
+) -> str | None:
+    """
+    Return why Certbot needs to be invoked for the given certificate configuration,
+    or None if the live certificate is healthy and matches this configuration.
+    """
+    if not info:
+        return "certificate does not exist yet"
+
+    if certificate.get("force_renew", False):
+        return "force renewal is requested"
+
+    if info.server is None:
+        return "renewal configuration is missing"
+
+    if info.server != acme_url:
+        return f"ACME server changed from {info.server}"
+
+    domains = frozenset(domain.lower() for domain in certificate.get("domains", []))
+    if domains != info.domains:
+        return "domains changed"
+
+    if certificate.get("key_type", "rsa") != info.key_type:
+        return f"key type changed from {info.key_type}"
+
+    if not now:
+        now = datetime.now(timezone.utc)
+    if now >= renewal_due(info, renewal_fraction):
+        return f"certificate expires on {info.not_after.isoformat()}"
+
+    return None
+
+
+def _renewal_server(directory_path: str, lineage: str) -> str | None:
+    renewal_path = os.path.join(directory_path, "renewal", f"{lineage}.conf")
+    try:
+        with open(renewal_path) as file_h:
+            for line in file_h:
+                key, _, value = line.partition("=")
+                if key.strip() == "server":
+                    return value.strip()
+    except OSError:
+        return None
+
+    return None
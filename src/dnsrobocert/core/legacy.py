@@ -1,22 +1,16 @@
 from __future__ import annotations
 
+import argparse
 import logging
 import os
 import re
 import shlex
 from copy import deepcopy
-from functools import reduce
+from functools import lru_cache, reduce
 from typing import Any
 
 import coloredlogs
 import yaml
-from lexicon._private.parser import generate_cli_main_parser
-from lexicon.config import (
-    ArgsConfigSource,
-    ConfigResolver,
-    EnvironmentConfigSource,
-    FileConfigSource,
-)
 
 from dnsrobocert.core import utils
 
@@ -24,8 +18,6 @@ LEGACY_CONFIGURATION_PATH = "/etc/letsencrypt/domains.conf"
 LOGGER = logging.getLogger(__name__)
 coloredlogs.install(logger=LOGGER)
 
-LEXICON_ARGPARSER = generate_cli_main_parser()
-
 
 def migrate(config_path: str) -> str | None:
     if os.path.exists(config_path):  # pragma: nocover
@@ -155,6 +147,13 @@ def _handle_specific_envs_variables(
 def _gather_parameters(
     provider: str,
 ) -> tuple[dict[str, str], dict[str, Any], dict[str, dict[str, Any]]]:
+    from lexicon.config import (
+        ArgsConfigSource,
+        ConfigResolver,
+        EnvironmentConfigSource,
+        FileConfigSource,
+    )
+
     env_variables_of_interest = {
         name: value
         for name, value in os.environ.items()
@@ -174,7 +173,7 @@ def _gather_parameters(
         *shlex.split(os.environ.get("LEXICON_PROVIDER_OPTIONS", "")),
     ]
     try:
-        args, _ = LEXICON_ARGPARSER.parse_known_args(command)
+        args, _ = _lexicon_argparser().parse_known_args(command)
     except SystemExit:  # pragma: nocover
         args = None
 
@@ -285,3 +284,12 @@ def _deep_merge(*dicts: dict[str, Any]) -> dict[str, Any]:
         return d1
 
     return reduce(merge_into, dicts[1:], dicts[0])
+
+
+@lru_cache(maxsize=None)
+def _lexicon_argparser() -> argparse.ArgumentParser:
+    # Lexicon, and all its providers for the parser, are imported only when a legacy
+    # configuration is actually migrated, not each time DNSroboCert starts.
+    from lexicon._private.parser import generate_cli_main_parser
+
+    return generate_cli_main_parser()
@@ -11,13 +11,25 @@ import tempfile
 import threading
 import time
 import traceback
+from datetime import datetime
 from typing import Any
 
 import coloredlogs
 import yaml
 
 from dnsrobocert import get_version
-from dnsrobocert.core import background, certbot, config, legacy, utils
+from dnsrobocert.core import (
+    background,
+    certbot,
+    config,
+    hookserver,
+    legacy,
+    metrics,
+    state,
+    tracing,
+    utils,
+    watcher,
+)
 
 LOGGER = logging.getLogger(__name__)
 coloredlogs.install(logger=LOGGER)
@@ -28,26 +40,39 @@ def _process_config(
     directory_path: str,
     runtime_config_path: str,
     lock: threading.Lock,
-) -> None:
+    previous_config: dict[str, Any] | None = None,
+) -> dict[str, Any] | None:
     dnsrobocert_config = config.load(config_path)
 
     if not dnsrobocert_config:
-        return
+        return previous_config
 
     if dnsrobocert_config.get("draft"):
         LOGGER.info("Configuration file is in draft mode: no action will be done.")
-        return
-
-    with open(runtime_config_path, "w") as f:
-        f.write(yaml.dump(dnsrobocert_config))
-
-    utils.configure_certbot_workspace(dnsrobocert_config, directory_path)
-
-    LOGGER.info("Registering ACME account if needed.")
-    certbot.account(runtime_config_path, directory_path, lock)
+        return previous_config
+
+    tracing.configure(dnsrobocert_config)
+    with tracing.span("process_config"):
+        with open(runtime_config_path, "w") as f:
+            f.write(yaml.dump(dnsrobocert_config, Dumper=config.YAML_DUMPER))
+
+        # Only the steps affected by the changes since the previously applied
+        # configuration are executed.
+        if config.permissions_changed(previous_config, dnsrobocert_config):
+            utils.configure_certbot_workspace(dnsrobocert_config, directory_path)
+
+        if config.account_changed(previous_config, dnsrobocert_config):
+            LOGGER.info("Registering ACME account if needed.")
+            certbot.account(runtime_config_path, directory_path, lock)
+
+        changes = config.diff(previous_config, dnsrobocert_config)
+        LOGGER.info(
+            f"Creating missing certificates if needed (~1min for each), "
+            f"{len(changes)} certificate(s) affected by the configuration changes."
+        )
+        certbot._issue(runtime_config_path, directory_path, lock, changes)
 
-    LOGGER.info("Creating missing certificates if needed (~1min for each)")
-    certbot._issue(runtime_config_path, directory_path, lock)
+    return dnsrobocert_config
 
 
 class _Daemon:
@@ -71,31 +96,56 @@ def _watch_config(config_path: str, directory_path: str) -> None:
         runtime_config_path = os.path.join(workspace, "dnsrobocert-runtime.yml")
         certbot_lock = threading.Lock()
 
-        with background.worker(runtime_config_path, directory_path, certbot_lock):
+        with (
+            metrics.serve(workspace),
+            hookserver.serve(workspace, runtime_config_path),
+            background.worker(
+                runtime_config_path, directory_path, certbot_lock
+            ) as scheduler,
+        ):
             daemon = _Daemon()
+            config_watcher = watcher.ConfigWatcher(
+                [config_path, legacy.LEGACY_CONFIGURATION_PATH]
+            )
             previous_digest = ""
-            while not daemon.do_shutdown():
-                try:
-                    generated_config_path = legacy.migrate(config_path)
-                    effective_config_path = (
-                        generated_config_path if generated_config_path else config_path
-                    )
-                    digest = utils.digest(effective_config_path)
-
-                    if digest != previous_digest:
-                        previous_digest = digest
-                        _process_config(
-                            effective_config_path,
-                            directory_path,
-                            runtime_config_path,
-                            certbot_lock,
-                        )
-                except BaseException as error:
-                    LOGGER.error("An error occurred during DNSroboCert watch:")
-                    LOGGER.error(error)
-                    traceback.print_exc(file=sys.stderr)
-
-                time.sleep(1)
+            applied_config = None
+            changed = True
+            try:
+                while not daemon.do_shutdown():
+                    # Configuration is read and hashed only when the watcher reports a change.
+                    if changed:
+                        try:
+                            generated_config_path = legacy.migrate(config_path)
+                            effective_config_path = (
+                                generated_config_path
+                                if generated_config_path
+                                else config_path
+                            )
+                            digest = utils.digest(effective_config_path)
+
+                            if digest != previous_digest:
+                                previous_digest = digest
+                                # Metrics are served before the certificates are
+                                # processed, as the first pass can take minutes.
+                                loaded_config = config.load(effective_config_path)
+                                if loaded_config:
+                                    metrics.configure(loaded_config)
+                                applied_config = _process_config(
+                                    effective_config_path,
+                                    directory_path,
+                                    runtime_config_path,
+                                    certbot_lock,
+                                    applied_config,
+                                )
+                                scheduler.refresh()
+                        except BaseException as error:
+                            LOGGER.error("An error occurred during DNSroboCert watch:")
+                            LOGGER.error(error)
+                            traceback.print_exc(file=sys.stderr)
+
+                    changed = config_watcher.wait(1)
+            finally:
+                config_watcher.close()
 
     LOGGER.info("Exiting DNSroboCert.")
 
@@ -112,12 +162,13 @@ def _run_config(config_path: str, directory_path: str) -> None:
             generated_config_path if generated_config_path else config_path
         )
 
-        _process_config(
-            effective_config_path,
-            directory_path,
-            runtime_config_path,
-            certbot_lock,
-        )
+        with hookserver.serve(workspace, runtime_config_path):
+            _process_config(
+                effective_config_path,
+                directory_path,
+                runtime_config_path,
+                certbot_lock,
+            )
 
 
 def main(args: list[str] | None = None) -> None:
@@ -146,11 +197,19 @@ def main(args: list[str] | None = None) -> None:
         help="if set, DNSroboCert will process only once certificates (creation, renewal, deletion) then return immediately",
     )
 
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="if set, DNSroboCert will print the state of the certificates stored in the directory (last attempt and success, failures, next attempt) then return immediately",
+    )
+
     parsed_args = parser.parse_args(args)
 
     utils.validate_snap_environment(parsed_args)
 
-    if parsed_args.one_shot:
+    if parsed_args.status:
+        _print_status(os.path.abspath(parsed_args.directory))
+    elif parsed_args.one_shot:
         _run_config(
             os.path.abspath(parsed_args.config), os.path.abspath(parsed_args.directory)
         )
@@ -160,5 +219,79 @@ def main(args: list[str] | None = None) -> None:
         )
 
 
+def _print_status(directory_path: str) -> None:
+    database_path = os.path.join(directory_path, "dnsrobocert", state.DATABASE)
+    if not os.path.exists(database_path):
+        print(f"No certificate has been processed yet in {directory_path}.")
+        return
+
+    def _time(timestamp: float | None) -> str:
+        if not timestamp:
+            return "-"
+        return datetime.fromtimestamp(timestamp).isoformat(sep=" ", timespec="seconds")
+
+    store = state.StateStore(database_path)
+    lineage_states = store.all()
+    rows = [
+        (
+            "LINEAGE",
+            "LAST ATTEMPT",
+            "LAST SUCCESS",
+            "FAILURES",
+            "LAST ERROR PHASE",
+            "DURATION",
+            "NEXT ATTEMPT",
+        )
+    ]
+    for lineage_state in lineage_states:
+        rows.append(
+            (
+                lineage_state.lineage,
+                _time(lineage_state.last_attempt),
+                _time(lineage_state.last_success),
+                str(lineage_state.consecutive_failures),
+                lineage_state.last_error_phase or "-",
+                (
+                    f"{lineage_state.last_duration:.1f}s"
+                    if lineage_state.last_duration is not None
+                    else "-"
+                ),
+                _time(lineage_state.next_attempt()),
+            )
+        )
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print(
+            "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        )
+    for lineage_state in lineage_states:
+        if lineage_state.consecutive_failures and lineage_state.last_error:
+            print(
+                f"\nLast error of {lineage_state.lineage}:\n{lineage_state.last_error}"
+            )
+
+    now = time.time()
+    orders = store.orders(now - state.ORDERS_RETENTION)
+    for account in sorted({order.account for order in orders}):
+        account_orders = [order for order in orders if order.account == account]
+        counts = [
+            len([order for order in account_orders if order.created > now - 3 * 3600]),
+            len(
+                [
+                    order
+                    for order in account_orders
+                    if not order.succeeded and order.created > now - 3600
+                ]
+            ),
+            len([order for order in account_orders if order.succeeded]),
+        ]
+        print(
+            f"\nACME orders of {account}: {counts[0]} in the last 3 hours, "
+            f"{counts[1]} failed in the last hour, {counts[2]} certificates issued "
+            "in the last 7 days."
+        )
+
+
 if __name__ == "__main__":
     main()
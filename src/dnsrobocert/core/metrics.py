@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import coloredlogs
+
+LOGGER = logging.getLogger(__name__)
+coloredlogs.install(logger=LOGGER)
+
+# Environment variable holding the path of the socket receiving the measures made by
+# the Certbot and hooks processes. It is inherited like the hooks server socket.
+SOCKET_ENV = "DNSROBOCERT_METRICS_SOCKET"
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 9808
+
+_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        _REGISTRY[name] = self
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, key: tuple[str, ...], **extra: str) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra.items())
+        if not pairs:
+            return ""
+        escaped = (
+            (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def apply(self, value: float, labels: dict[str, str]) -> None:
+        raise NotImplementedError()
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def _record(self, value: float, labels: dict[str, str]) -> None:
+        self.apply(value, labels)
+        _EXPORTER.forward(self.name, value, labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...]) -> None:
+        super().__init__(name, documentation, labels)
+        # For each labels values: the count of each bucket, the sum and the count.
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        self._record(value, labels)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def apply(self, value: float, labels: dict[str, str]) -> None:
+        with self._lock:
+            buckets, totals = self._values.setdefault(
+                self._key(labels), ([0] * len(_BUCKETS), [0.0, 0])
+            )
+            for index, bound in enumerate(_BUCKETS):
+                if value <= bound:
+                    buckets[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = {
+                key: (list(buckets), list(totals))
+                for key, (buckets, totals) in self._values.items()
+            }
+
+        for key, (buckets, (total, count)) in sorted(values.items()):
+            for bound, bucket in zip(_BUCKETS, buckets):
+                labels = self._format_labels(key, le=str(float(bound)))
+                yield f"{self.name}_bucket{labels} {bucket}"
+            yield f"{self.name}_bucket{self._format_labels(key, le='+Inf')} {int(count)}"
+            yield f"{self.name}_sum{self._format_labels(key)} {total}"
+            yield f"{self.name}_count{self._format_labels(key)} {int(count)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...]) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._record(value, labels)
+
+    def apply(self, value: float, labels: dict[str, str]) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{self._format_labels(key)} {value}"
+
+
+_REGISTRY: dict[str, _Metric] = {}
+
+CERTBOT_DURATION = Histogram(
+    "dnsrobocert_certbot_duration_seconds",
+    "Duration of the Certbot operations.",
+    ("operation",),
+)
+HOOK_DURATION = Histogram(
+    "dnsrobocert_hook_duration_seconds",
+    "Duration of the auth, cleanup and deploy hooks.",
+    ("hook",),
+)
+PROVIDER_DURATION = Histogram(
+    "dnsrobocert_provider_request_duration_seconds",
+    "Duration of the operations on the TXT records of a DNS zone through the DNS provider.",
+    ("profile", "action"),
+)
+PROPAGATION_DURATION = Histogram(
+    "dnsrobocert_propagation_duration_seconds",
+    "Time until all TXT records of a certificate are propagated.",
+    ("profile",),
+)
+CONFIG_LOAD_DURATION = Histogram(
+    "dnsrobocert_config_load_duration_seconds",
+    "Duration of the configuration loading.",
+    ("cached",),
+)
+CERTIFICATE_NOT_AFTER = Gauge(
+    "dnsrobocert_certificate_not_after_timestamp_seconds",
+    "Expiration date of the current certificate.",
+    ("lineage",),
+)
+CERTIFICATE_LAST_SUCCESS = Gauge(
+    "dnsrobocert_certificate_last_success_timestamp_seconds",
+    "Last time the certificate was successfully processed by Certbot.",
+    ("lineage",),
+)
+CERTIFICATE_LAST_FAILURE = Gauge(
+    "dnsrobocert_certificate_last_failure_timestamp_seconds",
+    "Last time the processing of the certificate failed.",
+    ("lineage",),
+)
+
+
+def render() -> str:
+    lines = []
+    for metric in _REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def serve(workspace: str) -> Iterator[None]:
+    """
+    Prepare the metrics exporter of the daemon for the duration of the context. The HTTP
+    endpoint is started, reconfigured or stopped by configure() following the
+    api.metrics section of the configuration.
+    """
+    _EXPORTER.workspace = workspace
+    try:
+        yield
+    finally:
+        _EXPORTER.configure(None)
+        _EXPORTER.workspace = None
+
+
+def configure(dnsrobocert_config: dict[str, Any] | None) -> None:
+    settings = None
+    if dnsrobocert_config:
+        settings = dnsrobocert_config.get("api", {}).get("metrics")
+    _EXPORTER.configure(settings)
+
+
+class _Exporter:
+    def __init__(self) -> None:
+        self.workspace: str | None = None
+        self._settings: dict[str, Any] | None = None
+        self._server: ThreadingHTTPServer | None = None
+        self._receiver: socket.socket | None = None
+        self._sender: socket.socket | None = None
+
+    def configure(self, settings: dict[str, Any] | None) -> None:
+        if settings == self._settings:
+            return
+
+        self._stop()
+        self._settings = settings
+        if settings is not None and self.workspace:
+            self._start(settings)
+
+    def forward(self, name: str, value: float, labels: dict[str, str]) -> None:
+        # Measures made in the daemon are already in its registry.
+        socket_path = os.environ.get(SOCKET_ENV)
+        if self._receiver or not socket_path:
+            return
+
+        try:
+            if not self._sender:
+                self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.sendto(
+                json.dumps({"name": name, "value": value, "labels": labels}).encode(
+                    "utf-8"
+                ),
+                socket_path,
+            )
+        except OSError:
+            # Metrics must never break the certificates processing.
+            pass
+
+    def _start(self, settings: dict[str, Any]) -> None:
+        host = settings.get("host", DEFAULT_HOST)
+        port = settings.get("port", DEFAULT_PORT)
+        try:
+            self._server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError as e:
+            LOGGER.error(f"Could not start the metrics endpoint on {host}:{port}: {e}")
+            return
+
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="dnsrobocert-metrics", daemon=True
+        ).start()
+        LOGGER.info(f"Metrics are exposed on http://{host}:{port}/metrics")
+
+        if hasattr(socket, "AF_UNIX") and self.workspace:
+            socket_path = os.path.join(self.workspace, "metrics.sock")
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._receiver.bind(socket_path)
+            threading.Thread(
+                target=_receive,
+                args=(self._receiver,),
+                name="dnsrobocert-metrics-receiver",
+                daemon=True,
+            ).start()
+            os.environ[SOCKET_ENV] = socket_path
+
+    def _stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+        if self._receiver:
+            os.environ.pop(SOCKET_ENV, None)
+            socket_path = self._receiver.getsockname()
+            self._receiver.close()
+            self._receiver = None
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+_EXPORTER = _Exporter()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", _CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def _receive(receiver: socket.socket) -> None:
+    while True:
+        try:
+            data = receiver.recv(65536)
+        except OSError:
+            return
+
+        try:
+            measure = json.loads(data)
+            metric = _REGISTRY[measure["name"]]
+            metric.apply(float(measure["value"]), measure["labels"])
+        except (ValueError, KeyError, TypeError) as e:
+            LOGGER.warning(f"Invalid measure received: {e}")
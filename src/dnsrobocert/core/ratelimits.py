@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Collection, Iterable
+from typing import Any, NamedTuple
+
+from dnsrobocert.core import config, state, suffixes
+
+
+class Limit(NamedTuple):
+    default: int
+    window: float
+    description: str
+
+
+# Rate limits of the ACME server, with the default values and windows of Let's Encrypt.
+# Each one can be overridden (or disabled with 0) in the acme.rate_limits section. The
+# default values apply only to the production servers of Let's Encrypt.
+LIMITS = {
+    "orders_per_account": Limit(300, 3 * 3600, "new orders per account"),
+    "certificates_per_domain": Limit(
+        50, 7 * 86400, "certificates per registered domain"
+    ),
+    "duplicate_certificates": Limit(5, 7 * 86400, "duplicate certificates"),
+    "failed_validations": Limit(5, 3600, "failed validations per domain name"),
+}
+
+
+LETSENCRYPT_PRODUCTION = (
+    "https://acme-v01.api.letsencrypt.org/directory",
+    "https://acme-v02.api.letsencrypt.org/directory",
+)
+
+
+class Budget:
+    """
+    Admission control of the ACME orders against the rate limits of the ACME server.
+    The budget is estimated from the orders recorded in the state store during the
+    windows of the limits, plus the orders currently in progress in this process.
+    An order that would exceed a limit is held back instead of being attempted.
+    """
+
+    def __init__(
+        self, dnsrobocert_config: dict[str, Any], store: state.StateStore
+    ) -> None:
+        rate_limits = dnsrobocert_config.get("acme", {}).get("rate_limits", {})
+        self.account = config.get_acme_url(dnsrobocert_config)
+        production = self.account in LETSENCRYPT_PRODUCTION
+        self.limits = {
+            name: rate_limits.get(name, limit.default if production else 0)
+            for name, limit in LIMITS.items()
+        }
+        self._store = store
+        self._lock = threading.Lock()
+        self._orders = store.orders(time.time() - state.ORDERS_RETENTION, self.account)
+        self._pending: dict[str, state.Order] = {}
+
+    def reserve(
+        self, lineage: str, names: Collection[str], renewal: bool
+    ) -> dict[str, float]:
+        """
+        Reserve the budget of an order for the given lineage and names. If this order
+        would exceed some rate limits, nothing is reserved, and these limits are returned
+        with the time when each one is expected to allow the order again.
+        """
+        names = frozenset(name.lower() for name in names)
+        with self._lock:
+            now = time.time()
+            order = state.Order(
+                now,
+                self.account,
+                lineage,
+                names,
+                frozenset(_registered_domain(name) for name in names),
+                renewal,
+                True,
+            )
+            exceeded = self._exceeded(
+                order, self._orders + list(self._pending.values()), now
+            )
+            if not exceeded:
+                self._pending[lineage] = order
+            return exceeded
+
+    def complete(self, lineage: str, succeeded: bool) -> None:
+        """
+        Record the outcome of the order reserved for the given lineage.
+        """
+        with self._lock:
+            pending = self._pending.pop(lineage)
+            self._orders.append(
+                self._store.record_order(
+                    self.account,
+                    lineage,
+                    pending.names,
+                    pending.registered_domains,
+                    pending.renewal,
+                    succeeded,
+                )
+            )
+
+    def cancel(self, lineage: str) -> None:
+        """
+        Release the budget reserved for the given lineage, when no order was placed.
+        """
+        with self._lock:
+            del self._pending[lineage]
+
+    def _exceeded(
+        self, order: state.Order, orders: list[state.Order], now: float
+    ) -> dict[str, float]:
+        exceeded: dict[str, float] = {}
+
+        def _check(name: str, matching: Iterable[state.Order]) -> None:
+            limit = self.limits[name]
+            if not limit:
+                return
+            since = now - LIMITS[name].window
+            created = sorted(o.created for o in matching if o.created > since)
+            if len(created) >= limit:
+                until = created[len(created) - limit] + LIMITS[name].window
+                exceeded[name] = max(exceeded.get(name, 0), until)
+
+        _check("orders_per_account", orders)
+        # Renewals (same set of names as an existing certificate) are not limited
+        # by the number of certificates per registered domain.
+        if not order.renewal:
+            for registered_domain in order.registered_domains:
+                _check(
+                    "certificates_per_domain",
+                    (
+                        o
+                        for o in orders
+                        if o.succeeded and registered_domain in o.registered_domains
+                    ),
+                )
+        _check(
+            "duplicate_certificates",
+            (o for o in orders if o.succeeded and o.names == order.names),
+        )
+        for name in order.names:
+            _check(
+                "failed_validations",
+                (o for o in orders if not o.succeeded and name in o.names),
+            )
+
+        return exceeded
+
+
+def _registered_domain(name: str) -> str:
+    return suffixes.extract(name[2:] if name.startswith("*.") else name)
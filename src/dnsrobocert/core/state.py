@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import time
+from collections.abc import Collection, Iterator
+from contextlib import contextmanager
+from typing import Any, NamedTuple
+
+from dnsrobocert.core import config, utils
+
+# Environment variable holding the path of the state database, so the hooks can record
+# the phase of an issuance that failed.
+STATE_ENV = "DNSROBOCERT_STATE"
+
+DATABASE = "state.db"
+
+# Delay before a new issuance of a failing lineage, doubled after each consecutive
+# failure, up to the maximum delay.
+BACKOFF_DELAY = 300
+MAX_BACKOFF_DELAY = 86400
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS lineages (
+    lineage TEXT PRIMARY KEY,
+    last_attempt REAL,
+    last_success REAL,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    last_error_phase TEXT,
+    last_error TEXT,
+    last_duration REAL,
+    config_digest TEXT
+)
+"""
+_ORDERS_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS orders (
+    created REAL NOT NULL,
+    account TEXT NOT NULL,
+    lineage TEXT NOT NULL,
+    names TEXT NOT NULL,
+    registered_domains TEXT NOT NULL,
+    renewal INTEGER NOT NULL,
+    succeeded INTEGER NOT NULL
+)
+"""
+# Last time the auth hook of a lineage let the ACME server validate its challenges.
+_VALIDATIONS_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS validations (
+    lineage TEXT PRIMARY KEY,
+    last_validation REAL NOT NULL
+)
+"""
+# Orders are kept as long as they count against an ACME rate limit.
+ORDERS_RETENTION = 7 * 86400
+_COLUMNS = (
+    "lineage",
+    "last_attempt",
+    "last_success",
+    "consecutive_failures",
+    "last_error_phase",
+    "last_error",
+    "last_duration",
+    "config_digest",
+)
+
+
+class LineageState(NamedTuple):
+    lineage: str
+    last_attempt: float | None
+    last_success: float | None
+    consecutive_failures: int
+    last_error_phase: str | None
+    last_error: str | None
+    last_duration: float | None
+    config_digest: str | None
+
+    def next_attempt(self) -> float:
+        """
+        Return the time before which the lineage should not be issued again, because of
+        its consecutive failures (0 if the lineage is not failing).
+        """
+        if not self.consecutive_failures or not self.last_attempt:
+            return 0
+        delay = min(
+            BACKOFF_DELAY * 2 ** (self.consecutive_failures - 1), MAX_BACKOFF_DELAY
+        )
+        return self.last_attempt + delay
+
+
+class Order(NamedTuple):
+    created: float
+    account: str
+    lineage: str
+    names: frozenset[str]
+    registered_domains: frozenset[str]
+    renewal: bool
+    succeeded: bool
+
+
+class StateStore:
+    """
+    The state of the lineages across passes and restarts, stored in a SQLite database
+    alongside the Certbot data: last attempt and success of an issuance, consecutive
+    failures, with the phase, the error and the duration of the last attempt.
+    It also records the ACME orders of the last days, to account for the rate limits.
+    The database is opened for each operation, so the store can be used from several
+    threads and processes (daemon and hooks).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with self._connect() as connection:
+            connection.execute(_SCHEMA)
+            connection.execute(_ORDERS_SCHEMA)
+            connection.execute(_VALIDATIONS_SCHEMA)
+
+    def get(self, lineage: str) -> LineageState | None:
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM lineages WHERE lineage = ?",
+                (lineage,),
+            ).fetchone()
+        return LineageState(*row) if row else None
+
+    def all(self) -> list[LineageState]:
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM lineages ORDER BY lineage"
+            ).fetchall()
+        return [LineageState(*row) for row in rows]
+
+    def backoff_until(self, lineage: str, config_digest: str) -> float:
+        """
+        Return the time before which the given lineage should not be issued again
+        (0 if it is not failing). Failing lineages are not backed off anymore once
+        their settings, identified by the given digest, change.
+        """
+        lineage_state = self.get(lineage)
+        if not lineage_state or lineage_state.config_digest != config_digest:
+            return 0
+        return lineage_state.next_attempt()
+
+    def start_attempt(self, lineage: str) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO lineages (lineage, last_attempt) VALUES (?, ?) "
+                "ON CONFLICT (lineage) DO UPDATE SET "
+                "last_attempt = excluded.last_attempt, last_error_phase = NULL",
+                (lineage, time.time()),
+            )
+
+    def record_phase(self, lineage: str, phase: str) -> None:
+        """
+        Record the phase (eg. a hook) where the current attempt failed, unless an
+        earlier phase of this attempt already failed.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE lineages SET last_error_phase = ? "
+                "WHERE lineage = ? AND last_error_phase IS NULL",
+                (phase, lineage),
+            )
+
+    def record_validation(self, lineage: str) -> None:
+        """
+        Record that the challenges of the current attempt are submitted for validation
+        to the ACME server.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO validations (lineage, last_validation) VALUES (?, ?) "
+                "ON CONFLICT (lineage) DO UPDATE SET "
+                "last_validation = excluded.last_validation",
+                (lineage, time.time()),
+            )
+
+    def validated_since(self, lineage: str, since: float) -> bool:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT last_validation FROM validations WHERE lineage = ?",
+                (lineage,),
+            ).fetchone()
+        return bool(row and row[0] >= since)
+
+    def record_success(
+        self, lineage: str, duration: float, config_digest: str | None = None
+    ) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE lineages SET last_success = ?, consecutive_failures = 0, "
+                "last_error_phase = NULL, last_error = NULL, last_duration = ?, "
+                "config_digest = ? WHERE lineage = ?",
+                (time.time(), duration, config_digest, lineage),
+            )
+
+    def record_failure(
+        self,
+        lineage: str,
+        error: str,
+        duration: float,
+        config_digest: str | None = None,
+        phase: str = "certbot",
+    ) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE lineages SET consecutive_failures = consecutive_failures + 1, "
+                "last_error_phase = COALESCE(last_error_phase, ?), last_error = ?, "
+                "last_duration = ?, config_digest = ? WHERE lineage = ?",
+                (phase, error, duration, config_digest, lineage),
+            )
+
+    def record_order(
+        self,
+        account: str,
+        lineage: str,
+        names: Collection[str],
+        registered_domains: Collection[str],
+        renewal: bool,
+        succeeded: bool,
+    ) -> Order:
+        order = Order(
+            time.time(),
+            account,
+            lineage,
+            frozenset(names),
+            frozenset(registered_domains),
+            renewal,
+            succeeded,
+        )
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    order.created,
+                    account,
+                    lineage,
+                    json.dumps(sorted(order.names)),
+                    json.dumps(sorted(order.registered_domains)),
+                    renewal,
+                    succeeded,
+                ),
+            )
+            connection.execute(
+                "DELETE FROM orders WHERE created < ?",
+                (order.created - ORDERS_RETENTION,),
+            )
+        return order
+
+    def orders(self, since: float, account: str | None = None) -> list[Order]:
+        """
+        Return the orders created since the given time, optionally only for an account.
+        """
+        query = "SELECT * FROM orders WHERE created >= ?"
+        parameters: tuple[Any, ...] = (since,)
+        if account is not None:
+            query = f"{query} AND account = ?"
+            parameters = (since, account)
+        with self._connect() as connection:
+            rows = connection.execute(f"{query} ORDER BY created", parameters)
+            return [
+                Order(
+                    created,
+                    account,
+                    lineage,
+                    frozenset(json.loads(names)),
+                    frozenset(json.loads(registered_domains)),
+                    bool(renewal),
+                    bool(succeeded),
+                )
+                for (
+                    created,
+                    account,
+                    lineage,
+                    names,
+                    registered_domains,
+                    renewal,
+                    succeeded,
+                ) in rows.fetchall()
+            ]
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+def open_store(directory_path: str) -> StateStore:
+    return StateStore(utils.state_path(directory_path, DATABASE))
+
+
+def config_digest(
+    dnsrobocert_config: dict[str, Any], certificate: dict[str, Any]
+) -> str:
+    """
+    Digest of the settings used to issue a certificate (the certificate and its profile).
+    """
+    profile = config.get_profile(dnsrobocert_config, certificate.get("profile", ""))
+    data = json.dumps(
+        {"certificate": certificate, "profile": profile}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import functools
+import os
+import time
+import urllib.request
+from importlib.resources import as_file, files
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from dnsrobocert.core import utils
+
+if TYPE_CHECKING:
+    import tldextract
+
+# Environment variable holding the path of the Public Suffix List refreshed by DNSroboCert.
+# When not set, or if this file does not exist, the snapshot shipped with DNSroboCert is used.
+SUFFIX_LIST_ENV = "DNSROBOCERT_PUBLIC_SUFFIX_LIST"
+
+PUBLIC_SUFFIX_LIST_URL = "https://publicsuffix.org/list/public_suffix_list.dat"
+REFRESH_INTERVAL = 86400
+
+_SNAPSHOT = "public_suffix_list.dat"
+_DOWNLOAD_TIMEOUT = 30
+_ICANN_MARKER = "===BEGIN ICANN DOMAINS==="
+
+
+def extract(name: str) -> str:
+    """
+    Return the registered domain (domain and public suffix) of the given DNS name.
+    """
+    extracted = extractor(os.environ.get(SUFFIX_LIST_ENV))(name)
+    return ".".join([extracted.domain, extracted.suffix])
+
+
+@functools.lru_cache(maxsize=None)
+def extractor(path: str | None) -> tldextract.TLDExtract:
+    """
+    Return the extractor shared by all the calls made from this process, backed by the
+    Public Suffix List at the given path if it exists, or by the snapshot shipped with
+    DNSroboCert otherwise. It never fetches anything over the network and does not use
+    any disk cache: once loaded, the extractions are in-memory lookups.
+    """
+    import tldextract
+
+    with as_file(files("dnsrobocert") / _SNAPSHOT) as snapshot_path:
+        urls = [Path(snapshot_path).absolute().as_uri()]
+        if path and os.path.exists(path):
+            urls.insert(0, Path(path).absolute().as_uri())
+
+        extract = tldextract.TLDExtract(cache_dir=None, suffix_list_urls=urls)
+        # The suffix list is loaded now, so forked processes inherit a loaded extractor.
+        extract("example.com")
+
+    return extract
+
+
+def refresh(
+    path: str,
+    url: str = PUBLIC_SUFFIX_LIST_URL,
+    max_age: float = REFRESH_INTERVAL,
+) -> bool:
+    """
+    Download the Public Suffix List to the given path if the current copy is older than
+    max_age seconds. Return True if the list has been downloaded.
+    """
+    try:
+        if time.time() - os.stat(path).st_mtime < max_age:
+            return False
+    except OSError:
+        pass
+
+    with urllib.request.urlopen(url, timeout=_DOWNLOAD_TIMEOUT) as response:
+        content = response.read().decode("utf-8")
+    if _ICANN_MARKER not in content:
+        raise RuntimeError(f"Invalid Public Suffix List downloaded from {url}.")
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # The hooks never read a partially written file.
+    utils.atomic_write(path, content.encode("utf-8"))
+
+    return True
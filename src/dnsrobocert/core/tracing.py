@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+import dnsrobocert
+
+# Environment variable holding the path of the file receiving the spans. It is inherited
+# by the Certbot and hooks processes, like the trace context in TRACEPARENT.
+FILE_ENV = "DNSROBOCERT_TRACING_FILE"
+# W3C Trace Context header, as used by OpenTelemetry for environment propagation.
+TRACEPARENT_ENV = "TRACEPARENT"
+
+_TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_SPAN_KIND_INTERNAL = 1
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+_CURRENT_SPAN: contextvars.ContextVar[tuple[str, str] | None] = contextvars.ContextVar(
+    "dnsrobocert_span", default=None
+)
+_WRITE_LOCK = threading.Lock()
+
+
+def configure(dnsrobocert_config: dict[str, Any]) -> None:
+    """
+    Enable or disable the tracing in the current process and in its children,
+    following the api.tracing section of the configuration.
+    """
+    tracing = dnsrobocert_config.get("api", {}).get("tracing")
+    if tracing:
+        os.environ[FILE_ENV] = tracing["file"]
+    else:
+        os.environ.pop(FILE_ENV, None)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """
+    Record the execution of the enclosed block as a span, child of the current span of
+    this process, or of the span given by TRACEPARENT in a child process.
+    Does nothing if the tracing is not enabled.
+    """
+    path = os.environ.get(FILE_ENV)
+    if not path:
+        yield
+        return
+
+    parent = _CURRENT_SPAN.get() or _parse_traceparent(
+        os.environ.get(TRACEPARENT_ENV, "")
+    )
+    trace_id = parent[0] if parent else secrets.token_hex(16)
+    span_id = secrets.token_hex(8)
+
+    token = _CURRENT_SPAN.set((trace_id, span_id))
+    start = time.time_ns()
+    error: BaseException | None = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        record: dict[str, Any] = {
+            "traceId": trace_id,
+            "spanId": span_id,
+            "name": name,
+            "kind": _SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(time.time_ns()),
+            "attributes": [
+                _attribute(key, value) for key, value in sorted(attributes.items())
+            ],
+            "status": (
+                {"code": _STATUS_ERROR, "message": str(error)}
+                if error
+                else {"code": _STATUS_OK}
+            ),
+        }
+        if parent:
+            record["parentSpanId"] = parent[1]
+        _write(path, record)
+
+
+def inject(env: dict[str, str] | None) -> dict[str, str] | None:
+    """
+    Return the environment to give to a child process, so its spans are children
+    of the current span.
+    """
+    current = _CURRENT_SPAN.get()
+    if not current or not os.environ.get(FILE_ENV):
+        return env
+
+    env = dict(os.environ if env is None else env)
+    env[FILE_ENV] = os.environ[FILE_ENV]
+    env[TRACEPARENT_ENV] = f"00-{current[0]}-{current[1]}-01"
+    return env
+
+
+def _parse_traceparent(traceparent: str) -> tuple[str, str] | None:
+    match = _TRACEPARENT_PATTERN.match(traceparent.strip().lower())
+    return (match.group(1), match.group(2)) if match else None
+
+
+def _attribute(key: str, value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _write(path: str, record: dict[str, Any]) -> None:
+    # Each line is an OTLP/JSON export request, as read by the OpenTelemetry Collector
+    # (otlpjsonfile receiver) or imported in tracing backends.
+    line = json.dumps(
+        {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            _attribute("service.name", "dnsrobocert"),
+                            _attribute("service.version", dnsrobocert.__version__),
+                            _attribute("process.pid", os.getpid()),
+                        ]
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": "dnsrobocert"}, "spans": [record]}
+                    ],
+                }
+            ]
+        }
+    )
+    try:
+        with _WRITE_LOCK, open(path, "a") as file_h:
+            file_h.write(line + "\n")
+    except OSError:
+        # Tracing must never break the certificates processing.
+        pass
@@ -2,17 +2,21 @@ from __future__ import annotations
 
 import argparse
 import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import re
+import stat
 import subprocess
 import sys
+import tempfile
 import threading
+from multiprocessing.context import BaseContext
 from pathlib import Path
 from typing import Any
 
 import coloredlogs
-from certbot.compat import misc
 
 try:
     POSIX_MODE = True
@@ -62,47 +66,97 @@ def execute(
         raise error
 
 
-def fix_permissions(certificate_permissions: dict[str, Any], target_path: str) -> None:
-    files_mode = certificate_permissions.get("files_mode", 0o640)
-    dirs_mode = certificate_permissions.get("dirs_mode", 0o750)
+def forkserver_context() -> BaseContext:
+    """
+    Return the multiprocessing context used to start the DNSroboCert helper processes.
+    The fork server preloads Certbot and the hooks, so these imports are done only once.
+    """
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(
+        [
+            "certbot.main",
+            "dnsrobocert.core.certbot",
+            "dnsrobocert.core.challenge",
+            "dnsrobocert.core.hooks",
+        ]
+    )
+    return context
 
-    os.chmod(target_path, dirs_mode)
 
-    uid = -1
-    gid = -1
+def fix_permissions(
+    certificate_permissions: dict[str, Any],
+    target_path: str,
+    fingerprints_path: str | None = None,
+) -> None:
+    """
+    Apply the files and directories modes and the owner defined by the certificates
+    permissions to the target directory and to its content. Modes and owners are
+    changed only when they differ. If a fingerprints file is given, the files of the
+    directories whose content and permissions settings did not change since the last
+    call are not checked again.
+    """
+    files_mode, dirs_mode, uid, gid = _resolve_permissions(certificate_permissions)
+    settings = f"{files_mode:o}:{dirs_mode:o}:{uid}:{gid}"
+    fingerprints = load_json(fingerprints_path) if fingerprints_path else {}
+    new_fingerprints: dict[str, str] = {}
+
+    directories = [target_path]
+    while directories:
+        directory = directories.pop()
+        stats = os.stat(directory)
+        _apply_permissions(directory, stats, dirs_mode, uid, gid)
+
+        # Adding, removing or renaming a file changes the modification time of its
+        # directory, which is the case each time Certbot issues a new certificate.
+        fingerprint = f"{settings}:{stats.st_ino}:{stats.st_mtime_ns}"
+        unchanged = fingerprints.get(directory) == fingerprint
+        new_fingerprints[directory] = fingerprint
+
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif not unchanged:
+                    # Like chmod and chown, symbolic links are followed.
+                    entry_stats = entry.stat()
+                    _apply_permissions(
+                        entry.path,
+                        entry_stats,
+                        dirs_mode if stat.S_ISDIR(entry_stats.st_mode) else files_mode,
+                        uid,
+                        gid,
+                    )
+
+        directories.extend(reversed(subdirectories))
+
+    if fingerprints_path:
+        prefix = os.path.join(target_path, "")
+        fingerprints = {
+            path: fingerprint
+            for path, fingerprint in fingerprints.items()
+            if path != target_path and not path.startswith(prefix)
+        }
+        fingerprints.update(new_fingerprints)
+        save_json(fingerprints_path, fingerprints)
 
-    user = certificate_permissions.get("user")
-    group = certificate_permissions.get("group")
 
-    if (user or group) and not POSIX_MODE:
-        LOGGER.warning(
-            "Setting user and group for certificates/keys is not supported on Windows."
+def fix_paths_permissions(
+    certificate_permissions: dict[str, Any], paths: list[str]
+) -> None:
+    """
+    Apply the certificates permissions to the given paths only, not to their content.
+    """
+    files_mode, dirs_mode, uid, gid = _resolve_permissions(certificate_permissions)
+    for path in paths:
+        stats = os.stat(path)
+        _apply_permissions(
+            path,
+            stats,
+            dirs_mode if stat.S_ISDIR(stats.st_mode) else files_mode,
+            uid,
+            gid,
         )
-    elif POSIX_MODE:
-        if isinstance(user, int):
-            uid = user
-        elif isinstance(user, str):
-            uid = pwd.getpwnam(user)[2]
-
-        if isinstance(group, int):
-            gid = group
-        elif isinstance(group, str):
-            try:
-                gid = grp.getgrnam(group)[2]
-            except KeyError:
-                # Group could not be resolved (eg. `nogroup`): gid stays at -1 and will not be modified by os.chown.
-                pass
-
-        os.chown(target_path, uid, gid)  # type: ignore
-
-    for root, dirs, files in os.walk(target_path):
-        for path in dirs:
-            os.chmod(os.path.join(root, path), dirs_mode)
-        for path in files:
-            os.chmod(os.path.join(root, path), files_mode)
-        if POSIX_MODE:
-            for path in files + dirs:
-                os.chown(os.path.join(root, path), uid, gid)  # type: ignore
 
 
 def configure_certbot_workspace(
@@ -119,8 +173,9 @@ def configure_certbot_workspace(
     certificate_permissions = dnsrobocert_config.get("acme", {}).get(
         "certs_permissions", {}
     )
-    fix_permissions(certificate_permissions, live_path)
-    fix_permissions(certificate_permissions, archive_path)
+    fingerprints_path = state_path(directory_path, "permissions.json")
+    fix_permissions(certificate_permissions, live_path, fingerprints_path)
+    fix_permissions(certificate_permissions, archive_path, fingerprints_path)
 
 
 def digest(path: str) -> bytes | None:
@@ -135,6 +190,52 @@ def digest(path: str) -> bytes | None:
     return md5.digest()
 
 
+def state_path(directory_path: str, name: str) -> str:
+    """
+    Return the path of a file holding some DNSroboCert state, stored alongside the
+    Certbot data in the given directory.
+    """
+    state_directory = os.path.join(directory_path, "dnsrobocert")
+    os.makedirs(state_directory, exist_ok=True)
+    return os.path.join(state_directory, name)
+
+
+def load_json(path: str) -> dict[str, Any]:
+    """
+    Load a JSON state file, an empty dict is returned if it is missing or corrupted.
+    """
+    try:
+        with open(path) as file_h:
+            return json.load(file_h)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_json(path: str, data: dict[str, Any]) -> None:
+    """
+    Save a JSON state file, see atomic_write.
+    """
+    atomic_write(path, json.dumps(data).encode("utf-8"))
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """
+    Write the given data to a file, replaced atomically so a concurrent reader never
+    sees a partially written file. The data is written first in a hidden temporary
+    file (.<name>-<random>) of the same directory, removed if the write fails.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}-"
+    )
+    try:
+        with os.fdopen(fd, "wb") as file_h:
+            file_h.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
 def normalize_lineage(domain: str) -> str:
     return re.sub(r"^\*\.", "", domain)
 
@@ -184,6 +285,8 @@ def get_default_args() -> dict[str, str]:
             "directoryDesc": os.path.join(user_home, "dnsrobocert/letsencrypt"),
         }
 
+    from certbot.compat import misc
+
     return {
         "config": os.path.join(os.getcwd(), "dnsrobocert.yml"),
         "configDesc": "$(pwd)/dnsrobocert.yml",
@@ -232,3 +335,48 @@ def _split_path(path: str) -> list[str]:
             all_parts.insert(0, parts[1])
 
     return all_parts
+
+
+def _resolve_permissions(
+    certificate_permissions: dict[str, Any],
+) -> tuple[int, int, int, int]:
+    files_mode = certificate_permissions.get("files_mode", 0o640)
+    dirs_mode = certificate_permissions.get("dirs_mode", 0o750)
+
+    uid = -1
+    gid = -1
+
+    user = certificate_permissions.get("user")
+    group = certificate_permissions.get("group")
+
+    if (user or group) and not POSIX_MODE:
+        LOGGER.warning(
+            "Setting user and group for certificates/keys is not supported on Windows."
+        )
+    elif POSIX_MODE:
+        if isinstance(user, int):
+            uid = user
+        elif isinstance(user, str):
+            uid = pwd.getpwnam(user)[2]
+
+        if isinstance(group, int):
+            gid = group
+        elif isinstance(group, str):
+            try:
+                gid = grp.getgrnam(group)[2]
+            except KeyError:
+                # Group could not be resolved (eg. `nogroup`): gid stays at -1 and will not be modified by os.chown.
+                pass
+
+    return files_mode, dirs_mode, uid, gid
+
+
+def _apply_permissions(
+    path: str, stats: os.stat_result, mode: int, uid: int, gid: int
+) -> None:
+    if stat.S_IMODE(stats.st_mode) != mode:
+        os.chmod(path, mode)
+    if POSIX_MODE and (
+        (uid != -1 and stats.st_uid != uid) or (gid != -1 and stats.st_gid != gid)
+    ):
+        os.chown(path, uid, gid)  # type: ignore
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import time
+
+import coloredlogs
+
+LOGGER = logging.getLogger(__name__)
+coloredlogs.install(logger=LOGGER)
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+
+
+class ConfigWatcher:
+    """
+    Wait for changes on a set of files. On Linux, the kernel notifies the changes
+    through inotify on the directories holding the files, including every directory
+    involved in the resolution of symbolic links (eg. ConfigMaps mounted in Kubernetes).
+    Elsewhere, the size and modification time of the files are polled.
+    Changes are debounced, to let editors that write files in several steps finish.
+    """
+
+    def __init__(
+        self,
+        paths: list[str],
+        debounce: float = 0.5,
+        poll_interval: float = 1,
+        use_inotify: bool = True,
+    ) -> None:
+        self._paths = [os.path.abspath(path) for path in paths]
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        # Watch descriptor of each watched directory.
+        self._watched: dict[str, int] = {}
+        self._signature = self._current_signature()
+
+        self._libc: ctypes.CDLL | None = None
+        self._fd = -1
+        if use_inotify and sys.platform.startswith("linux"):
+            self._init_inotify()
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait at most timeout seconds for a change, return True if one of the
+        watched files changed since the last call.
+        """
+        if self._fd >= 0:
+            # Nothing is inspected on the file system until the kernel reports an event.
+            if not self._wait_event(timeout):
+                return False
+            while self._wait_event(self._debounce):
+                pass
+            self._update_watches()
+        else:
+            deadline = time.monotonic() + timeout
+            while self._signature == self._current_signature():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self._poll_interval, remaining))
+
+            signature = self._current_signature()
+            time.sleep(self._debounce)
+            while signature != self._current_signature():
+                signature = self._current_signature()
+                time.sleep(self._debounce)
+
+        signature = self._current_signature()
+        if signature == self._signature:
+            return False
+
+        self._signature = signature
+        return True
+
+    def _init_inotify(self) -> None:
+        try:
+            libc = ctypes.CDLL(
+                ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+            )
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            LOGGER.warning(f"Inotify is not available ({e}), falling back to polling.")
+            return
+
+        if fd < 0:
+            LOGGER.warning(
+                f"Inotify is not available ({os.strerror(ctypes.get_errno())}), "
+                "falling back to polling."
+            )
+            return
+
+        self._libc = libc
+        self._fd = fd
+        self._update_watches()
+
+    def _update_watches(self) -> None:
+        if not self._libc:
+            return
+
+        # Every directory is added again, as a path can now resolve to another directory
+        # (eg. ..data in a ConfigMap). The kernel returns the existing descriptor of a
+        # directory already watched.
+        watched = {}
+        for directory in self._directories():
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), _WATCH_MASK
+            )
+            if wd >= 0:
+                watched[directory] = wd
+
+        # Directories left behind by the replaced symbolic links are not watched anymore.
+        for wd in set(self._watched.values()) - set(watched.values()):
+            # Fails harmlessly if the kernel already removed the watch with the directory.
+            self._libc.inotify_rm_watch(self._fd, wd)
+        self._watched = watched
+
+    def _wait_event(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+
+        # Events content does not matter: the signature of the files is checked afterwards.
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+        return True
+
+    def _directories(self) -> set[str]:
+        directories = set()
+        for path in self._paths:
+            # Follow the chain of symbolic links, as each link can be replaced.
+            for _ in range(40):
+                directories.add(os.path.dirname(path))
+                if not os.path.islink(path):
+                    break
+                path = os.path.join(os.path.dirname(path), os.readlink(path))
+            directories.add(os.path.dirname(os.path.realpath(path)))
+
+        # A missing directory is noticed when it appears in its closest existing parent.
+        existing = set()
+        for directory in directories:
+            while not os.path.isdir(directory) and directory != os.path.dirname(
+                directory
+            ):
+                directory = os.path.dirname(directory)
+            existing.add(directory)
+
+        return existing
+
+    def _current_signature(self) -> tuple[tuple[str, int, int, int] | None, ...]:
+        signature: list[tuple[str, int, int, int] | None] = []
+        for path in self._paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append(
+                    (
+                        os.path.realpath(path),
+                        stat.st_ino,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    )
+                )
+
+        return tuple(signature)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import coloredlogs
+
+from dnsrobocert.core import utils
+
+LOGGER = logging.getLogger(__name__)
+coloredlogs.install(logger=LOGGER)
+
+_POOL: ProcessPoolExecutor | None = None
+_POOL_SIZE = 0
+_POOL_LOCK = threading.Lock()
+
+
+def supported() -> bool:
+    return "forkserver" in multiprocessing.get_all_start_methods()
+
+
+def execute(
+    args: list[str],
+    size: int,
+    check: bool = True,
+    env: dict[str, str] | None = None,
+    lock: threading.Lock | None = None,
+) -> None:
+    """
+    Run the certbot command line described by args in one of the warm worker
+    processes. The interface mirrors utils.execute, so a non-zero exit code
+    raises a subprocess.CalledProcessError if check is True.
+    """
+    if not env:
+        env = os.environ.copy()
+
+    LOGGER.info(f"Launching certbot in worker: {subprocess.list2cmdline(args)}")
+    sys.stdout.write("----------\n")
+    sys.stdout.flush()
+
+    if lock:
+        with lock:
+            returncode, duration = _pool(size).submit(_run, args, env).result()
+    else:
+        returncode, duration = _pool(size).submit(_run, args, env).result()
+
+    sys.stdout.write("----------\n")
+    sys.stdout.flush()
+
+    LOGGER.info(
+        f"Certbot {args[0] if args else ''} finished in {duration:.2f} seconds "
+        f"with exit code {returncode}."
+    )
+
+    if check and returncode:
+        raise subprocess.CalledProcessError(returncode, ["certbot", *args])
+
+
+def shutdown() -> None:
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL:
+            _POOL.shutdown()
+        _POOL = None
+        _POOL_SIZE = 0
+
+
+atexit.register(shutdown)
+
+
+def _pool(size: int) -> ProcessPoolExecutor:
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL and _POOL_SIZE != size:
+            _POOL.shutdown()
+            _POOL = None
+
+        if not _POOL:
+            # Workers are forked from a server that has already imported Certbot,
+            # so neither the interpreter startup nor the imports are paid per call.
+            _POOL = ProcessPoolExecutor(
+                max_workers=size, mp_context=utils.forkserver_context()
+            )
+            _POOL_SIZE = size
+
+        return _POOL
+
+
+def _run(args: list[str], env: dict[str, str]) -> tuple[int, float]:
+    start = time.monotonic()
+
+    # Each call is executed in a child forked from the warm worker: Certbot holds
+    # global state (locks, logging handlers, atexit callbacks) that must not leak
+    # from one call to another, and a crash must not take the worker down.
+    pid = os.fork()
+    if pid == 0:
+        returncode = 1
+        try:
+            os.environ.clear()
+            os.environ.update(env)
+            from dnsrobocert.core import certbot
+
+            returncode = _exit_code(certbot.run(args))
+        except SystemExit as e:
+            returncode = _exit_code(e.code)
+        except BaseException as e:
+            print(f"Unexpected error in certbot worker: {e}", file=sys.stderr)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(returncode)
+
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status), time.monotonic() - start
+
+
+def _exit_code(result: int | str | None) -> int:
+    # Mimic the behavior of sys.exit() used by the certbot CLI entrypoint.
+    if result is None:
+        return 0
+    if isinstance(result, int):
+        return result
+    print(result, file=sys.stderr)
+    return 1
@@ -0,0 +1,102 @@
+"""
+Micro-benchmark of the configuration loading.
+
+Usage: python test/benchmarks/config_benchmark.py [CERTIFICATES_COUNT ...]
+
+For each size, it reports the time to load a generated configuration:
+* with the previous implementation (pure Python YAML loader, schema parsed and
+  validator built at each call),
+* with the current implementation on a cold cache,
+* with the current implementation on a warm cache (the usual case for hooks and
+  Certbot operations of a given configuration).
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+from collections.abc import Callable
+from importlib.resources import as_file, files
+from typing import Any
+
+import jsonschema
+import yaml
+
+from dnsrobocert.core import config
+
+
+def _generate(path: str, certificates_count: int) -> None:
+    with open(path, "w") as file_h:
+        file_h.write("""\
+acme:
+  email_account: john.doe@example.net
+  certs_permissions:
+    files_mode: "0640"
+profiles:
+- name: dummy
+  provider: dummy
+  provider_options:
+    auth_token: ${BENCHMARK_TOKEN}
+certificates:
+""")
+        for index in range(certificates_count):
+            file_h.write(f"""\
+- name: cert{index}.example.net
+  domains: [cert{index}.example.net, "*.cert{index}.example.net"]
+  profile: dummy
+  deploy_hook: echo deployed
+""")
+
+
+def _legacy_load(config_path: str) -> dict[str, Any]:
+    with open(config_path) as file_h:
+        raw_config = config._inject_env_variables(file_h.read())
+    parsed = yaml.load(raw_config, Loader=yaml.SafeLoader)
+    with as_file(files("dnsrobocert") / "schema.yml") as schema_path:
+        with open(schema_path) as file_h:
+            schema = yaml.load(file_h.read(), yaml.SafeLoader)
+    jsonschema.validate(instance=parsed, schema=schema)
+    return parsed
+
+
+def _measure(function: Callable[[], Any], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - start) / rounds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark config.load.")
+    parser.add_argument("sizes", nargs="*", type=int, default=[10, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["BENCHMARK_TOKEN"] = "TOKEN"
+    print(f"YAML loader: {config.YAML_LOADER.__name__}")
+    print(f"{'certificates':>12} {'previous':>12} {'cold':>12} {'warm':>12}")
+
+    with tempfile.TemporaryDirectory() as workspace:
+        for size in args.sizes:
+            config_path = os.path.join(workspace, f"config-{size}.yml")
+            _generate(config_path, size)
+
+            legacy = _measure(lambda: _legacy_load(config_path), args.rounds)
+
+            def cold_load() -> None:
+                config._CACHE.clear()
+                config.load(config_path)
+
+            cold = _measure(cold_load, args.rounds)
+            warm = _measure(lambda: config.load(config_path), args.rounds)
+
+            print(
+                f"{size:>12} {legacy * 1000:>10.1f}ms {cold * 1000:>10.1f}ms "
+                f"{warm * 1000:>10.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+End-to-end benchmark of the certificates issuance, without any network access.
+
+Usage: python test/benchmarks/e2e_benchmark.py [LINEAGES_COUNT ...]
+
+For each size, the real DNSroboCert pipeline (main --one-shot: account registration,
+then Certbot and the hooks for each lineage) is run against local stand-ins:
+* an ACME server (standins/acme_server.py),
+* an authoritative DNS server for the example.com zone (standins/dns_server.py),
+* a Lexicon provider updating this DNS server (standins/providers/standin.py).
+
+The stand-ins are plugged in every process by standins/benchmark_standins.py, and tracing
+is enabled to collect the spans of the daemon, Certbot and hooks processes.
+It reports the throughput (issued lineages per second) and the latency of each phase
+(count, mean, median and 95th percentile of the spans with the same name).
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any
+
+import yaml
+
+from dnsrobocert.core import main as dnsrobocert_main
+
+_STANDINS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "standins")
+sys.path.insert(0, _STANDINS_PATH)
+
+import benchmark_standins  # noqa: E402
+from acme_server import ACMEServer  # noqa: E402
+from dns_server import DNSServer  # noqa: E402
+
+_ZONE = "example.com"
+
+# Module loaded at the startup of the child processes, generated outside of the sources
+# so it is never collected as a test module. The sitecustomize module of the
+# interpreter, if any, is still executed.
+_BOOTSTRAP = """\
+import runpy
+
+import benchmark_standins
+
+benchmark_standins.install()
+for path in {chained!r}:
+    runpy.run_path(path)
+"""
+
+
+def _install_standins(dns_address: tuple[str, int], bootstrap_path: str) -> None:
+    spec = importlib.util.find_spec("sitecustomize")
+    chained = [spec.origin] if spec and spec.origin else []
+    with open(os.path.join(bootstrap_path, "sitecustomize.py"), "w") as file_h:
+        file_h.write(_BOOTSTRAP.format(chained=chained))
+
+    # Child processes load sitecustomize at startup from PYTHONPATH.
+    os.environ[benchmark_standins.DNS_ENV] = "{0}:{1}".format(*dns_address)
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        [
+            bootstrap_path,
+            _STANDINS_PATH,
+            *filter(None, [os.environ.get("PYTHONPATH")]),
+        ]
+    )
+    # The current process, that runs the daemon and may run the hooks, is set up too.
+    benchmark_standins.install()
+
+
+def _generate(
+    path: str,
+    lineages_count: int,
+    acme_url: str,
+    dns_address: tuple[str, int],
+    tracing_file: str,
+    args: argparse.Namespace,
+) -> None:
+    acme: dict[str, Any] = {
+        "email_account": "john.doe@example.com",
+        "directory_url": acme_url,
+    }
+    if args.max_parallel_issuance:
+        acme["max_parallel_issuance"] = args.max_parallel_issuance
+    if args.certbot_workers:
+        acme["certbot_workers"] = args.certbot_workers
+
+    config = {
+        "draft": False,
+        "acme": acme,
+        "api": {"tracing": {"file": tracing_file}},
+        "profiles": [
+            {
+                "name": "standin",
+                "provider": "standin",
+                "provider_options": {
+                    "nameserver": dns_address[0],
+                    "port": dns_address[1],
+                },
+                "propagation_strategy": "backoff",
+                "sleep_time": args.sleep_time,
+            }
+        ],
+        "certificates": [
+            {
+                "name": f"cert{index}.{_ZONE}",
+                "domains": [f"cert{index}.{_ZONE}", f"*.cert{index}.{_ZONE}"],
+                "profile": "standin",
+                **({"key_type": args.key_type} if args.key_type else {}),
+            }
+            for index in range(lineages_count)
+        ],
+    }
+
+    with open(path, "w") as file_h:
+        yaml.safe_dump(config, file_h)
+
+
+def _spans(tracing_file: str) -> dict[str, list[float]]:
+    durations: dict[str, list[float]] = {}
+    if not os.path.exists(tracing_file):
+        return durations
+
+    with open(tracing_file) as file_h:
+        for line in file_h:
+            for resource_spans in json.loads(line)["resourceSpans"]:
+                for scope_spans in resource_spans["scopeSpans"]:
+                    for span in scope_spans["spans"]:
+                        durations.setdefault(span["name"], []).append(
+                            (
+                                int(span["endTimeUnixNano"])
+                                - int(span["startTimeUnixNano"])
+                            )
+                            / 1e9
+                        )
+    return durations
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+
+def _run(
+    size: int,
+    acme: ACMEServer,
+    dns_address: tuple[str, int],
+    args: argparse.Namespace,
+    workspace: str,
+) -> None:
+    config_path = os.path.join(workspace, "config.yml")
+    directory_path = os.path.join(workspace, "letsencrypt")
+    tracing_file = os.path.join(workspace, "spans.jsonl")
+    _generate(config_path, size, acme.directory_url, dns_address, tracing_file, args)
+
+    start = time.perf_counter()
+    dnsrobocert_main.main(["-c", config_path, "-d", directory_path, "--one-shot"])
+    duration = time.perf_counter() - start
+
+    live_path = os.path.join(directory_path, "live")
+    issued = len(
+        [
+            lineage
+            for lineage in os.listdir(live_path)
+            if os.path.isdir(os.path.join(live_path, lineage))
+        ]
+        if os.path.isdir(live_path)
+        else []
+    )
+
+    print()
+    print(
+        f"{size} lineage(s): {issued} issued in {duration:.2f}s, "
+        f"{issued / duration:.2f} lineages/s"
+    )
+    print(f"{'phase':<24} {'count':>7} {'mean':>10} {'p50':>10} {'p95':>10}")
+    for name, durations in sorted(_spans(tracing_file).items()):
+        print(
+            f"{name:<24} {len(durations):>7} "
+            f"{statistics.mean(durations) * 1000:>8.1f}ms "
+            f"{_percentile(durations, 0.5) * 1000:>8.1f}ms "
+            f"{_percentile(durations, 0.95) * 1000:>8.1f}ms"
+        )
+
+    if issued != size:
+        print(f"WARNING: {size - issued} lineage(s) were not issued.", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the issuance pipeline.")
+    parser.add_argument("sizes", nargs="*", type=int, default=[1, 50, 1000])
+    parser.add_argument("--max-parallel-issuance", type=int)
+    parser.add_argument("--certbot-workers", type=int)
+    parser.add_argument("--key-type", choices=["rsa", "ecdsa"])
+    parser.add_argument(
+        "--sleep-time",
+        type=float,
+        default=0.1,
+        help="maximum delay between two checks of the TXT records propagation",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the workspaces of each run"
+    )
+    args = parser.parse_args()
+
+    dns_server = DNSServer(_ZONE).start()
+    acme = ACMEServer(dns_server.address).start()
+    bootstrap_path = tempfile.mkdtemp(prefix="dnsrobocert-benchmark-bootstrap-")
+    _install_standins(dns_server.address, bootstrap_path)
+    print(f"ACME server: {acme.directory_url}")
+    print(f"DNS server: {dns_server.address[0]}:{dns_server.address[1]}")
+
+    try:
+        for size in args.sizes:
+            workspace = tempfile.mkdtemp(prefix=f"dnsrobocert-benchmark-{size}-")
+            try:
+                _run(size, acme, dns_server.address, args, workspace)
+            finally:
+                if args.keep:
+                    print(f"Workspace kept in {workspace}")
+                else:
+                    shutil.rmtree(workspace, ignore_errors=True)
+    finally:
+        acme.stop()
+        dns_server.stop()
+        shutil.rmtree(bootstrap_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""
+Minimal ACME v2 server (RFC 8555), listening on HTTP on the loopback.
+
+It implements what Certbot needs to register an account, issue certificates with
+dns-01 challenges and revoke them. Challenges are validated synchronously against
+the benchmark DNS server, and certificates are signed by a throwaway CA.
+Signatures of the JWS requests are not verified: it is a stand-in for benchmarks and
+tests, not an ACME server to rely on.
+"""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+import dns.exception
+import dns.resolver
+import josepy
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+_CERTIFICATE_LIFETIME = datetime.timedelta(days=90)
+
+
+class ACMEServer:
+    def __init__(
+        self, dns_address: tuple[str, int], host: str = "127.0.0.1", port: int = 0
+    ) -> None:
+        self._resolver = dns.resolver.Resolver(configure=False)
+        self._resolver.nameservers = [dns_address[0]]
+        self._resolver.port = dns_address[1]
+        self._resolver.lifetime = 5
+        self._ca_key, self._ca_certificate = _generate_ca()
+
+        self._lock = threading.Lock()
+        self._accounts: dict[str, dict[str, Any]] = {}
+        self._orders: dict[str, dict[str, Any]] = {}
+        self._authorizations: dict[str, dict[str, Any]] = {}
+        self._challenges: dict[str, str] = {}
+        self._certificates: dict[str, bytes] = {}
+        self.stats = {"orders": 0, "certificates": 0, "revocations": 0}
+
+        server = self
+
+        class Handler(_Handler):
+            acme = server
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = "http://{0}:{1}".format(*self._server.server_address[:2])
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="benchmark-acme", daemon=True
+        )
+
+    @property
+    def directory_url(self) -> str:
+        return f"{self.url}/directory"
+
+    def start(self) -> ACMEServer:
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def directory(self) -> dict[str, Any]:
+        return {
+            "newNonce": f"{self.url}/new-nonce",
+            "newAccount": f"{self.url}/new-account",
+            "newOrder": f"{self.url}/new-order",
+            "revokeCert": f"{self.url}/revoke-cert",
+            "keyChange": f"{self.url}/key-change",
+            "meta": {"termsOfService": f"{self.url}/terms"},
+        }
+
+    def new_account(
+        self, jwk: dict[str, Any], payload: dict[str, Any]
+    ) -> tuple[int, dict[str, Any], str]:
+        thumbprint = _thumbprint(jwk)
+        with self._lock:
+            account = self._accounts.get(thumbprint)
+            if not account:
+                if payload.get("onlyReturnExisting"):
+                    raise _Problem("accountDoesNotExist", "No account for this key.")
+                account = {
+                    "status": "valid",
+                    "contact": payload.get("contact", []),
+                    "orders": f"{self.url}/acct/{thumbprint}/orders",
+                }
+                self._accounts[thumbprint] = account
+                status = 201
+            else:
+                status = 200
+        return status, account, f"{self.url}/acct/{thumbprint}"
+
+    def account(self, account_id: str) -> dict[str, Any]:
+        with self._lock:
+            if account_id not in self._accounts:
+                raise _Problem("accountDoesNotExist", "No such account.", 404)
+            return self._accounts[account_id]
+
+    def new_order(
+        self, account_id: str, payload: dict[str, Any]
+    ) -> tuple[dict[str, Any], str]:
+        order_id = secrets.token_hex(8)
+        authorizations = []
+        with self._lock:
+            for identifier in payload["identifiers"]:
+                wildcard = identifier["value"].startswith("*.")
+                authz_id = secrets.token_hex(8)
+                challenge_id = secrets.token_hex(8)
+                self._authorizations[authz_id] = {
+                    "account": account_id,
+                    "order": order_id,
+                    "status": "pending",
+                    "identifier": {
+                        "type": "dns",
+                        "value": identifier["value"][2 if wildcard else 0 :],
+                    },
+                    "wildcard": wildcard,
+                    "challenge": {
+                        "type": "dns-01",
+                        "url": f"{self.url}/chall/{challenge_id}",
+                        "token": josepy.b64encode(secrets.token_bytes(32)).decode(),
+                        "status": "pending",
+                    },
+                }
+                self._challenges[challenge_id] = authz_id
+                authorizations.append(authz_id)
+
+            self._orders[order_id] = {
+                "status": "pending",
+                "identifiers": payload["identifiers"],
+                "authorizations": authorizations,
+            }
+            self.stats["orders"] += 1
+
+        return self.order(order_id), f"{self.url}/order/{order_id}"
+
+    def order(self, order_id: str) -> dict[str, Any]:
+        with self._lock:
+            order = self._orders.get(order_id)
+            if not order:
+                raise _Problem("malformed", "No such order.", 404)
+
+            body = {
+                key: value for key, value in order.items() if key != "authorizations"
+            }
+            body["authorizations"] = [
+                f"{self.url}/authz/{authz_id}" for authz_id in order["authorizations"]
+            ]
+            body["finalize"] = f"{self.url}/order/{order_id}/finalize"
+            if order_id in self._certificates:
+                body["certificate"] = f"{self.url}/cert/{order_id}"
+            return body
+
+    def authorization(self, authz_id: str) -> dict[str, Any]:
+        with self._lock:
+            authz = self._authorizations.get(authz_id)
+            if not authz:
+                raise _Problem("malformed", "No such authorization.", 404)
+            return {
+                "status": authz["status"],
+                "identifier": authz["identifier"],
+                "wildcard": authz["wildcard"],
+                "challenges": [authz["challenge"]],
+            }
+
+    def answer_challenge(self, challenge_id: str) -> tuple[dict[str, Any], str]:
+        with self._lock:
+            authz_id = self._challenges.get(challenge_id)
+            if not authz_id:
+                raise _Problem("malformed", "No such challenge.", 404)
+            authz = self._authorizations[authz_id]
+            challenge = authz["challenge"]
+            thumbprint = authz["account"]
+            name = f"_acme-challenge.{authz['identifier']['value']}."
+
+        key_authorization = f"{challenge['token']}.{josepy.b64encode(bytes.fromhex(thumbprint)).decode()}"
+        expected = josepy.b64encode(
+            hashlib.sha256(key_authorization.encode("utf-8")).digest()
+        ).decode()
+
+        try:
+            answers = self._resolver.resolve(name, "TXT")
+            values = [b"".join(rdata.strings).decode("utf-8") for rdata in answers]
+        except dns.exception.DNSException:
+            values = []
+
+        with self._lock:
+            if expected in values:
+                challenge["status"] = authz["status"] = "valid"
+            else:
+                challenge["status"] = authz["status"] = "invalid"
+                challenge["error"] = {
+                    "type": "urn:ietf:params:acme:error:unauthorized",
+                    "detail": f"Incorrect TXT record found at {name}",
+                }
+
+            order = self._orders[authz["order"]]
+            statuses = {
+                self._authorizations[other]["status"]
+                for other in order["authorizations"]
+            }
+            if "invalid" in statuses:
+                order["status"] = "invalid"
+            elif statuses == {"valid"}:
+                order["status"] = "ready"
+
+            return dict(challenge), f"{self.url}/authz/{authz_id}"
+
+    def finalize(self, order_id: str, payload: dict[str, Any]) -> dict[str, Any]:
+        csr = x509.load_der_x509_csr(josepy.b64decode(payload["csr"]))
+        names = csr.extensions.get_extension_for_class(
+            x509.SubjectAlternativeName
+        ).value.get_values_for_type(x509.DNSName)
+
+        with self._lock:
+            order = self._orders.get(order_id)
+            if not order:
+                raise _Problem("malformed", "No such order.", 404)
+            if order["status"] != "ready":
+                raise _Problem("orderNotReady", f"Order is {order['status']}.", 403)
+            if sorted(names) != sorted(
+                identifier["value"] for identifier in order["identifiers"]
+            ):
+                raise _Problem("badCSR", "CSR does not match the order identifiers.")
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(
+                x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, names[0])])
+            )
+            .issuer_name(self._ca_certificate.subject)
+            .public_key(csr.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=1))
+            .not_valid_after(now + _CERTIFICATE_LIFETIME)
+            .add_extension(
+                x509.SubjectAlternativeName([x509.DNSName(name) for name in names]),
+                critical=False,
+            )
+            .add_extension(
+                x509.BasicConstraints(ca=False, path_length=None), critical=True
+            )
+            .sign(self._ca_key, hashes.SHA256())
+        )
+
+        with self._lock:
+            self._certificates[order_id] = certificate.public_bytes(
+                serialization.Encoding.PEM
+            ) + self._ca_certificate.public_bytes(serialization.Encoding.PEM)
+            order["status"] = "valid"
+            self.stats["certificates"] += 1
+
+        return self.order(order_id)
+
+    def certificate(self, order_id: str) -> bytes:
+        with self._lock:
+            if order_id not in self._certificates:
+                raise _Problem("malformed", "No such certificate.", 404)
+            return self._certificates[order_id]
+
+    def revoke(self) -> None:
+        with self._lock:
+            self.stats["revocations"] += 1
+
+
+class _Problem(Exception):
+    def __init__(self, kind: str, detail: str, status: int = 400) -> None:
+        super().__init__(detail)
+        self.kind = kind
+        self.detail = detail
+        self.status = status
+
+
+class _Handler(BaseHTTPRequestHandler):
+    acme: ACMEServer
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent in one segment, otherwise the delayed ACKs of the
+    # client add 40ms to most requests.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_HEAD(self) -> None:
+        self._send(200 if self.path == "/new-nonce" else 404)
+
+    def do_GET(self) -> None:
+        if self.path == "/directory":
+            self._send(200, self.acme.directory())
+        elif self.path == "/new-nonce":
+            self._send(204)
+        else:
+            self._send(404)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            jws = json.loads(self.rfile.read(length))
+            protected = json.loads(josepy.b64decode(jws["protected"]))
+            payload = (
+                json.loads(josepy.b64decode(jws["payload"])) if jws["payload"] else None
+            )
+            account_id = protected.get("kid", "").rpartition("/")[2]
+            self._dispatch(
+                self.path.strip("/").split("/"), protected, payload, account_id
+            )
+        except _Problem as problem:
+            self._send(
+                problem.status,
+                {
+                    "type": f"urn:ietf:params:acme:error:{problem.kind}",
+                    "detail": problem.detail,
+                },
+                content_type="application/problem+json",
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(
+                400,
+                {"type": "urn:ietf:params:acme:error:malformed", "detail": str(e)},
+                content_type="application/problem+json",
+            )
+
+    def _dispatch(
+        self,
+        parts: list[str],
+        protected: dict[str, Any],
+        payload: dict[str, Any] | None,
+        account_id: str,
+    ) -> None:
+        if parts == ["new-account"]:
+            status, account, location = self.acme.new_account(
+                protected["jwk"], payload or {}
+            )
+            self._send(status, account, location=location)
+        elif parts[0] == "acct":
+            self._send(200, self.acme.account(parts[1]))
+        elif parts == ["new-order"]:
+            order, location = self.acme.new_order(account_id, payload or {})
+            self._send(201, order, location=location)
+        elif parts[0] == "order" and len(parts) == 3 and parts[2] == "finalize":
+            self._send(200, self.acme.finalize(parts[1], payload or {}))
+        elif parts[0] == "order":
+            self._send(200, self.acme.order(parts[1]))
+        elif parts[0] == "authz":
+            self._send(200, self.acme.authorization(parts[1]))
+        elif parts[0] == "chall":
+            if payload is None:
+                raise _Problem(
+                    "malformed", "POST-as-GET on challenges is not supported."
+                )
+            challenge, authz_url = self.acme.answer_challenge(parts[1])
+            self._send(200, challenge, links=[f'<{authz_url}>;rel="up"'])
+        elif parts[0] == "cert":
+            self._send(
+                200,
+                self.acme.certificate(parts[1]),
+                content_type="application/pem-certificate-chain",
+            )
+        elif parts == ["revoke-cert"]:
+            self.acme.revoke()
+            self._send(200)
+        else:
+            raise _Problem("malformed", f"Unknown resource {self.path}.", 404)
+
+    def _send(
+        self,
+        status: int,
+        body: dict[str, Any] | bytes | None = None,
+        content_type: str = "application/json",
+        location: str | None = None,
+        links: list[str] | None = None,
+    ) -> None:
+        data = (
+            body
+            if isinstance(body, bytes)
+            else json.dumps(body).encode("utf-8") if body is not None else b""
+        )
+        self.send_response(status)
+        self.send_header(
+            "Replay-Nonce", josepy.b64encode(secrets.token_bytes(16)).decode()
+        )
+        self.send_header("Cache-Control", "no-store")
+        if data:
+            self.send_header("Content-Type", content_type)
+        if location:
+            self.send_header("Location", location)
+        for link in links or []:
+            self.send_header("Link", link)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def _thumbprint(jwk: dict[str, Any]) -> str:
+    # Accounts are identified by the RFC 7638 thumbprint of their key, so the key
+    # authorizations can be computed back from the account identifier.
+    return josepy.JWK.from_json(jwk).thumbprint(hash_function=hashes.SHA256).hex()
+
+
+def _generate_ca() -> tuple[ec.EllipticCurvePrivateKey, x509.Certificate]:
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark Stand-in CA")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=3650))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    return key, certificate
@@ -0,0 +1,34 @@
+"""
+Installed at the startup of every Python process of the benchmark (by the sitecustomize
+module generated by e2e_benchmark.py), including the Certbot and hooks processes spawned
+by DNSroboCert. It registers the stand-in Lexicon provider, and makes dnspython resolve
+the names against the benchmark DNS server instead of the system resolvers.
+"""
+
+from __future__ import annotations
+
+import os
+
+# Address of the benchmark DNS server, as HOST:PORT.
+DNS_ENV = "DNSROBOCERT_BENCHMARK_DNS"
+
+
+def install() -> None:
+    address = os.environ.get(DNS_ENV)
+    if not address:
+        return
+
+    import dns.resolver
+    from lexicon._private import providers
+
+    providers_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "providers"
+    )
+    if providers_path not in providers.__path__:
+        providers.__path__.append(providers_path)
+
+    host, _, port = address.rpartition(":")
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = [host]
+    resolver.port = int(port)
+    dns.resolver.default_resolver = resolver
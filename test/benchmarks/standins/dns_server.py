@@ -0,0 +1,137 @@
+"""
+Authoritative DNS server for the benchmark zone, listening on UDP on the loopback.
+
+It answers the SOA of the zone and the TXT records of the challenges, and accepts
+dynamic updates (RFC 2136) of these TXT records, as sent by the stand-in Lexicon
+provider. Other record types are not supported.
+"""
+
+from __future__ import annotations
+
+import socket
+import threading
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+_TTL = 1
+
+
+class DNSServer:
+    def __init__(self, zone: str, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.zone = dns.name.from_text(zone)
+        self._soa = dns.rrset.from_text(
+            self.zone,
+            _TTL,
+            "IN",
+            "SOA",
+            f"ns.{self.zone} hostmaster.{self.zone} 1 3600 600 86400 {_TTL}",
+        )
+        self._records: dict[dns.name.Name, list[str]] = {}
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self.address: tuple[str, int] = self._socket.getsockname()
+        self._thread = threading.Thread(
+            target=self._serve, name="benchmark-dns", daemon=True
+        )
+
+    def start(self) -> DNSServer:
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._socket.close()
+
+    def txt(self, name: str) -> list[str]:
+        with self._lock:
+            return list(self._records.get(dns.name.from_text(name), []))
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                wire, client = self._socket.recvfrom(65535)
+            except OSError:
+                return
+
+            try:
+                request = dns.message.from_wire(wire)
+            except Exception:
+                continue
+
+            if request.opcode() == dns.opcode.UPDATE:
+                response = self._update(request)
+            else:
+                response = self._query(request)
+
+            try:
+                self._socket.sendto(response.to_wire(), client)
+            except OSError:
+                return
+
+    def _query(self, request: dns.message.Message) -> dns.message.Message:
+        response = dns.message.make_response(request)
+        response.flags |= dns.flags.AA
+        question = request.question[0]
+        name = question.name
+
+        if not name.is_subdomain(self.zone):
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+
+        with self._lock:
+            values = list(self._records.get(name, []))
+
+        if question.rdtype == dns.rdatatype.SOA and name == self.zone:
+            response.answer.append(self._soa)
+        elif question.rdtype == dns.rdatatype.TXT and values:
+            response.answer.append(
+                dns.rrset.from_text_list(
+                    name, _TTL, "IN", "TXT", [f'"{value}"' for value in values]
+                )
+            )
+        else:
+            if not values and name != self.zone:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(self._soa)
+
+        return response
+
+    def _update(self, request: dns.message.Message) -> dns.message.Message:
+        response = dns.message.make_response(request)
+
+        # For an UPDATE message, the zone section is the question section, and the
+        # update section is the authority section.
+        if not request.question or request.question[0].name != self.zone:
+            response.set_rcode(dns.rcode.NOTAUTH)
+            return response
+
+        with self._lock:
+            for rrset in request.authority:
+                if rrset.rdtype != dns.rdatatype.TXT:
+                    continue
+
+                values = self._records.setdefault(rrset.name, [])
+                if rrset.rdclass == dns.rdataclass.IN:
+                    for rdata in rrset:
+                        value = b"".join(rdata.strings).decode("utf-8")
+                        if value not in values:
+                            values.append(value)
+                elif rrset.rdclass == dns.rdataclass.NONE:
+                    for rdata in rrset:
+                        value = b"".join(rdata.strings).decode("utf-8")
+                        if value in values:
+                            values.remove(value)
+                elif rrset.rdclass == dns.rdataclass.ANY:
+                    values.clear()
+
+                if not values:
+                    del self._records[rrset.name]
+
+        return response
@@ -0,0 +1,124 @@
+"""
+Lexicon provider managing the TXT records of the benchmark DNS server through
+dynamic updates (RFC 2136). Only TXT records are supported.
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from typing import Any
+
+import dns.exception
+import dns.query
+import dns.rcode
+import dns.resolver
+import dns.update
+from lexicon.exceptions import AuthenticationError
+from lexicon.interfaces import Provider as BaseProvider
+
+
+class Provider(BaseProvider):
+    @staticmethod
+    def get_nameservers() -> list[str]:
+        return []
+
+    @staticmethod
+    def configure_parser(parser: ArgumentParser) -> None:
+        parser.add_argument("--nameserver", help="address of the DNS server")
+        parser.add_argument("--port", help="port of the DNS server")
+
+    def __init__(self, config: Any) -> None:
+        super().__init__(config)
+        self.domain = str(self._get_lexicon_option("domain"))
+        self.nameserver = str(self._get_provider_option("nameserver") or "127.0.0.1")
+        self.port = int(self._get_provider_option("port") or 53)
+
+    def authenticate(self) -> None:
+        resolver = dns.resolver.Resolver(configure=False)
+        resolver.nameservers = [self.nameserver]
+        resolver.port = self.port
+        try:
+            resolver.resolve(f"{self.domain}.", "SOA")
+        except dns.exception.DNSException as e:
+            raise AuthenticationError(f"Zone {self.domain} is not served: {e}")
+
+    def create_record(self, rtype: str, name: str, content: str) -> bool:
+        update = self._update()
+        update.add(
+            self._fqdn_name(name),
+            self._get_lexicon_option("ttl") or 1,
+            rtype,
+            f'"{content}"',
+        )
+        return self._send(update)
+
+    def list_records(
+        self,
+        rtype: str | None = None,
+        name: str | None = None,
+        content: str | None = None,
+    ) -> list[dict[str, Any]]:
+        if rtype != "TXT" or not name:
+            return []
+
+        resolver = dns.resolver.Resolver(configure=False)
+        resolver.nameservers = [self.nameserver]
+        resolver.port = self.port
+        try:
+            answers = resolver.resolve(self._fqdn_name(name), "TXT")
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return []
+
+        records = []
+        for rdata in answers:
+            value = b"".join(rdata.strings).decode("utf-8")
+            if content is None or value == content:
+                records.append(
+                    {
+                        "id": f"{self._full_name(name)}/{value}",
+                        "type": "TXT",
+                        "name": self._full_name(name),
+                        "ttl": answers.rrset.ttl if answers.rrset else 1,
+                        "content": value,
+                    }
+                )
+        return records
+
+    def update_record(
+        self,
+        identifier: str | None = None,
+        rtype: str | None = None,
+        name: str | None = None,
+        content: str | None = None,
+    ) -> bool:
+        raise NotImplementedError("TXT records are only created and deleted.")
+
+    def delete_record(
+        self,
+        identifier: str | None = None,
+        rtype: str | None = None,
+        name: str | None = None,
+        content: str | None = None,
+    ) -> bool:
+        if identifier:
+            name, _, content = identifier.partition("/")
+        if not name:
+            return False
+
+        update = self._update()
+        if content:
+            update.delete(self._fqdn_name(name), rtype or "TXT", f'"{content}"')
+        else:
+            update.delete(self._fqdn_name(name), rtype or "TXT")
+        return self._send(update)
+
+    def _update(self) -> dns.update.UpdateMessage:
+        return dns.update.UpdateMessage(f"{self.domain}.")
+
+    def _send(self, update: dns.update.UpdateMessage) -> bool:
+        response = dns.query.udp(update, self.nameserver, port=self.port, timeout=5)
+        if response.rcode() != dns.rcode.NOERROR:
+            raise RuntimeError(
+                f"Update refused by the DNS server: {dns.rcode.to_text(response.rcode())}"
+            )
+        return True
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+from dnsrobocert.core import background, index
+
+
+def _info(lineage: str, not_before: datetime) -> index.LineageInfo:
+    return index.LineageInfo(
+        lineage=lineage,
+        not_before=not_before,
+        not_after=not_before + timedelta(days=90),
+        domains=frozenset([lineage]),
+        key_type="rsa",
+        server="https://acme-v02.api.letsencrypt.org/directory",
+    )
+
+
+# Periodic checks by Certbot are not due before the renewals of this test.
+@patch.object(index, "CERTBOT_CHECK_INTERVAL", 365 * 86400)
+@patch("dnsrobocert.core.background.certbot.renew")
+@patch("dnsrobocert.core.background.index.build")
+def test_scheduler(build: MagicMock, renew: MagicMock, tmp_path: Path) -> None:
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("""\
+acme:
+  renewal_fraction: 0.5
+profiles:
+- name: dummy
+  provider: dummy
+certificates:
+- domains: [test1.example.net]
+  profile: dummy
+- domains: [test2.example.net]
+  profile: dummy
+- domains: [test3.example.net]
+  profile: dummy
+""")
+    now = datetime.now(timezone.utc)
+    build.return_value = {
+        # Due since 5 days
+        "test1.example.net": _info("test1.example.net", now - timedelta(days=50)),
+        # Due in 5 days with the renewal fraction of 0.5, not due with the default one
+        "test2.example.net": _info("test2.example.net", now - timedelta(days=40)),
+    }
+    renewed = threading.Event()
+    snapshots = []
+
+    def _renew(*_args: Any, **_kwargs: Any) -> None:
+        # The queue can be inspected from another thread while a renewal runs.
+        snapshots.append(scheduler.queue())
+        renewed.set()
+
+    renew.side_effect = _renew
+
+    with background.worker(
+        str(config_path), str(tmp_path), threading.Lock()
+    ) as scheduler:
+        assert renewed.wait(5)
+    scheduler.join(5)
+
+    assert renew.call_args[0][3] == ["test1.example.net"]
+    assert {lineage for _, lineage in snapshots[0]} == {
+        "test2.example.net",
+        "test3.example.net",
+    }
+
+    queue = scheduler.queue()
+    assert {lineage for _, lineage in queue[:2]} == {
+        "test1.example.net",
+        "test3.example.net",
+    }
+    assert queue[2][1] == "test2.example.net"
+    # Failed renewals and missing certificates are retried later.
+    assert queue[0][0] > time.time() + background._RETRY_DELAY - 60
+    assert queue[1][0] > time.time() + background._RETRY_DELAY - 60
+    # Renewal is spread with a jitter.
+    due = (now + timedelta(days=5)).timestamp()
+    assert due <= queue[2][0] <= due + background._JITTER_WINDOW
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from dnsrobocert.core import cache
+
+
+def test_resolution_cache(tmp_path: Path) -> None:
+    path = str(tmp_path / "dnsrobocert" / "resolution-cache.json")
+    resolve = MagicMock(return_value="example.com")
+
+    first = cache.ResolutionCache(path)
+    assert first.lookup("zone", "www.example.com", resolve) == "example.com"
+
+    # Another process shares the same cache file.
+    second = cache.ResolutionCache(path)
+    assert second.lookup("zone", "www.example.com", resolve) == "example.com"
+    assert resolve.call_count == 1
+    assert second.stats() == {"hits": 1, "misses": 1, "invalidations": 0}
+
+    second.invalidate("zone", "www.example.com")
+    assert first.lookup("zone", "www.example.com", resolve) == "example.com"
+    assert resolve.call_count == 2
+    assert first.stats() == {"hits": 1, "misses": 2, "invalidations": 1}
+
+
+def test_resolution_cache_expiration(tmp_path: Path) -> None:
+    path = str(tmp_path / "resolution-cache.json")
+    resolve = MagicMock(return_value="example.com")
+    resolution_cache = cache.ResolutionCache(path, ttl=60)
+
+    with patch("dnsrobocert.core.cache.time.time", return_value=1000):
+        resolution_cache.lookup("zone", "www.example.com", resolve)
+    with patch("dnsrobocert.core.cache.time.time", return_value=1059):
+        resolution_cache.lookup("zone", "www.example.com", resolve)
+    assert resolve.call_count == 1
+
+    with patch("dnsrobocert.core.cache.time.time", return_value=1061):
+        resolution_cache.lookup("zone", "www.example.com", resolve)
+    assert resolve.call_count == 2
+
+
+def test_disabled_resolution_cache() -> None:
+    resolve = MagicMock(return_value="example.com")
+    resolution_cache = cache.ResolutionCache(None)
+
+    resolution_cache.lookup("zone", "www.example.com", resolve)
+    resolution_cache.lookup("zone", "www.example.com", resolve)
+
+    assert resolve.call_count == 2
+
+
+def test_resolution_cache_hits(tmp_path: Path) -> None:
+    path = str(tmp_path / "resolution-cache.json")
+    resolve = MagicMock(return_value="example.com")
+    cache.ResolutionCache(path).lookup("zone", "www.example.com", resolve)
+
+    # Hits do not write the cache file, until the statistics are flushed.
+    resolution_cache = cache.ResolutionCache(path)
+    with patch("dnsrobocert.core.cache.utils.atomic_write") as atomic_write:
+        for _ in range(3):
+            resolution_cache.lookup("zone", "www.example.com", resolve)
+        atomic_write.assert_not_called()
+    assert resolution_cache.stats() == {"hits": 3, "misses": 1, "invalidations": 0}
+
+    resolution_cache.flush()
+    assert cache.ResolutionCache(path).stats() == {
+        "hits": 3,
+        "misses": 1,
+        "invalidations": 0,
+    }
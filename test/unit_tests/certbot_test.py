@@ -0,0 +1,610 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from dnsrobocert.core import certbot, index, state
+
+
+def _write_config(tmp_path: Path, max_parallel_issuance: int) -> Path:
+    config_path = tmp_path / "config.yml"
+    config_path.write_text(f"""\
+acme:
+  max_parallel_issuance: {max_parallel_issuance}
+profiles:
+- name: dummy
+  provider: dummy
+certificates:
+- domains: [test1.example.net]
+  profile: dummy
+- domains: [test2.example.net]
+  profile: dummy
+- domains: [test3.example.net]
+  profile: dummy
+""")
+    return config_path
+
+
+def _issued(_directory_path: str, lineage: str) -> index.LineageInfo:
+    # Certificate found in the live directory after a successful Certbot invocation.
+    now = datetime.now(timezone.utc)
+    return index.LineageInfo(
+        lineage,
+        now,
+        now + timedelta(days=90),
+        frozenset([lineage]),
+        "rsa",
+        "https://acme-v02.api.letsencrypt.org/directory",
+    )
+
+
+@patch("dnsrobocert.core.certbot.revoke")
+def test_parallel_issuance(revoke: MagicMock, tmp_path: Path) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    os.makedirs(directory_path / "live")
+    config_path = _write_config(tmp_path, 3)
+
+    barrier = threading.Barrier(3, timeout=5)
+    locks = {}
+
+    def _certonly(
+        _config_path: str,
+        _directory_path: str,
+        lineage: str,
+        lock: threading.Lock,
+        *_args: object,
+        **_kwargs: object,
+    ) -> None:
+        locks[lineage] = lock
+        # Would break with a timeout if the certificates were processed serially.
+        barrier.wait()
+
+    global_lock = threading.Lock()
+    with patch("dnsrobocert.core.certbot.certonly", side_effect=_certonly):
+        certbot._issue(str(config_path), str(directory_path), global_lock)
+
+    assert sorted(locks) == [
+        "test1.example.net",
+        "test2.example.net",
+        "test3.example.net",
+    ]
+    assert len({id(lock) for lock in locks.values()}) == 3
+    assert global_lock not in locks.values()
+    assert certbot._lineage_lock("test1.example.net") is locks["test1.example.net"]
+    assert not revoke.called
+
+
+@patch("dnsrobocert.core.certbot.utils.execute")
+def test_certonly_isolated_directories(execute: MagicMock, tmp_path: Path) -> None:
+    directory_path = str(tmp_path / "letsencrypt")
+    config_path = _write_config(tmp_path, 1)
+
+    certbot.certonly(
+        str(config_path),
+        directory_path,
+        "test1.example.net",
+        threading.Lock(),
+        ["test1.example.net"],
+    )
+
+    command = execute.call_args[0][0]
+    assert command[command.index("--work-dir") + 1] == os.path.join(
+        directory_path, "workdir", "test1.example.net"
+    )
+    assert command[command.index("--logs-dir") + 1] == os.path.join(
+        directory_path, "logs", "test1.example.net"
+    )
+    assert execute.call_args[1]["env"][certbot._SHARED_CONFIG_DIR_ENV] == directory_path
+
+
+@patch("dnsrobocert.core.certbot.utils.execute")
+def test_account_registration(execute: MagicMock, tmp_path: Path) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    config_path = _write_config(tmp_path, 1)
+    config_path.write_text(
+        config_path.read_text().replace(
+            "acme:\n", "acme:\n  email_account: john.doe@example.net\n"
+        )
+    )
+
+    def _register(command: list[str], **_kwargs: object) -> None:
+        if "register" in command:
+            account_path = (
+                directory_path
+                / "accounts"
+                / "acme-v02.api.letsencrypt.org"
+                / "directory"
+                / "0123456789abcdef"
+            )
+            os.makedirs(account_path)
+            (account_path / "regr.json").write_text("{}")
+
+    execute.side_effect = _register
+
+    certbot.account(str(config_path), str(directory_path), threading.Lock())
+    assert execute.call_args[0][0][3] == "register"
+
+    # The existing account is found without spawning Certbot.
+    execute.reset_mock()
+    certbot.account(str(config_path), str(directory_path), threading.Lock())
+    execute.assert_not_called()
+
+    # The account is updated when the email changes.
+    config_path.write_text(config_path.read_text().replace("john.doe@", "jane.smith@"))
+    certbot.account(str(config_path), str(directory_path), threading.Lock())
+    command = execute.call_args[0][0]
+    assert command[3] == "update_account"
+    assert command[command.index("-m", 4) + 1] == "jane.smith@example.net"
+    execute.reset_mock()
+    certbot.account(str(config_path), str(directory_path), threading.Lock())
+    execute.assert_not_called()
+
+
+@patch("dnsrobocert.core.certbot.utils.execute")
+def test_account_reused_servers(execute: MagicMock, tmp_path: Path) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    config_path = _write_config(tmp_path, 1)
+    config_path.write_text(
+        config_path.read_text().replace(
+            "acme:\n", "acme:\n  email_account: john.doe@example.net\n"
+        )
+    )
+
+    # Like Certbot, an account of the ACME v1 server is reused for the v2 server.
+    account_path = (
+        directory_path
+        / "accounts"
+        / "acme-v01.api.letsencrypt.org"
+        / "directory"
+        / "0123456789abcdef"
+    )
+    os.makedirs(account_path)
+    (account_path / "regr.json").write_text("{}")
+
+    certbot.account(str(config_path), str(directory_path), threading.Lock())
+    execute.assert_not_called()
+
+
+@patch("dnsrobocert.core.certbot._account_exists")
+@patch("dnsrobocert.core.certbot.utils.execute")
+def test_account_registration_refused(
+    execute: MagicMock, account_exists: MagicMock, tmp_path: Path
+) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    config_path = _write_config(tmp_path, 1)
+    config_path.write_text(
+        config_path.read_text().replace(
+            "acme:\n", "acme:\n  email_account: john.doe@example.net\n"
+        )
+    )
+
+    # Certbot refuses the registration because it found an existing account.
+    account_exists.side_effect = [False, True]
+    execute.side_effect = subprocess.CalledProcessError(1, "certbot")
+
+    certbot.account(str(config_path), str(directory_path), threading.Lock())
+
+    assert execute.call_args[0][0][3] == "register"
+    accounts = json.loads(
+        (directory_path / "dnsrobocert" / "accounts.json").read_text()
+    )
+    assert accounts == {
+        "https://acme-v02.api.letsencrypt.org/directory": "john.doe@example.net"
+    }
+
+
+@patch("dnsrobocert.core.certbot.revoke")
+@patch("dnsrobocert.core.certbot.certonly")
+@patch("dnsrobocert.core.certbot.index.build")
+def test_issue_skips_healthy_lineages(
+    build: MagicMock, certonly: MagicMock, revoke: MagicMock, tmp_path: Path
+) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    os.makedirs(directory_path / "live")
+    config_path = _write_config(tmp_path, 1)
+
+    now = datetime.now(timezone.utc)
+    build.return_value = {
+        "test1.example.net": index.LineageInfo(
+            lineage="test1.example.net",
+            not_before=now - timedelta(days=10),
+            not_after=now + timedelta(days=80),
+            domains=frozenset(["test1.example.net"]),
+            key_type="rsa",
+            server="https://acme-v02.api.letsencrypt.org/directory",
+        )
+    }
+    # Certbot checked this lineage recently.
+    state.open_store(str(directory_path)).start_attempt("test1.example.net")
+
+    certbot._issue(str(config_path), str(directory_path), threading.Lock())
+
+    lineages = sorted(call[0][2] for call in certonly.call_args_list)
+    assert lineages == ["test2.example.net", "test3.example.net"]
+    assert not any(call[1]["force_renew"] for call in certonly.call_args_list)
+
+    # A lineage due according to renewal_fraction is renewed by force, as Certbot
+    # applies its own renewal window.
+    certonly.reset_mock()
+    build.return_value["test1.example.net"] = build.return_value[
+        "test1.example.net"
+    ]._replace(not_before=now - timedelta(days=70), not_after=now + timedelta(days=20))
+    certbot._issue(
+        str(config_path),
+        str(directory_path),
+        threading.Lock(),
+        {"test1.example.net": {"issue"}},
+    )
+    assert certonly.call_args[0][2] == "test1.example.net"
+    assert certonly.call_args[1]["force_renew"]
+
+    # A lineage that is not due is still checked by Certbot once a day, without
+    # forcing its renewal, so Certbot can renew it earlier (ARI).
+    certonly.reset_mock()
+    build.return_value["test1.example.net"] = build.return_value[
+        "test1.example.net"
+    ]._replace(not_before=now - timedelta(days=10), not_after=now + timedelta(days=80))
+    with patch("dnsrobocert.core.certbot.time.time", return_value=time.time() + 86400):
+        certbot._issue(
+            str(config_path),
+            str(directory_path),
+            threading.Lock(),
+            {"test1.example.net": {"issue"}},
+        )
+    assert certonly.call_args[0][2] == "test1.example.net"
+    assert not certonly.call_args[1]["force_renew"]
+
+
+@patch("dnsrobocert.core.certbot.revoke")
+@patch("dnsrobocert.core.certbot.hooks.deploy_lineage")
+@patch("dnsrobocert.core.certbot.certonly")
+@patch("dnsrobocert.core.certbot.index.build")
+def test_issue_applies_changes(
+    build: MagicMock,
+    certonly: MagicMock,
+    deploy_lineage: MagicMock,
+    revoke: MagicMock,
+    tmp_path: Path,
+) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    os.makedirs(directory_path / "live")
+    config_path = _write_config(tmp_path, 1)
+
+    now = datetime.now(timezone.utc)
+    build.return_value = {
+        lineage: index.LineageInfo(
+            lineage=lineage,
+            not_before=now - timedelta(days=10),
+            not_after=now + timedelta(days=80),
+            domains=frozenset([lineage]),
+            key_type="rsa",
+            server="https://acme-v02.api.letsencrypt.org/directory",
+        )
+        for lineage in ["test1.example.net", "test2.example.net"]
+    }
+
+    certbot._issue(
+        str(config_path),
+        str(directory_path),
+        threading.Lock(),
+        {
+            "test1.example.net": {"deploy_hook"},
+            "test3.example.net": {"issue", "deploy_hook"},
+        },
+    )
+
+    # Untouched lineage test2.example.net is not processed, and the deploy settings
+    # of the lineage issued by Certbot are applied by its deploy hook.
+    assert [call[0][2] for call in certonly.call_args_list] == ["test3.example.net"]
+    deploy_lineage.assert_called_once()
+    assert deploy_lineage.call_args[0][1:] == (
+        str(directory_path / "live" / "test1.example.net"),
+        {"deploy_hook"},
+        str(directory_path / "dnsrobocert" / "deploy-queue.jsonl"),
+    )
+
+
+@patch("dnsrobocert.core.certbot.certonly")
+@patch("dnsrobocert.core.certbot.index.build")
+def test_revocation_sweep(
+    build: MagicMock, _certonly: MagicMock, tmp_path: Path
+) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    for lineage in [
+        "test1.example.net",
+        "old1.net",
+        "old2.net",
+        "old3.net",
+        "old4.net",
+    ]:
+        os.makedirs(directory_path / "live" / lineage)
+        os.makedirs(directory_path / "archive" / lineage)
+        os.makedirs(directory_path / "renewal", exist_ok=True)
+        (directory_path / "live" / lineage / "cert.pem").write_text(lineage)
+        (directory_path / "renewal" / f"{lineage}.conf").write_text(lineage)
+    (directory_path / "live" / "README").write_text("README")
+    config_path = _write_config(tmp_path, 1)
+
+    # An expired certificate is deleted without being revoked.
+    now = datetime.now(timezone.utc)
+    build.return_value = {
+        "old3.net": index.LineageInfo(
+            lineage="old3.net",
+            not_before=now - timedelta(days=100),
+            not_after=now - timedelta(days=10),
+            domains=frozenset(["old3.net"]),
+            key_type="rsa",
+            server=None,
+        )
+    }
+
+    # Revocations are executed concurrently, and a failure does not stop the others.
+    barrier = threading.Barrier(3, timeout=5)
+
+    def _revoke(_config: object, _directory_path: str, lineage: str) -> None:
+        barrier.wait()
+        if lineage == "old2.net":
+            raise RuntimeError("CA is unreachable")
+
+    with patch("dnsrobocert.core.certbot.revoke", side_effect=_revoke) as revoke:
+        certbot._issue(str(config_path), str(directory_path), threading.Lock())
+
+    assert sorted(call[0][2] for call in revoke.call_args_list) == [
+        "old1.net",
+        "old2.net",
+        "old4.net",
+    ]
+    assert sorted(os.listdir(directory_path / "live")) == [
+        "README",
+        "old2.net",
+        "test1.example.net",
+    ]
+    assert sorted(os.listdir(directory_path / "archive")) == [
+        "old2.net",
+        "test1.example.net",
+    ]
+    assert sorted(os.listdir(directory_path / "renewal")) == [
+        "old2.net.conf",
+        "test1.example.net.conf",
+    ]
+
+    # The failed revocation is retried after a backoff, then abandoned.
+    with patch("dnsrobocert.core.certbot.revoke") as revoke:
+        certbot._issue(str(config_path), str(directory_path), threading.Lock())
+        revoke.assert_not_called()
+
+    state_path = directory_path / "dnsrobocert" / "revocations.json"
+    state = json.loads(state_path.read_text())
+    assert state["old2.net"]["attempts"] == 1
+    state["old2.net"]["next_attempt"] = 0
+    state_path.write_text(json.dumps(state))
+    with (
+        patch("dnsrobocert.core.certbot._REVOCATION_RETRY_DELAY", 0),
+        patch(
+            "dnsrobocert.core.certbot.revoke", side_effect=RuntimeError("Error")
+        ) as revoke,
+    ):
+        for _ in range(certbot._MAX_REVOCATION_ATTEMPTS + 2):
+            certbot._issue(str(config_path), str(directory_path), threading.Lock())
+        assert revoke.call_count == certbot._MAX_REVOCATION_ATTEMPTS - 1
+    assert os.path.exists(directory_path / "live" / "old2.net")
+
+    # A new certificate for the lineage is handled from scratch.
+    (directory_path / "live" / "old2.net" / "cert.pem").write_text("new")
+    with patch("dnsrobocert.core.certbot.revoke") as revoke:
+        certbot._issue(str(config_path), str(directory_path), threading.Lock())
+        revoke.assert_called_once()
+    assert not os.path.exists(directory_path / "live" / "old2.net")
+
+
+@patch("dnsrobocert.core.certbot.index.load", side_effect=_issued)
+@patch("dnsrobocert.core.certbot.revoke")
+def test_failing_lineage_backoff(
+    revoke: MagicMock, _load: MagicMock, tmp_path: Path
+) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    os.makedirs(directory_path / "live")
+    config_path = _write_config(tmp_path, 1)
+
+    def _certonly(
+        _config_path: str,
+        _directory_path: str,
+        lineage: str,
+        *_args: object,
+        **_kwargs: object,
+    ) -> None:
+        if lineage == "test1.example.net":
+            raise RuntimeError("Invalid credentials")
+
+    with patch("dnsrobocert.core.certbot.certonly", side_effect=_certonly) as certonly:
+        certbot._issue(str(config_path), str(directory_path), threading.Lock())
+        assert certonly.call_count == 3
+
+        # The failing lineage is backed off, the other ones are still processed.
+        certonly.reset_mock()
+        certbot._issue(str(config_path), str(directory_path), threading.Lock())
+        assert sorted(call[0][2] for call in certonly.call_args_list) == [
+            "test2.example.net",
+            "test3.example.net",
+        ]
+
+        # The backoff is lifted as soon as the settings of the lineage change.
+        certonly.reset_mock()
+        config_path.write_text(
+            config_path.read_text().replace(
+                "provider: dummy", "provider: dummy\n  provider_options: {}"
+            )
+        )
+        certbot._issue(str(config_path), str(directory_path), threading.Lock())
+        assert "test1.example.net" in [call[0][2] for call in certonly.call_args_list]
+
+    lineage_state = state.open_store(str(directory_path)).get("test1.example.net")
+    assert lineage_state
+    assert lineage_state.consecutive_failures == 2
+    assert lineage_state.last_error == "Invalid credentials"
+
+
+@patch("dnsrobocert.core.certbot.revoke")
+def test_failed_orders(revoke: MagicMock, tmp_path: Path) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    os.makedirs(directory_path / "live")
+    config_path = _write_config(tmp_path, 1)
+
+    def _certonly(
+        _config_path: str,
+        _directory_path: str,
+        lineage: str,
+        *_args: object,
+        **_kwargs: object,
+    ) -> None:
+        # The auth hook of test2 succeeds, then the ACME server rejects its challenges.
+        if lineage == "test2.example.net":
+            state.open_store(str(directory_path)).record_validation(lineage)
+            raise RuntimeError("Incorrect TXT record")
+        # The auth hook of test1 fails, the ACME server validates nothing.
+        raise RuntimeError("Invalid credentials")
+
+    with patch("dnsrobocert.core.certbot.certonly", side_effect=_certonly):
+        certbot._issue(str(config_path), str(directory_path), threading.Lock())
+
+    # Only the failed validation counts against the rate limits.
+    orders = state.open_store(str(directory_path)).orders(0)
+    assert [(order.lineage, order.succeeded) for order in orders] == [
+        ("test2.example.net", False)
+    ]
+
+
+@patch("dnsrobocert.core.certbot.revoke")
+def test_unrenewed_lineage(revoke: MagicMock, tmp_path: Path) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    os.makedirs(directory_path / "live")
+    config_path = _write_config(tmp_path, 1)
+    now = datetime.now(timezone.utc)
+    lineages_index = {
+        # Due according to renewal_fraction.
+        "test1.example.net": _issued("", "test1.example.net")._replace(
+            not_before=now - timedelta(days=70), not_after=now + timedelta(days=20)
+        ),
+        # Not due, but not checked by Certbot since its issuance 10 days ago.
+        "test2.example.net": _issued("", "test2.example.net")._replace(
+            not_before=now - timedelta(days=10), not_after=now + timedelta(days=80)
+        ),
+    }
+
+    # Certbot exits successfully, but the certificates are unchanged.
+    with (
+        patch("dnsrobocert.core.certbot.index.build", return_value=lineages_index),
+        patch(
+            "dnsrobocert.core.certbot.index.load",
+            side_effect=lambda _path, lineage: lineages_index.get(lineage),
+        ),
+        patch("dnsrobocert.core.certbot.certonly") as certonly,
+    ):
+        certbot._issue(
+            str(config_path),
+            str(directory_path),
+            threading.Lock(),
+            {"test1.example.net": {"issue"}, "test2.example.net": {"issue"}},
+        )
+        assert certonly.call_count == 2
+
+    store = state.open_store(str(directory_path))
+    # The due lineage is failing, so it is retried only after its backoff.
+    test1_state = store.get("test1.example.net")
+    assert test1_state and test1_state.consecutive_failures == 1
+    assert test1_state.next_attempt() > time.time()
+    # The periodic check is a success.
+    test2_state = store.get("test2.example.net")
+    assert test2_state and test2_state.consecutive_failures == 0
+    assert test2_state.last_success
+    # No order is recorded against the rate limits.
+    assert not store.orders(0)
+
+
+@patch("dnsrobocert.core.certbot.index.load", side_effect=_issued)
+@patch("dnsrobocert.core.certbot.revoke")
+def test_rate_limits(revoke: MagicMock, _load: MagicMock, tmp_path: Path) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    os.makedirs(directory_path / "live")
+    config_path = _write_config(tmp_path, 1)
+    config_path.write_text(
+        config_path.read_text().replace(
+            "acme:\n", "acme:\n  rate_limits:\n    orders_per_account: 2\n"
+        )
+    )
+    now = datetime.now(timezone.utc)
+    lineages_index = {
+        "test3.example.net": index.LineageInfo(
+            "test3.example.net",
+            now - timedelta(days=89),
+            now + timedelta(days=1),
+            frozenset(["test3.example.net"]),
+            "rsa",
+            None,
+        )
+    }
+
+    with (
+        patch("dnsrobocert.core.certbot.index.build", return_value=lineages_index),
+        patch("dnsrobocert.core.certbot.certonly") as certonly,
+    ):
+        certbot._issue(str(config_path), str(directory_path), threading.Lock())
+
+        # The certificate closest to its expiration goes first, the last one is held back.
+        assert [call[0][2] for call in certonly.call_args_list] == [
+            "test3.example.net",
+            "test1.example.net",
+        ]
+
+    orders = state.open_store(str(directory_path)).orders(0)
+    assert [(order.lineage, order.renewal) for order in orders] == [
+        ("test3.example.net", True),
+        ("test1.example.net", False),
+    ]
+
+
+@patch("dnsrobocert.core.certbot.index.load", side_effect=_issued)
+@patch("dnsrobocert.core.certbot.revoke")
+def test_overlapping_passes(
+    revoke: MagicMock, _load: MagicMock, tmp_path: Path
+) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    os.makedirs(directory_path / "live")
+    config_path = _write_config(tmp_path, 2)
+
+    active = []
+    max_active = []
+    active_lock = threading.Lock()
+
+    def _certonly(*_args: object, **_kwargs: object) -> None:
+        with active_lock:
+            active.append(1)
+            max_active.append(len(active))
+        time.sleep(0.05)
+        with active_lock:
+            active.pop()
+
+    with patch("dnsrobocert.core.certbot.certonly", side_effect=_certonly) as certonly:
+        # Passes started by the config watcher and by the scheduler at the same time.
+        passes = [
+            threading.Thread(
+                target=certbot._issue,
+                args=(str(config_path), str(directory_path), threading.Lock()),
+            )
+            for _ in range(2)
+        ]
+        for thread in passes:
+            thread.start()
+        for thread in passes:
+            thread.join()
+
+        assert certonly.call_count == 6
+
+    # The passes are serialized, so max_parallel_issuance is respected overall.
+    assert max(max_active) == 2
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+import dns.exception
+import dns.name
+import dns.resolver
+import pytest
+import tldextract
+
+from dnsrobocert.core import cache, challenge
+
+
+@patch("dnsrobocert.core.challenge.dns.resolver.resolve")
+def test_check_challenges_concurrently(resolve: MagicMock) -> None:
+    barrier = threading.Barrier(3, timeout=5)
+
+    def _resolve(name: str, _rdtype: str, lifetime: float | None = None) -> MagicMock:
+        assert lifetime and 0 < lifetime <= 5
+        # Would break with a timeout if the names were checked serially.
+        barrier.wait()
+        if name == "_acme-challenge.missing.example.com":
+            raise dns.resolver.NXDOMAIN()
+        rdata = MagicMock()
+        rdata.strings = [b"TOKEN"]
+        return MagicMock(__iter__=lambda _: iter([rdata]))
+
+    resolve.side_effect = _resolve
+
+    results = challenge.check_challenges(
+        {
+            "_acme-challenge.example.com": "TOKEN",
+            "_acme-challenge.www.example.com": None,
+            "_acme-challenge.missing.example.com": None,
+        },
+        timeout=5,
+    )
+
+    assert results == {
+        "_acme-challenge.example.com": True,
+        "_acme-challenge.www.example.com": True,
+        "_acme-challenge.missing.example.com": False,
+    }
+
+
+@patch("dnsrobocert.core.challenge._MAX_CONCURRENT_CHECKS", 2)
+@patch("dnsrobocert.core.challenge.dns.resolver.resolve")
+def test_check_challenges_deadline(resolve: MagicMock) -> None:
+    def _resolve(name: str, _rdtype: str, lifetime: float | None = None) -> MagicMock:
+        assert lifetime is not None
+        time.sleep(lifetime)
+        raise dns.exception.Timeout()
+
+    resolve.side_effect = _resolve
+
+    # The queued checks share the deadline of the round instead of getting a new
+    # timeout each.
+    start = time.monotonic()
+    results = challenge.check_challenges(
+        {f"_acme-challenge.test{i}.example.com": None for i in range(6)},
+        timeout=0.5,
+    )
+
+    assert time.monotonic() - start < 1
+    assert not any(results.values())
+    assert len(results) == 6
+
+
+@patch("dnsrobocert.core.challenge.dns.resolver.zone_for_name")
+@patch("dnsrobocert.core.challenge._ZoneClient")
+def test_txt_challenge_resolution_cache(
+    client: MagicMock,
+    zone_for_name: MagicMock,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv(cache.CACHE_ENV, str(tmp_path / "resolution-cache.json"))
+    zone_for_name.return_value = dns.name.from_text("example.com")
+    profile = {"name": "dummy", "provider": "dummy", "provider_options": {"a": "b"}}
+
+    challenge.txt_challenge({}, profile, "TOKEN", "www.example.com")
+    challenge.txt_challenge({}, profile, "TOKEN", "www.example.com")
+
+    assert zone_for_name.call_count == 1
+    resolver = client.call_args[0][0]
+    assert resolver.resolve("lexicon:domain") == "example.com"
+    assert resolver.resolve("lexicon:resolve_zone_name") is None
+
+    # A provider error invalidates the cached resolution.
+    client.return_value.__enter__.side_effect = RuntimeError("Provider error")
+    with pytest.raises(RuntimeError):
+        challenge.txt_challenge({}, profile, "TOKEN", "www.example.com")
+    client.return_value.__enter__.side_effect = None
+    challenge.txt_challenge({}, profile, "TOKEN", "www.example.com")
+
+    assert zone_for_name.call_count == 2
+
+    # The zone given to Lexicon is the delegated subdomain, or the static zone.
+    profile["delegated_subdomain"] = "sub.example.com"
+    challenge.txt_challenge({}, profile, "TOKEN", "www.sub.example.com")
+    resolver = client.call_args[0][0]
+    assert resolver.resolve("lexicon:domain") == "sub.example.com"
+
+    del profile["delegated_subdomain"]
+    profile["dynamic_zone_resolution"] = False
+    challenge.txt_challenge({}, profile, "TOKEN", "www.example.co.uk")
+    resolver = client.call_args[0][0]
+    assert resolver.resolve("lexicon:domain") == "example.co.uk"
+    assert zone_for_name.call_count == 3
+
+
+class _FakeProvider:
+    records: list[tuple[str, str, str]] = []
+
+    def __init__(self, config: object) -> None:
+        self.config = config
+
+    def authenticate(self) -> None:
+        pass
+
+    def cleanup(self) -> None:
+        pass
+
+    def create_record(self, rtype: str, name: str, content: str) -> bool:
+        self.records.append((rtype, name, content))
+        return True
+
+
+@patch("dns.resolver.canonical_name")
+@patch("dns.resolver.zone_for_name")
+@patch("lexicon.client.Client._validate_provider")
+@patch("lexicon.client._load_provider_module")
+def test_txt_challenge_offline_zone_resolution(
+    load_provider_module: MagicMock,
+    _validate_provider: MagicMock,
+    zone_for_name: MagicMock,
+    canonical_name: MagicMock,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv(cache.CACHE_ENV, str(tmp_path / "resolution-cache.json"))
+    load_provider_module.return_value = MagicMock(Provider=_FakeProvider)
+    zone_for_name.return_value = dns.name.from_text("example.co.uk")
+    canonical_name.return_value = dns.name.from_text(
+        "_acme-challenge.www.example.co.uk"
+    )
+    profile = {"name": "dummy", "provider": "dummy", "provider_options": {"a": "b"}}
+
+    extractors = []
+    init = tldextract.TLDExtract.__init__
+
+    def _init(self: tldextract.TLDExtract, *args: Any, **kwargs: Any) -> None:
+        extractors.append(kwargs)
+        init(self, *args, **kwargs)
+
+    with patch.object(tldextract.TLDExtract, "__init__", _init):
+        for certificate in [{}, {"follow_cnames": True}]:
+            challenge.txt_challenge(certificate, profile, "TOKEN", "www.example.co.uk")
+
+    assert _FakeProvider.records == [
+        ("TXT", "_acme-challenge.www.example.co.uk.", "TOKEN"),
+        ("TXT", "_acme-challenge.www.example.co.uk.", "TOKEN"),
+    ]
+    # The zone is resolved once for each name (plain, then canonical), Lexicon uses
+    # it as is.
+    assert zone_for_name.call_count == 2
+    # The Public Suffix List is never fetched from the network, nor cached on disk.
+    for kwargs in extractors:
+        assert kwargs.get("cache_dir") is None
+        assert all(url.startswith("file:") for url in kwargs["suffix_list_urls"])
@@ -1,5 +1,7 @@
+import copy
 import os
 from pathlib import Path
+from unittest.mock import patch
 
 import pytest
 
@@ -128,3 +130,69 @@ certificates:
         str(raised.value)
         == "Error while parsing config: environment variable DRAFT_VALUE does not exist."
     )
+
+
+def test_config_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("""\
+draft: true
+profiles:
+- name: one
+  provider: ${PROVIDER}
+""")
+    monkeypatch.setenv("PROVIDER", "one")
+
+    with patch("dnsrobocert.core.config._parse", wraps=config._parse) as parse:
+        parsed = config.load(str(config_path))
+        parsed["profiles"][0]["provider"] = "modified"
+        assert config.load(str(config_path))["profiles"][0]["provider"] == "one"
+        assert parse.call_count == 1
+
+        monkeypatch.setenv("PROVIDER", "two")
+        assert config.load(str(config_path))["profiles"][0]["provider"] == "two"
+        assert parse.call_count == 2
+
+        config_path.write_text("draft: true\n")
+        assert "profiles" not in config.load(str(config_path))
+        assert parse.call_count == 3
+
+
+def test_config_diff() -> None:
+    previous_config = {
+        "acme": {"email_account": "john.doe@example.net"},
+        "profiles": [
+            {"name": "one", "provider": "one"},
+            {"name": "two", "provider": "two"},
+        ],
+        "certificates": [
+            {"domains": ["test1.example.net"], "profile": "one"},
+            {"domains": ["test2.example.net"], "profile": "one", "deploy_hook": "a"},
+            {"domains": ["test3.example.net"], "profile": "two"},
+            {"domains": ["test4.example.net"], "profile": "two", "force_renew": True},
+        ],
+    }
+    new_config = copy.deepcopy(previous_config)
+    new_config["acme"]["email_account"] = "jane.doe@example.net"
+    new_config["profiles"][1]["provider_options"] = {"auth_token": "TOKEN"}
+    new_config["certificates"][1]["deploy_hook"] = "b"
+    new_config["certificates"].append(
+        {"domains": ["test5.example.net"], "profile": "one"}
+    )
+
+    assert config.diff(previous_config, new_config) == {
+        "test2.example.net": {"deploy_hook"},
+        "test3.example.net": {"issue"},
+        "test4.example.net": {"issue"},
+        "test5.example.net": {"issue"},
+    }
+    assert config.account_changed(previous_config, new_config)
+    assert not config.permissions_changed(previous_config, new_config)
+    assert config.diff(None, previous_config) == {
+        "test1.example.net": {"issue"},
+        "test2.example.net": {"issue"},
+        "test3.example.net": {"issue"},
+        "test4.example.net": {"issue"},
+    }
+
+    new_config["acme"]["staging"] = True
+    assert len(config.diff(previous_config, new_config)) == 5
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+import pytest
+
+from dnsrobocert.core import cron
+
+
+def test_crontab_next() -> None:
+    crontab = cron.Crontab("12 01,13 * * *")
+    start = datetime(2026, 3, 10, 2, 0, 30)
+    assert datetime.fromtimestamp(crontab.next(start.timestamp())) == datetime(
+        2026, 3, 10, 13, 12
+    )
+
+    # Window between 01:00 and 05:59 on week-ends.
+    crontab = cron.Crontab("* 1-5 * * 6,7")
+    assert datetime.fromtimestamp(crontab.next(start.timestamp())) == datetime(
+        2026, 3, 14, 1, 0
+    )
+    moment = datetime(2026, 3, 15, 3, 30)
+    assert crontab.match(moment)
+    assert crontab.next(moment.timestamp()) == moment.timestamp()
+
+    crontab = cron.Crontab("*/20 0 1 * *")
+    assert datetime.fromtimestamp(crontab.next(start.timestamp())) == datetime(
+        2026, 4, 1, 0, 0
+    )
+
+
+@pytest.mark.parametrize("pattern", ["* * * *", "60 * * * *", "* * 0 * *", "a * * * *"])
+def test_crontab_invalid(pattern: str) -> None:
+    with pytest.raises(ValueError):
+        cron.Crontab(pattern)
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import io
+import json
+import socketserver
+import struct
+import sys
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+
+from dnsrobocert.core import engine
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="Requires Unix sockets."
+)
+
+
+class _FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str) -> None:
+        super().__init__(socket_path, _FakeEngineHandler)
+        self.socket_path = socket_path
+        self.requests: list[tuple[str, str, Any]] = []
+        self.connections = 0
+        self.service_version = 7
+        self.exit_code = 0
+        # Number of inspections reporting the exec as still running.
+        self.exec_running = 0
+
+
+class _FakeEngineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _FakeEngine
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def _handle(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.requests.append((method, self.path, body))
+
+        if self.path.startswith("/containers/missing/"):
+            self._send(404, {"message": "No such container: missing"})
+        elif self.path.startswith("/containers/") and self.path.endswith(
+            "/restart?t=10"
+        ):
+            self._send(204)
+        elif self.path == "/services/proxy":
+            self._send(
+                200,
+                {
+                    "ID": "service-id",
+                    "Version": {"Index": self.server.service_version},
+                    "Spec": {"Name": "proxy", "TaskTemplate": {"ForceUpdate": 2}},
+                },
+            )
+        elif self.path.startswith("/services/service-id/update"):
+            self._send(200, {"Warnings": []})
+        elif self.path == "/services/service-id":
+            self._send(
+                200, {"ID": "service-id", "UpdateStatus": {"State": "completed"}}
+            )
+        elif self.path.endswith("/exec") and method == "POST":
+            self._send(201, {"Id": "exec-id"})
+        elif self.path == "/exec/exec-id/start":
+            # Raw multiplexed stream, until the connection is closed.
+            self.send_response(200)
+            self.send_header(
+                "Content-Type", "application/vnd.docker.multiplexed-stream"
+            )
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for stream, data in [(1, "Hello "), (2, "warning\n"), (1, "World!\n")]:
+                payload = data.encode("utf-8")
+                self.wfile.write(struct.pack(">BxxxL", stream, len(payload)) + payload)
+            self.wfile.flush()
+            self.close_connection = True
+        elif self.path == "/exec/exec-id/json":
+            if self.server.exec_running:
+                self.server.exec_running -= 1
+                self._send(200, {"Running": True, "ExitCode": None})
+            else:
+                self._send(200, {"Running": False, "ExitCode": self.server.exit_code})
+        else:
+            self._send(404, {"message": "page not found"})
+
+    def _send(self, status: int, payload: Any = None) -> None:
+        data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def fake_engine(tmp_path: Path) -> Iterator[_FakeEngine]:
+    server = _FakeEngine(str(tmp_path / "engine.sock"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_restart_container(fake_engine: _FakeEngine) -> None:
+    client = engine.EngineClient(fake_engine.socket_path, timeout=5)
+    try:
+        client.restart_container("container1")
+        client.restart_container("container2")
+    finally:
+        client.close()
+
+    assert [request[1] for request in fake_engine.requests] == [
+        "/containers/container1/restart?t=10",
+        "/containers/container2/restart?t=10",
+    ]
+    # The connection is reused between calls.
+    assert fake_engine.connections == 1
+
+    client = engine.EngineClient(fake_engine.socket_path, timeout=5)
+    with pytest.raises(RuntimeError, match="No such container: missing"):
+        client.restart_container("missing")
+    client.close()
+
+
+def test_update_service(fake_engine: _FakeEngine) -> None:
+    client = engine.EngineClient(fake_engine.socket_path, timeout=5)
+    try:
+        client.update_service("proxy")
+    finally:
+        client.close()
+
+    update = fake_engine.requests[1]
+    assert update[0] == "POST"
+    assert update[1] == "/services/service-id/update?version=7"
+    assert update[2]["TaskTemplate"]["ForceUpdate"] == 3
+
+
+def test_exec(fake_engine: _FakeEngine) -> None:
+    client = engine.EngineClient(fake_engine.socket_path, timeout=5)
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    try:
+        client.exec("nginx", ["nginx", "-s", "reload"], stdout=stdout, stderr=stderr)
+
+        assert fake_engine.requests[0][2]["Cmd"] == ["nginx", "-s", "reload"]
+        assert stdout.getvalue() == "Hello World!\n"
+        assert stderr.getvalue() == "warning\n"
+
+        # The exit code is read once the command is not running anymore.
+        fake_engine.exec_running = 15
+        with patch.object(engine, "_EXEC_POLL_INTERVAL", 0.01):
+            client.exec("nginx", ["sleep", "2"], stdout=stdout, stderr=stderr)
+        assert fake_engine.exec_running == 0
+
+        fake_engine.exit_code = 1
+        with pytest.raises(RuntimeError, match="failed with exit code 1"):
+            client.exec("nginx", ["false"], stdout=stdout, stderr=stderr)
+    finally:
+        client.close()
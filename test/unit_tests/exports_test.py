@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+
+from dnsrobocert.core import exports
+
+LINEAGE = "example.com"
+
+
+def _issue(directory_path: Path, version: int) -> x509.Certificate:
+    # Same layout as Certbot: versioned files in the archive directory, and relative
+    # symbolic links to the current version in the live directory.
+    archive_path = directory_path / "archive" / LINEAGE
+    live_path = directory_path / "live" / LINEAGE
+    os.makedirs(archive_path, exist_ok=True)
+    os.makedirs(live_path, exist_ok=True)
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, LINEAGE)])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.now(timezone.utc))
+        .not_valid_after(datetime.now(timezone.utc) + timedelta(days=10))
+        .sign(key, hashes.SHA256())
+    )
+    files = {
+        "privkey": key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ),
+        "cert": cert.public_bytes(serialization.Encoding.PEM),
+        "chain": cert.public_bytes(serialization.Encoding.PEM),
+    }
+    for file_name, data in files.items():
+        (archive_path / f"{file_name}{version}.pem").write_bytes(data)
+        link_path = live_path / f"{file_name}.pem"
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        os.symlink(
+            os.path.join("..", "..", "archive", LINEAGE, f"{file_name}{version}.pem"),
+            link_path,
+        )
+
+    return cert
+
+
+def test_export(tmp_path: Path) -> None:
+    certificate = {
+        "domains": [LINEAGE],
+        "pfx": {"export": True, "passphrase": "secret"},
+        "exports": ["pem", "der", "jks"],
+    }
+    live_path = tmp_path / "live" / LINEAGE
+    archive_path = tmp_path / "archive" / LINEAGE
+    cert = _issue(tmp_path, 1)
+
+    exports.export(certificate, str(live_path), LINEAGE)
+
+    assert os.readlink(live_path / "cert.pfx") == os.path.join(
+        "..", "..", "archive", LINEAGE, "cert1.pfx"
+    )
+    pfx = pkcs12.load_pkcs12((live_path / "cert.pfx").read_bytes(), b"secret")
+    assert pfx.cert and pfx.cert.certificate == cert
+    assert pfx.cert.friendly_name == LINEAGE.encode("utf-8")
+    jks = pkcs12.load_pkcs12((live_path / "keystore.jks").read_bytes(), b"secret")
+    assert jks.key and jks.cert and jks.cert.certificate == cert
+    assert x509.load_der_x509_certificate((live_path / "cert.der").read_bytes()) == cert
+    combined = (live_path / "combined.pem").read_bytes()
+    assert x509.load_pem_x509_certificates(combined) == [cert, cert]
+    assert serialization.load_pem_private_key(combined, None)
+
+    manifest = json.loads((archive_path / exports.MANIFEST).read_text())
+    assert manifest["der"] == {
+        "serial": format(cert.serial_number, "x"),
+        "options": manifest["pem"]["options"],
+        "file": "cert1.der",
+    }
+
+    # Exports are not generated again while the certificate and the options are unchanged.
+    stats = {path: os.stat(path) for path in archive_path.iterdir()}
+    exports.export(certificate, str(live_path), LINEAGE)
+    assert {path: os.stat(path) for path in archive_path.iterdir()} == stats
+
+    certificate["pfx"] = {"export": True}
+    exports.export(certificate, str(live_path), LINEAGE)
+    assert pkcs12.load_pkcs12((live_path / "cert.pfx").read_bytes(), None)
+    assert os.stat(archive_path / "cert1.der") == stats[archive_path / "cert1.der"]
+
+    # The live links are replaced when a new certificate is issued.
+    cert = _issue(tmp_path, 2)
+    exports.export(certificate, str(live_path), LINEAGE)
+    assert os.readlink(live_path / "cert.pfx") == os.path.join(
+        "..", "..", "archive", LINEAGE, "cert2.pfx"
+    )
+    assert x509.load_der_x509_certificate((live_path / "cert.der").read_bytes()) == cert
+    assert not [path for path in os.listdir(live_path) if path.endswith(".tmp")]
+    assert not [path for path in os.listdir(archive_path) if path.startswith(".")]
@@ -2,11 +2,17 @@ from __future__ import annotations
 
 import contextlib
 import os
+import socket
+import subprocess
+import sys
+import threading
+import time
 from collections.abc import Iterator
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, call, patch
 
+import dns.name
 import pytest
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
@@ -14,7 +20,7 @@ from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.x509.oid import NameOID
 
-from dnsrobocert.core import config, hooks
+from dnsrobocert.core import config, engine, hooks, hookserver, state
 
 try:
     POSIX_MODE = True
@@ -46,6 +52,18 @@ def fake_env(
     }
 
 
+@pytest.fixture(autouse=True)
+def fake_zones() -> Iterator[MagicMock]:
+    # The DNS zone of a name is its registered domain.
+    with patch(
+        "dnsrobocert.core.challenge.dns.resolver.zone_for_name"
+    ) as zone_for_name:
+        zone_for_name.side_effect = lambda name: dns.name.from_text(
+            ".".join(name.rstrip(".").split(".")[-2:])
+        )
+        yield zone_for_name
+
+
 @pytest.fixture
 def fake_config(tmp_path: Path) -> Iterator[Path]:
     config_path = tmp_path / "config.yml"
@@ -83,17 +101,27 @@ certificates:
     yield config_path
 
 
-@patch("dnsrobocert.core.challenge.Client")
-def test_auth_cli(client: MagicMock, fake_config: Path) -> None:
+@patch("dnsrobocert.core.challenge._ZoneClient")
+def test_auth_cli(
+    client: MagicMock,
+    fake_config: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
     operations = MagicMock()
     client.return_value.__enter__.return_value = operations
+    store = state.open_store(str(tmp_path))
+    monkeypatch.setenv(state.STATE_ENV, store.path)
+    started = time.time()
 
-    hooks.main(["-t", "auth", "-c", str(fake_config), "-l", LINEAGE])
+    assert hooks.main(["-t", "auth", "-c", str(fake_config), "-l", LINEAGE]) == 0
+    # The challenges are submitted to the ACME server once the hook succeeds.
+    assert store.validated_since(LINEAGE, started)
 
     assert len(client.call_args[0]) == 1
     resolver = client.call_args[0][0]
 
-    assert resolver.resolve("lexicon:domain") == LINEAGE
+    assert resolver.resolve("lexicon:domain") == "example.com"
     assert resolver.resolve("lexicon:provider_name") == "dummy"
     assert resolver.resolve("lexicon:ttl") == 42
     assert resolver.resolve("lexicon:dummy:auth_token") == "TOKEN"
@@ -103,7 +131,27 @@ def test_auth_cli(client: MagicMock, fake_config: Path) -> None:
     )
 
 
-@patch("dnsrobocert.core.challenge.Client")
+@patch("dnsrobocert.core.challenge._ZoneClient")
+def test_failed_hook_phase(
+    client: MagicMock,
+    fake_config: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    client.return_value.__enter__.side_effect = RuntimeError("Invalid credentials")
+    store = state.open_store(str(tmp_path))
+    store.start_attempt(LINEAGE)
+    monkeypatch.setenv(state.STATE_ENV, store.path)
+
+    assert hooks.main(["-t", "auth", "-c", str(fake_config), "-l", LINEAGE]) == 1
+
+    lineage_state = store.get(LINEAGE)
+    assert lineage_state
+    assert lineage_state.last_error_phase == "auth"
+    assert not store.validated_since(LINEAGE, 0)
+
+
+@patch("dnsrobocert.core.challenge._ZoneClient")
 def test_cleanup_cli(client: MagicMock, fake_config: Path) -> None:
     operations = MagicMock()
     client.return_value.__enter__.return_value = operations
@@ -113,7 +161,7 @@ def test_cleanup_cli(client: MagicMock, fake_config: Path) -> None:
     assert len(client.call_args[0]) == 1
     resolver = client.call_args[0][0]
 
-    assert resolver.resolve("lexicon:domain") == LINEAGE
+    assert resolver.resolve("lexicon:domain") == "example.com"
     assert resolver.resolve("lexicon:provider_name") == "dummy"
     assert resolver.resolve("lexicon:dummy:auth_token") == "TOKEN"
 
@@ -182,61 +230,102 @@ def test_pfx(
 
 
 @patch("dnsrobocert.core.hooks._fix_permissions")
-@patch("dnsrobocert.core.hooks._pfx_export")
+@patch("dnsrobocert.core.exports.export")
 @patch("dnsrobocert.core.hooks._autorestart")
 @patch("dnsrobocert.core.hooks.os.path.exists")
-@patch("dnsrobocert.core.hooks.utils.execute")
+@patch("dnsrobocert.core.hooks.engine.client")
 def test_autocmd(
-    execute: MagicMock,
+    client: MagicMock,
     _exists: MagicMock,
     _autorestart: MagicMock,
-    _pfx_export: MagicMock,
+    export: MagicMock,
     _fix_permissions: MagicMock,
     fake_config: Path,
 ) -> None:
     hooks.deploy(config.load(fake_config), LINEAGE)
 
-    call_foo = call(["docker", "exec", "foo", "echo", "Hello World!"])
-    call_bar = call(["docker", "exec", "bar", "echo", "Hello World!"])
-    call_dummy = call("docker exec dummy echo test", shell=True)
-    execute.assert_has_calls([call_foo, call_bar, call_dummy])
+    client.assert_called_with(engine.DOCKER_SOCKET)
+    call_foo = call("foo", ["echo", "Hello World!"])
+    call_bar = call("bar", ["echo", "Hello World!"])
+    call_dummy = call("dummy", ["sh", "-c", "echo test"])
+    client.return_value.exec.assert_has_calls([call_foo, call_bar, call_dummy])
 
 
 @patch("dnsrobocert.core.hooks._fix_permissions")
-@patch("dnsrobocert.core.hooks._pfx_export")
+@patch("dnsrobocert.core.exports.export")
 @patch("dnsrobocert.core.hooks._autocmd")
 @patch("dnsrobocert.core.hooks.os.path.exists")
-@patch("dnsrobocert.core.hooks.utils.execute")
+@patch("dnsrobocert.core.hooks.engine.client")
 def test_autorestart(
-    execute: MagicMock,
+    client: MagicMock,
     _exists: MagicMock,
     _autocmd: MagicMock,
-    _pfx_export: MagicMock,
+    export: MagicMock,
     _fix_permissions: MagicMock,
     fake_config: Path,
 ) -> None:
     hooks.deploy(config.load(fake_config), LINEAGE)
 
-    call_container1 = call(["docker", "restart", "container1"])
-    call_container2 = call(["docker", "restart", "container2"])
-    call_service1 = call(
-        ["docker", "service", "update", "--detach=false", "--force", "service1"]
-    )
-    call_service2 = call(
-        ["docker", "service", "update", "--detach=false", "--force", "service2"]
-    )
-    execute.assert_has_calls(
-        [call_container1, call_container2, call_service1, call_service2]
-    )
+    client.assert_any_call(engine.DOCKER_SOCKET)
+    assert client.return_value.method_calls == [
+        call.restart_container("container1"),
+        call.restart_container("container2"),
+        call.update_service("service1"),
+        call.update_service("service2"),
+    ]
+
+
+@patch("dnsrobocert.core.hooks._fix_permissions")
+@patch("dnsrobocert.core.exports.export")
+@patch("dnsrobocert.core.hooks.engine.client")
+def test_coalesced_deploy_actions(
+    client: MagicMock,
+    export: MagicMock,
+    _fix_permissions: MagicMock,
+    fake_config: Path,
+    fake_env: dict[str, Path],
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    queue_path = tmp_path / "dnsrobocert" / "deploy-queue.jsonl"
+    monkeypatch.setenv(hooks.DEPLOY_QUEUE_ENV, str(queue_path))
+    exists = os.path.exists
+
+    with patch(
+        "dnsrobocert.core.hooks.os.path.exists",
+        side_effect=lambda path: path == "/var/run/docker.sock" or exists(path),
+    ):
+        # Actions are collected for each deployed certificate, but not executed.
+        hooks.deploy(config.load(fake_config), LINEAGE)
+        hooks.deploy(config.load(fake_config), LINEAGE)
+        client.assert_not_called()
+
+        hooks.flush_deploy_actions(str(queue_path))
 
+    # Each distinct action is executed once.
+    assert client.return_value.method_calls == [
+        call.restart_container("container1"),
+        call.restart_container("container2"),
+        call.update_service("service1"),
+        call.update_service("service2"),
+        call.exec("foo", ["echo", "Hello World!"]),
+        call.exec("bar", ["echo", "Hello World!"]),
+        call.exec("dummy", ["sh", "-c", "echo test"]),
+    ]
 
-@patch("dnsrobocert.core.hooks._pfx_export")
+    # The queue is empty after a flush.
+    client.reset_mock()
+    hooks.flush_deploy_actions(str(queue_path))
+    client.assert_not_called()
+
+
+@patch("dnsrobocert.core.exports.export")
 @patch("dnsrobocert.core.hooks._autocmd")
 @patch("dnsrobocert.core.hooks._autorestart")
 def test_fix_permissions(
     _autorestart: MagicMock,
     _autocmd: MagicMock,
-    _pfx_export: MagicMock,
+    export: MagicMock,
     fake_config: dict[str, str],
     fake_env: dict[str, Path],
 ) -> None:
@@ -248,12 +337,20 @@ def test_fix_permissions(
 
     probe_live_file = live_path / "dummy.txt"
     probe_live_dir = live_path / "dummy_dir"
+    readme_live_file = live_path / "README"
+
+    # A previous certificate, not targeted by the live symbolic links.
+    previous_file = archive_path / "previous.txt"
 
     open(probe_file, "w").close()
+    open(previous_file, "w").close()
+    os.chmod(previous_file, 0o600)
     os.mkdir(probe_dir)
 
     os.symlink(probe_file, probe_live_file)
     os.symlink(probe_dir, probe_live_dir)
+    open(readme_live_file, "w").close()
+    os.chmod(readme_live_file, 0o600)
 
     with _mock_os_chown() as chown:
         hooks.deploy(config.load(fake_config), LINEAGE)
@@ -261,6 +358,8 @@ def test_fix_permissions(
         assert os.stat(probe_file).st_mode & 0o777 == 0o666
         assert os.stat(probe_dir).st_mode & 0o777 == 0o777
         assert os.stat(archive_path).st_mode & 0o777 == 0o777
+        assert os.stat(previous_file).st_mode & 0o777 == 0o600
+        assert os.stat(readme_live_file).st_mode & 0o777 == 0o666
 
         if POSIX_MODE:
             uid = pwd.getpwnam("nobody")[2]
@@ -271,9 +370,8 @@ def test_fix_permissions(
 
             calls = [
                 call(str(archive_path), uid, gid),
-                call(str(probe_file), uid, gid),
-                call(str(probe_dir), uid, gid),
                 call(str(live_path), uid, gid),
+                call(str(readme_live_file), uid, gid),
                 call(str(probe_live_file), uid, gid),
                 call(str(probe_live_dir), uid, gid),
             ]
@@ -289,3 +387,222 @@ def _mock_os_chown() -> Iterator[MagicMock | AsyncMock | None]:
             yield chown
     else:
         yield None
+
+
+@pytest.mark.parametrize("strategy", ["backoff", "deadline"])
+@patch("dnsrobocert.core.hooks.time.sleep")
+@patch("dnsrobocert.core.challenge.check_one_challenge")
+@patch("dnsrobocert.core.challenge.txt_challenge")
+def test_auth_adaptive_propagation(
+    _txt_challenge: MagicMock,
+    check_one_challenge: MagicMock,
+    sleep: MagicMock,
+    strategy: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("CERTBOT_ALL_DOMAINS", f"{LINEAGE},www.{LINEAGE}")
+    dnsrobocert_config = {
+        "profiles": [
+            {
+                "name": "dummy",
+                "provider": "dummy",
+                "sleep_time": 30,
+                "propagation_strategy": strategy,
+            }
+        ],
+        "certificates": [{"domains": [LINEAGE], "profile": "dummy"}],
+    }
+    # First name propagates on the second round, the other one on the fourth round.
+    propagation_rounds = {
+        f"_acme-challenge.{LINEAGE}": 2,
+        f"_acme-challenge.www.{LINEAGE}": 4,
+    }
+
+    def _check_one_challenge(
+        challenge: str, token: str | None = None, _timeout: float | None = None
+    ) -> bool:
+        return sleep.call_count >= propagation_rounds[challenge]
+
+    check_one_challenge.side_effect = _check_one_challenge
+
+    hooks.auth(dnsrobocert_config, LINEAGE)
+
+    delays = [call_args[0][0] for call_args in sleep.call_args_list]
+    assert len(delays) == 4
+    assert 1 <= delays[0] <= 2
+    assert delays == sorted(delays)
+    assert check_one_challenge.call_count == 6
+    # Each query lasts at most until the deadline of its round, 10 seconds away.
+    checked = {
+        (call_args[0][0], call_args[0][1])
+        for call_args in check_one_challenge.call_args_list
+        if 0 < call_args[0][2] <= 10
+    }
+    assert checked == {
+        (f"_acme-challenge.{LINEAGE}", "VALIDATION"),
+        (f"_acme-challenge.www.{LINEAGE}", None),
+    }
+
+
+@patch("dnsrobocert.core.hooks.time.sleep")
+@patch("dnsrobocert.core.challenge.check_challenges")
+@patch("dnsrobocert.core.challenge.txt_challenge")
+def test_auth_propagation_failure(
+    _txt_challenge: MagicMock,
+    check_challenges: MagicMock,
+    sleep: MagicMock,
+) -> None:
+    dnsrobocert_config = {
+        "profiles": [
+            {
+                "name": "dummy",
+                "provider": "dummy",
+                "max_checks": 3,
+                "propagation_strategy": "backoff",
+            }
+        ],
+        "certificates": [{"domains": [LINEAGE], "profile": "dummy"}],
+    }
+    check_challenges.side_effect = lambda challenges, _timeout: {
+        challenge: False for challenge in challenges
+    }
+
+    with pytest.raises(RuntimeError):
+        hooks.auth(dnsrobocert_config, LINEAGE)
+
+    assert sleep.call_count == 3
+
+
+@patch("dnsrobocert.core.hooks.time.sleep")
+@patch("dnsrobocert.core.challenge._ZoneClient")
+def test_batched_challenges(
+    client: MagicMock,
+    _sleep: MagicMock,
+    fake_config: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    domains = [LINEAGE, f"www.{LINEAGE}", "test.example.net"]
+    sessions: dict[str, MagicMock] = {}
+
+    def _client(resolver: MagicMock) -> MagicMock:
+        zone = resolver.resolve("lexicon:domain")
+        instance = MagicMock()
+        instance.__enter__.return_value = sessions.setdefault(zone, MagicMock())
+        return instance
+
+    client.side_effect = _client
+    monkeypatch.setenv(hooks.WORKSPACE_ENV, str(tmp_path / "workspace"))
+    monkeypatch.setenv("CERTBOT_ALL_DOMAINS", ",".join(domains))
+    dnsrobocert_config = config.load(str(fake_config))
+
+    for hook in (hooks.auth, hooks.cleanup):
+        for index, domain in enumerate(domains):
+            monkeypatch.setenv("CERTBOT_DOMAIN", domain)
+            monkeypatch.setenv("CERTBOT_VALIDATION", f"TOKEN-{index}")
+            monkeypatch.setenv("CERTBOT_REMAINING_CHALLENGES", str(2 - index))
+            hook(dnsrobocert_config, LINEAGE)
+
+            if hook == hooks.auth and index < 2:
+                assert not sessions
+
+    assert sorted(sessions) == ["example.com", "example.net"]
+    assert sessions["example.com"].create_record.call_args_list == [
+        call(rtype="TXT", name=f"_acme-challenge.{LINEAGE}.", content="TOKEN-0"),
+        call(rtype="TXT", name=f"_acme-challenge.www.{LINEAGE}.", content="TOKEN-1"),
+    ]
+    assert sessions["example.net"].create_record.call_args_list == [
+        call(rtype="TXT", name="_acme-challenge.test.example.net.", content="TOKEN-2"),
+    ]
+    # One Lexicon client per DNS zone, for the auth and the cleanup hooks.
+    assert client.call_count == 4
+    assert sessions["example.com"].delete_record.call_count == 2
+    assert sessions["example.net"].delete_record.call_count == 1
+    assert not os.listdir(tmp_path / "workspace")
+
+
+@pytest.mark.skipif(
+    not hookserver.supported(), reason="Hooks server requires Unix sockets and fork."
+)
+def test_forwarded_hook_startup(tmp_path: Path) -> None:
+    # Certbot starts a new process for each hook: when the hooks server is running,
+    # this process only forwards the hook, and must not pay for the heavy imports.
+    socket_path = str(tmp_path / "hooks.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+
+    def serve() -> None:
+        connection, _ = server.accept()
+        with connection, connection.makefile("rwb") as stream:
+            stream.readline()
+            stream.write(b'{"exit": 0}\n')
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-m",
+                "dnsrobocert.core.hooks",
+                "-t",
+                "auth",
+                "-c",
+                str(tmp_path / "config.yml"),
+            ],
+            env={**os.environ, hookserver.SOCKET_ENV: socket_path},
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    finally:
+        thread.join(5)
+        server.close()
+
+    assert result.returncode == 0, result.stderr
+
+    # Modules imported after the interpreter startup.
+    imported: set[str] = set()
+    started = False
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        name = line.split("|")[-1].strip()
+        if not started:
+            started = name == "runpy"
+            continue
+        imported.add(name)
+
+    heavy = [
+        name
+        for name in imported
+        if name.split(".")[0]
+        in ("certbot", "cryptography", "dns", "jsonschema", "lexicon", "tldextract")
+    ]
+    assert not heavy
+
+    # The whole import time is compared with the one of an empty interpreter measured
+    # on the same machine, to tolerate its load: the heavy imports cost about ten
+    # times more, the forwarding path alone about three times.
+    baseline = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "pass"],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert _import_time(result.stderr) < 6 * _import_time(baseline.stderr)
+
+
+def _import_time(stderr: str) -> int:
+    # Sum of the cumulative times of the top level imports, in microseconds.
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+            total += int(cumulative)
+    return total
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from dnsrobocert.core import hooks, hookserver
+
+pytestmark = pytest.mark.skipif(
+    not hookserver.supported(), reason="Hooks server requires Unix sockets and fork."
+)
+
+LINEAGE = "test.example.com"
+
+
+def test_hook_forwarded_to_server(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capfd: pytest.CaptureFixture[str],
+) -> None:
+    live_path = tmp_path / "live" / LINEAGE
+    os.makedirs(live_path)
+    os.makedirs(tmp_path / "archive" / LINEAGE)
+    monkeypatch.setenv("RENEWED_LINEAGE", str(live_path))
+    monkeypatch.setenv("FORWARDED_VARIABLE", "forwarded")
+
+    config_path = tmp_path / "config.yml"
+    config_path.write_text(f"""\
+profiles:
+- name: dummy
+  provider: dummy
+certificates:
+- domains: [{LINEAGE}]
+  profile: dummy
+  deploy_hook: echo "deployed $DNSROBOCERT_CERTIFICATE_DOMAINS $FORWARDED_VARIABLE"
+""")
+
+    workspace = tmp_path / "workspace"
+    os.mkdir(workspace)
+    with hookserver.serve(str(workspace), str(config_path)):
+        socket_path = os.environ[hookserver.SOCKET_ENV]
+        assert os.path.exists(socket_path)
+        monkeypatch.setenv(hookserver.SOCKET_ENV, socket_path)
+
+        assert hooks.main(["-t", "deploy", "-c", str(config_path)]) == 0
+        assert hooks.main(["-t", "deploy", "-c", str(tmp_path / "missing.yml")]) == 1
+
+    assert hookserver.SOCKET_ENV not in os.environ
+    assert f"deployed {LINEAGE} forwarded" in capfd.readouterr().out
+
+
+def test_hook_server_unreachable(tmp_path: Path) -> None:
+    assert hookserver.forward(str(tmp_path / "missing.sock"), ["-t", "auth"]) is None
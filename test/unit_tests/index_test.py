@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from dnsrobocert.core import index
+
+LINEAGE = "test.example.com"
+ACME_URL = "https://acme-v02.api.letsencrypt.org/directory"
+
+
+def _create_lineage(
+    directory_path: Path, domains: list[str], not_before: datetime, days: int = 90
+) -> None:
+    live_path = directory_path / "live" / LINEAGE
+    os.makedirs(live_path)
+    os.makedirs(directory_path / "renewal", exist_ok=True)
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domains[0])])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(not_before)
+        .not_valid_after(not_before + timedelta(days=days))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(domain) for domain in domains]),
+            critical=False,
+        )
+        .sign(key, hashes.SHA256())
+    )
+    (live_path / "cert.pem").write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    (directory_path / "renewal" / f"{LINEAGE}.conf").write_text(f"""\
+version = 5.8.0
+archive_dir = {directory_path}/archive/{LINEAGE}
+
+[renewalparams]
+server = {ACME_URL}
+""")
+
+
+def test_build_index(tmp_path: Path) -> None:
+    not_before = datetime.now(timezone.utc) - timedelta(days=10)
+    _create_lineage(tmp_path, [LINEAGE, f"*.{LINEAGE}"], not_before)
+    (tmp_path / "live" / "README").write_text("README")
+
+    lineages = index.build(str(tmp_path))
+
+    assert list(lineages) == [LINEAGE]
+    info = lineages[LINEAGE]
+    assert info.domains == frozenset([LINEAGE, f"*.{LINEAGE}"])
+    assert info.key_type == "ecdsa"
+    assert info.server == ACME_URL
+    assert index.renewal_due(info) == info.not_after - timedelta(days=30)
+
+    # Certbot checks again the lineage a day after its issuance or its last check.
+    not_before = info.not_before.timestamp()
+    assert index.check_due(info, None) == not_before + index.CERTBOT_CHECK_INTERVAL
+    assert (
+        index.check_due(info, not_before + 3600)
+        == not_before + 3600 + index.CERTBOT_CHECK_INTERVAL
+    )
+
+
+def test_issuance_reason(tmp_path: Path) -> None:
+    now = datetime.now(timezone.utc)
+    _create_lineage(tmp_path, [LINEAGE], now - timedelta(days=10))
+    info = index.load(str(tmp_path), LINEAGE)
+    certificate = {"domains": [LINEAGE], "key_type": "ecdsa"}
+
+    assert not index.issuance_reason(info, certificate, ACME_URL)
+    assert index.issuance_reason(None, certificate, ACME_URL)
+    assert index.issuance_reason(info, {**certificate, "force_renew": True}, ACME_URL)
+    assert index.issuance_reason(
+        info, {**certificate, "domains": [LINEAGE, f"www.{LINEAGE}"]}, ACME_URL
+    )
+    assert index.issuance_reason(info, {"domains": [LINEAGE]}, ACME_URL)
+    assert index.issuance_reason(info, certificate, "https://example.net/dir")
+    assert index.issuance_reason(
+        info, certificate, ACME_URL, now=now + timedelta(days=61)
+    )
@@ -2,9 +2,12 @@ import os
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
-from dnsrobocert.core import main
+import pytest
 
+from dnsrobocert.core import main, state
 
+
+@patch("dnsrobocert.core.main.metrics.configure")
 @patch("dnsrobocert.core.main.certbot.account")
 @patch("dnsrobocert.core.main.certbot.certonly")
 @patch("dnsrobocert.core.main.certbot.revoke")
@@ -16,6 +19,7 @@ def test_main_loop(
     revoke: MagicMock,
     certonly: MagicMock,
     account: MagicMock,
+    configure: MagicMock,
     tmp_path: Path,
 ) -> None:
     directory_path = tmp_path / "letsencrypt"
@@ -39,7 +43,12 @@ certificates:
   profile: dummy
 """)
 
-    shutdown.side_effect = [False, True]
+    # Metrics are configured before the account is registered.
+    configured_after_account = []
+    configure.side_effect = lambda _config: configured_after_account.append(
+        account.called
+    )
+    shutdown.side_effect = [False, False, True]
     main.main(["-c", str(config_path), "-d", str(directory_path)])
 
     assert shutdown.called
@@ -47,3 +56,63 @@ certificates:
     assert certonly.called
     assert not revoke.called
     assert background.worker.called
+    # The configuration did not change between the loops.
+    assert configured_after_account == [False]
+
+
+def test_status(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    directory_path = tmp_path / "letsencrypt"
+    main.main(["--status", "-d", str(directory_path)])
+    assert "No certificate has been processed yet" in capsys.readouterr().out
+
+    store = state.open_store(str(directory_path))
+    store.start_attempt("test1.example.net")
+    store.record_success("test1.example.net", 12.3)
+    store.start_attempt("test2.example.net")
+    store.record_phase("test2.example.net", "auth")
+    store.record_failure("test2.example.net", "Auth hook failed.", 45)
+
+    main.main(["--status", "-d", str(directory_path)])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == [
+        "LINEAGE",
+        "LAST",
+        "ATTEMPT",
+        "LAST",
+        "SUCCESS",
+        "FAILURES",
+        "LAST",
+        "ERROR",
+        "PHASE",
+        "DURATION",
+        "NEXT",
+        "ATTEMPT",
+    ]
+    assert lines[1].startswith("test1.example.net")
+    assert "12.3s" in lines[1]
+    assert lines[2].startswith("test2.example.net")
+    assert " auth " in lines[2]
+    assert lines[4:6] == ["Last error of test2.example.net:", "Auth hook failed."]
+    assert lines[6:] == []
+
+    store.record_order(
+        "https://acme.example.com",
+        "test1",
+        ["test1.example.net"],
+        ["example.net"],
+        False,
+        True,
+    )
+    store.record_order(
+        "https://acme.example.com",
+        "test2",
+        ["test2.example.net"],
+        ["example.net"],
+        False,
+        False,
+    )
+    main.main(["--status", "-d", str(directory_path)])
+    assert capsys.readouterr().out.splitlines()[-1] == (
+        "ACME orders of https://acme.example.com: 2 in the last 3 hours, "
+        "1 failed in the last hour, 1 certificates issued in the last 7 days."
+    )
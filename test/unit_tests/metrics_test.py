@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from dnsrobocert.core import metrics
+
+
+@pytest.fixture(autouse=True)
+def registry() -> None:
+    # Other tests record measures in the registry of the tests process.
+    for metric in metrics._REGISTRY.values():
+        metric._values.clear()  # type: ignore[attr-defined]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Requires Unix sockets.")
+def test_metrics_endpoint(tmp_path: Path) -> None:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+
+    with metrics.serve(str(tmp_path)):
+        metrics.configure({"api": {"metrics": {"host": "127.0.0.1", "port": port}}})
+        assert metrics.SOCKET_ENV in os.environ
+
+        metrics.CERTBOT_DURATION.observe(12, operation="certonly")
+        metrics.CERTIFICATE_NOT_AFTER.set(1700000000, lineage="test.example.net")
+
+        # Measures made by a child process are reported to the daemon.
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-c",
+                "from dnsrobocert.core import metrics; "
+                "metrics.PROPAGATION_DURATION.observe(20, profile='child')",
+            ]
+        )
+
+        deadline = time.monotonic() + 5
+        while True:
+            with urllib.request.urlopen(f"{url}/metrics") as response:
+                assert response.headers["Content-Type"].startswith("text/plain")
+                body = response.read().decode("utf-8")
+            if (
+                'dnsrobocert_propagation_duration_seconds_count{profile="child"} 1'
+                in body
+            ):
+                break
+            assert time.monotonic() < deadline
+            time.sleep(0.1)
+
+        assert "# TYPE dnsrobocert_certbot_duration_seconds histogram" in body
+        assert (
+            'dnsrobocert_certbot_duration_seconds_bucket{operation="certonly",le="10.0"} 0'
+            in body
+        )
+        assert (
+            'dnsrobocert_certbot_duration_seconds_bucket{operation="certonly",le="30.0"} 1'
+            in body
+        )
+        assert (
+            'dnsrobocert_certbot_duration_seconds_sum{operation="certonly"} 12' in body
+        )
+        assert (
+            'dnsrobocert_certificate_not_after_timestamp_seconds{lineage="test.example.net"} 1700000000'
+            in body
+        )
+
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+
+    assert metrics.SOCKET_ENV not in os.environ
+    with pytest.raises(urllib.error.URLError):
+        urllib.request.urlopen(f"{url}/metrics")
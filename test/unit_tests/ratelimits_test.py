@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from pathlib import Path
+from unittest.mock import patch
+
+from dnsrobocert.core import ratelimits, state
+
+_CONFIG = {
+    "acme": {
+        "directory_url": "https://acme.example.com/directory",
+        "rate_limits": {
+            "orders_per_account": 4,
+            "certificates_per_domain": 2,
+            "duplicate_certificates": 0,
+        },
+    }
+}
+
+
+def test_budget(tmp_path: Path) -> None:
+    store = state.open_store(str(tmp_path))
+
+    with (
+        patch("dnsrobocert.core.state.time.time", return_value=1000),
+        patch("dnsrobocert.core.ratelimits.time.time", return_value=1000),
+    ):
+        budget = ratelimits.Budget(_CONFIG, store)
+        # The default limits are the ones of Let's Encrypt production servers.
+        assert budget.limits["failed_validations"] == 0
+
+        assert not budget.reserve("a", ["a.example.com"], False)
+        assert not budget.reserve("b", ["*.b.example.com"], False)
+        # Orders in progress count against the limits.
+        assert budget.reserve("c", ["c.example.com"], False) == {
+            "certificates_per_domain": 1000 + 7 * 86400
+        }
+        # Renewals are not limited by the number of certificates per registered domain.
+        assert not budget.reserve("c", ["c.example.com"], True)
+        assert not budget.reserve("d", ["d.example.co.uk"], False)
+        budget.complete("a", True)
+        budget.complete("b", False)
+        budget.complete("c", True)
+        budget.complete("d", True)
+
+        # The orders are recorded, failed orders do not count as issued certificates.
+        budget = ratelimits.Budget(_CONFIG, store)
+        assert budget.reserve("e", ["e.example.net"], False) == {
+            "orders_per_account": 1000 + 3 * 3600,
+        }
+        assert budget.reserve("e", ["e.example.com"], False) == {
+            "orders_per_account": 1000 + 3 * 3600,
+            "certificates_per_domain": 1000 + 7 * 86400,
+        }
+
+    # Budget is available again once the orders leave the windows of the limits.
+    with patch("dnsrobocert.core.ratelimits.time.time", return_value=1000 + 3 * 3600):
+        budget = ratelimits.Budget(_CONFIG, store)
+        assert not budget.reserve("e", ["e.example.net"], False)
+        assert budget.reserve("f", ["f.example.com"], False) == {
+            "certificates_per_domain": 1000 + 7 * 86400
+        }
+
+
+def test_failed_validations(tmp_path: Path) -> None:
+    store = state.open_store(str(tmp_path))
+    config = {"acme": {"rate_limits": {"failed_validations": 3}}}
+    budget = ratelimits.Budget(config, store)
+
+    for _ in range(3):
+        assert not budget.reserve("a", ["a.example.com", "b.example.com"], False)
+        budget.complete("a", False)
+
+    assert budget.limits["orders_per_account"] == 300
+    exceeded = budget.reserve("b", ["B.example.com"], False)
+    assert list(exceeded) == ["failed_validations"]
+    assert not budget.reserve("c", ["c.example.com"], False)
+
+    # Orders are accounted per account (ACME directory).
+    assert not ratelimits.Budget(_CONFIG, store).reserve("b", ["b.example.com"], False)
+    orders = store.orders(0)
+    assert {order.account for order in orders} == {
+        "https://acme-v02.api.letsencrypt.org/directory"
+    }
+    assert orders[0].names == {"a.example.com", "b.example.com"}
+    assert orders[0].registered_domains == {"example.com"}
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from unittest.mock import patch
+
+from dnsrobocert.core import state
+
+
+def test_state_store(tmp_path: Path) -> None:
+    store = state.open_store(str(tmp_path))
+    assert store.get("test.example.com") is None
+
+    with patch("dnsrobocert.core.state.time.time", return_value=1000):
+        store.start_attempt("test.example.com")
+        store.record_phase("test.example.com", "auth")
+        store.record_phase("test.example.com", "cleanup")
+        store.record_failure("test.example.com", "Auth hook failed.", 35.5, "digest")
+
+    lineage_state = store.get("test.example.com")
+    assert lineage_state == state.LineageState(
+        lineage="test.example.com",
+        last_attempt=1000,
+        last_success=None,
+        consecutive_failures=1,
+        last_error_phase="auth",
+        last_error="Auth hook failed.",
+        last_duration=35.5,
+        config_digest="digest",
+    )
+    assert store.backoff_until("test.example.com", "digest") == 1000 + 300
+    assert store.backoff_until("test.example.com", "other") == 0
+
+    # Backoff is doubled after each failure, up to a maximum.
+    for _ in range(20):
+        store.start_attempt("test.example.com")
+        store.record_failure("test.example.com", "Error", 1, "digest")
+    lineage_state = store.get("test.example.com")
+    assert lineage_state
+    assert lineage_state.consecutive_failures == 21
+    assert lineage_state.last_error_phase == "certbot"
+    assert lineage_state.next_attempt() == lineage_state.last_attempt + 86400
+
+    store.start_attempt("test.example.com")
+    store.record_success("test.example.com", 10, "digest")
+    lineage_state = store.get("test.example.com")
+    assert lineage_state
+    assert lineage_state.consecutive_failures == 0
+    assert lineage_state.last_success
+    assert lineage_state.next_attempt() == 0
+
+    # The state survives a restart, and can be read by any SQLite client.
+    assert [lineage.lineage for lineage in state.open_store(str(tmp_path)).all()] == [
+        "test.example.com"
+    ]
+    with sqlite3.connect(tmp_path / "dnsrobocert" / "state.db") as connection:
+        assert connection.execute("SELECT COUNT(*) FROM lineages").fetchone() == (1,)
+
+
+def test_config_digest() -> None:
+    dnsrobocert_config = {
+        "profiles": [{"name": "dummy", "provider": "dummy"}],
+        "certificates": [{"domains": ["test.example.com"], "profile": "dummy"}],
+    }
+    certificate = dnsrobocert_config["certificates"][0]
+    digest = state.config_digest(dnsrobocert_config, certificate)
+
+    assert state.config_digest(dnsrobocert_config, certificate) == digest
+    dnsrobocert_config["profiles"][0]["provider_options"] = {"auth_token": "NEW"}
+    assert state.config_digest(dnsrobocert_config, certificate) != digest
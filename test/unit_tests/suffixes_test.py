@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from dnsrobocert.core import suffixes
+
+
+def test_extract(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv(suffixes.SUFFIX_LIST_ENV, raising=False)
+    assert suffixes.extract("_acme-challenge.sub.example.co.uk.") == "example.co.uk"
+    assert suffixes.extractor(None) is suffixes.extractor(None)
+
+    # A missing refreshed list falls back to the snapshot.
+    monkeypatch.setenv(suffixes.SUFFIX_LIST_ENV, str(tmp_path / "missing.dat"))
+    assert suffixes.extract("_acme-challenge.sub.example.com.") == "example.com"
+
+    suffix_list_path = tmp_path / "public_suffix_list.dat"
+    suffix_list_path.write_text("// ===BEGIN ICANN DOMAINS===\nexample.com\n")
+    monkeypatch.setenv(suffixes.SUFFIX_LIST_ENV, str(suffix_list_path))
+    assert suffixes.extract("_acme-challenge.sub.example.com.") == "sub.example.com"
+
+
+def test_refresh(tmp_path: Path) -> None:
+    source_path = tmp_path / "source.dat"
+    source_path.write_text("// ===BEGIN ICANN DOMAINS===\ncom\n")
+    suffix_list_path = str(tmp_path / "dnsrobocert" / "public_suffix_list.dat")
+
+    assert suffixes.refresh(suffix_list_path, source_path.as_uri())
+    with open(suffix_list_path) as file_h:
+        assert file_h.read() == "// ===BEGIN ICANN DOMAINS===\ncom\n"
+
+    # The list is downloaded again only when it is outdated.
+    assert not suffixes.refresh(suffix_list_path, source_path.as_uri())
+    outdated = time.time() - suffixes.REFRESH_INTERVAL - 1
+    os.utime(suffix_list_path, (outdated, outdated))
+    assert suffixes.refresh(suffix_list_path, source_path.as_uri())
+
+    source_path.write_text("<html>Not found</html>")
+    with pytest.raises(RuntimeError, match="Invalid Public Suffix List"):
+        suffixes.refresh(suffix_list_path, source_path.as_uri(), max_age=0)
+    assert os.listdir(tmp_path / "dnsrobocert") == ["public_suffix_list.dat"]
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from dnsrobocert.core import tracing
+
+
+def _spans(path: Path) -> dict[str, dict[str, Any]]:
+    spans = {}
+    for line in path.read_text().splitlines():
+        for resource_spans in json.loads(line)["resourceSpans"]:
+            for scope_spans in resource_spans["scopeSpans"]:
+                for span in scope_spans["spans"]:
+                    spans[span["name"]] = span
+    return spans
+
+
+def test_spans_across_processes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    trace_path = tmp_path / "spans.jsonl"
+    monkeypatch.delenv(tracing.FILE_ENV, raising=False)
+    monkeypatch.delenv(tracing.TRACEPARENT_ENV, raising=False)
+
+    # Tracing is disabled by default.
+    with tracing.span("disabled"):
+        assert tracing.inject({"KEY": "VALUE"}) == {"KEY": "VALUE"}
+
+    tracing.configure({"api": {"tracing": {"file": str(trace_path)}}})
+    try:
+        with tracing.span("root", lineage="test.example.net"):
+            with tracing.span("child"):
+                env = tracing.inject(None)
+                assert env
+                subprocess.check_call(
+                    [
+                        sys.executable,
+                        "-c",
+                        "from dnsrobocert.core import tracing\n"
+                        "with tracing.span('subprocess'): pass",
+                    ],
+                    env=env,
+                )
+            with pytest.raises(RuntimeError):
+                with tracing.span("failure"):
+                    raise RuntimeError("Failure")
+    finally:
+        tracing.configure({})
+
+    spans = _spans(trace_path)
+    assert sorted(spans) == ["child", "failure", "root", "subprocess"]
+    assert len({span["traceId"] for span in spans.values()}) == 1
+    assert "parentSpanId" not in spans["root"]
+    assert spans["child"]["parentSpanId"] == spans["root"]["spanId"]
+    assert spans["failure"]["parentSpanId"] == spans["root"]["spanId"]
+    assert spans["subprocess"]["parentSpanId"] == spans["child"]["spanId"]
+    assert spans["root"]["attributes"] == [
+        {"key": "lineage", "value": {"stringValue": "test.example.net"}}
+    ]
+    assert spans["failure"]["status"] == {"code": 2, "message": "Failure"}
+    assert int(spans["root"]["endTimeUnixNano"]) >= int(
+        spans["subprocess"]["endTimeUnixNano"]
+    )
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from dnsrobocert.core import utils
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Requires POSIX modes.")
+def test_configure_certbot_workspace(tmp_path: Path) -> None:
+    archive_path = tmp_path / "archive" / "test.example.com"
+    os.makedirs(archive_path)
+    (archive_path / "cert1.pem").write_text("cert1")
+    os.chmod(archive_path / "cert1.pem", 0o600)
+
+    dnsrobocert_config = {"acme": {"certs_permissions": {"files_mode": 0o644}}}
+    utils.configure_certbot_workspace(dnsrobocert_config, str(tmp_path))
+
+    assert os.stat(archive_path / "cert1.pem").st_mode & 0o777 == 0o644
+    assert os.stat(archive_path).st_mode & 0o777 == 0o750
+    assert os.path.exists(tmp_path / "dnsrobocert" / "permissions.json")
+
+    # Files of unchanged directories are not checked again, and files with the
+    # expected permissions are not modified.
+    with patch("dnsrobocert.core.utils.os.chmod") as chmod:
+        utils.configure_certbot_workspace(dnsrobocert_config, str(tmp_path))
+        chmod.assert_not_called()
+
+    # A new file in a directory triggers the check of this directory.
+    (archive_path / "cert2.pem").write_text("cert2")
+    os.chmod(archive_path / "cert2.pem", 0o600)
+    with patch("dnsrobocert.core.utils.os.chmod", wraps=os.chmod) as chmod:
+        utils.configure_certbot_workspace(dnsrobocert_config, str(tmp_path))
+        assert [call.args[0] for call in chmod.call_args_list] == [
+            str(archive_path / "cert2.pem")
+        ]
+
+    # Changed settings trigger the check of all files.
+    dnsrobocert_config["acme"]["certs_permissions"]["files_mode"] = 0o640
+    utils.configure_certbot_workspace(dnsrobocert_config, str(tmp_path))
+    assert os.stat(archive_path / "cert1.pem").st_mode & 0o777 == 0o640
+    assert os.stat(archive_path / "cert2.pem").st_mode & 0o777 == 0o640
+
+
+def test_atomic_write(tmp_path: Path) -> None:
+    path = tmp_path / "state.json"
+    utils.atomic_write(str(path), b"{}")
+    assert path.read_bytes() == b"{}"
+
+    # The current file is kept, and the temporary file is removed, if the write fails.
+    with patch("dnsrobocert.core.utils.os.replace", side_effect=OSError("failure")):
+        with pytest.raises(OSError):
+            utils.atomic_write(str(path), b"[]")
+    assert path.read_bytes() == b"{}"
+    assert os.listdir(tmp_path) == ["state.json"]
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from dnsrobocert.core import watcher
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_watch_file(tmp_path: Path, use_inotify: bool) -> None:
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("draft: true\n")
+
+    config_watcher = watcher.ConfigWatcher(
+        [str(config_path), str(tmp_path / "missing" / "domains.conf")],
+        debounce=0.1,
+        poll_interval=0.05,
+        use_inotify=use_inotify,
+    )
+    try:
+        assert not config_watcher.wait(0.2)
+
+        # A file written in several steps is reported once.
+        def write() -> None:
+            with open(config_path, "w") as file_h:
+                file_h.write("draft: false\n")
+                file_h.flush()
+                file_h.write("acme: {}\n")
+
+        thread = threading.Timer(0.05, write)
+        thread.start()
+        assert config_watcher.wait(2)
+        thread.join()
+        assert not config_watcher.wait(0.2)
+
+        # Changes on unrelated files of the directory are ignored.
+        (tmp_path / "other.yml").write_text("other")
+        assert not config_watcher.wait(0.2)
+    finally:
+        config_watcher.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Requires inotify.")
+def test_watch_configmap(tmp_path: Path) -> None:
+    # Layout of a Kubernetes ConfigMap mounted as a volume.
+    os.mkdir(tmp_path / "..v1")
+    (tmp_path / "..v1" / "config.yml").write_text("draft: true\n")
+    os.symlink("..v1", tmp_path / "..data")
+    os.symlink("..data/config.yml", tmp_path / "config.yml")
+
+    config_watcher = watcher.ConfigWatcher([str(tmp_path / "config.yml")], debounce=0.1)
+    try:
+        assert not config_watcher.wait(0.2)
+
+        os.mkdir(tmp_path / "..v2")
+        (tmp_path / "..v2" / "config.yml").write_text("draft: false\n")
+        os.symlink("..v2", tmp_path / "..data_tmp")
+        os.replace(tmp_path / "..data_tmp", tmp_path / "..data")
+
+        assert config_watcher.wait(2)
+
+        # The new target directory is now watched, and the previous one is not anymore.
+        assert _kernel_watches(config_watcher) == 2
+        assert str(tmp_path / "..v1") not in config_watcher._watched
+        (tmp_path / "..v2" / "config.yml").write_text("draft: true\n")
+        assert config_watcher.wait(2)
+
+        # Without events, the files are not inspected until the timeout expires.
+        with patch.object(config_watcher, "_current_signature") as signature:
+            assert not config_watcher.wait(0.2)
+        signature.assert_not_called()
+    finally:
+        config_watcher.close()
+
+
+def _kernel_watches(config_watcher: watcher.ConfigWatcher) -> int:
+    with open(f"/proc/self/fdinfo/{config_watcher._fd}") as file_h:
+        return sum(1 for line in file_h if line.startswith("inotify wd:"))
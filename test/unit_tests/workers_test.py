@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import subprocess
+from collections.abc import Iterator
+
+import pytest
+
+from dnsrobocert.core import workers
+
+pytestmark = pytest.mark.skipif(
+    not workers.supported(), reason="Certbot workers require the forkserver method."
+)
+
+
+@pytest.fixture(autouse=True)
+def pool() -> Iterator[None]:
+    yield
+    workers.shutdown()
+
+
+def test_worker_execution(caplog: pytest.LogCaptureFixture) -> None:
+    workers.execute(["--version"], 1)
+    workers.execute(["--version"], 1)
+
+    assert caplog.text.count("with exit code 0") == 2
+
+
+def test_worker_error_isolation() -> None:
+    with pytest.raises(subprocess.CalledProcessError) as raised:
+        workers.execute(["--not-a-certbot-flag"], 1)
+
+    assert raised.value.returncode == 2
+
+    # The worker survived the failing call and can serve other calls.
+    workers.execute(["--not-a-certbot-flag"], 1, check=False)
+    workers.execute(["--version"], 1)